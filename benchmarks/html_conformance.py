@@ -0,0 +1,65 @@
+"""
+Checks that every HTML-to-text engine produces the same output as the original
+BeautifulSoup engine on the receipt corpus in benchmarks/html_corpus/.
+
+Usage:
+    python benchmarks/html_conformance.py [extra_dir_with_html_files ...]
+
+Exits with status 1 if any engine disagrees with the reference on any document.
+"""
+import difflib
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from transaction_categorizer.sub_agents.gmail_agent.gmail_tool import is_text_clearly_a_url
+from transaction_categorizer.sub_agents.gmail_agent.html_text import HTML_ENGINES
+
+CORPUS_DIR = Path(__file__).resolve().parent / "html_corpus"
+REFERENCE_ENGINE = "bs4"
+
+
+def _available_engines():
+    engines = dict(HTML_ENGINES)
+    try:
+        import lxml.html  # noqa: F401
+    except ImportError:
+        print("lxml is not installed; skipping the 'lxml' engine.")
+        engines.pop("lxml")
+    return engines
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    corpus_dirs = [CORPUS_DIR] + [Path(arg) for arg in argv]
+    documents = sorted(path for corpus_dir in corpus_dirs for path in corpus_dir.glob("*.html"))
+    engines = _available_engines()
+    reference = engines[REFERENCE_ENGINE]
+
+    failures = 0
+    for path in documents:
+        html = path.read_text(encoding="utf-8", errors="replace")
+        expected = reference(html, is_text_clearly_a_url)
+        for name, engine in engines.items():
+            if name == REFERENCE_ENGINE:
+                continue
+            actual = engine(html, is_text_clearly_a_url)
+            if actual == expected:
+                print(f"OK    {name:<7} {path.name}")
+                continue
+            failures += 1
+            print(f"FAIL  {name:<7} {path.name}")
+            diff = difflib.unified_diff(
+                expected.splitlines(), actual.splitlines(),
+                fromfile=REFERENCE_ENGINE, tofile=name, lineterm="",
+            )
+            for line in list(diff)[:40]:
+                print(f"      {line}")
+
+    print(f"\n{len(documents)} documents, {len(engines) - 1} engines compared, {failures} mismatches.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Compares the two Gmail lookup modes of the categorizer: "agent" (the nested
+gmail_agent behind an AgentTool) and "direct" (one function tool returning receipt
+records). Every transaction is run through a fresh session in each mode, with the
+merchant rules and the memo turned off, and the model calls (per agent) and wall-clock
+time are recorded.
+
+Usage:
+    python benchmarks/lookup_modes.py [statement_file] [--modes direct,agent] [--json out.json]
+
+The statement file holds one statement row per line, as pasted into the chat. Without
+one, a few sample rows are used. Needs the same model and Gmail credentials as the agent.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+
+from transaction_categorizer.agent import GMAIL_LOOKUP_MODES, build_root_agent
+from transaction_categorizer.sub_agents.gmail_agent.agent import gmail_agent
+from transaction_categorizer.transactions import format_transaction_message, parse_transaction_message
+
+APP_NAME = "lookup_mode_benchmark"
+USER_ID = "benchmark"
+SAMPLE_ROWS = [
+    "2025-03-11\t5484654361\tEASYPARK    /25-03-11\t-34,50\t23 035,62",
+    "2025-03-19\t5484689546\tBARBER & BOO/25-03-18\t-964,00\t22 100,62",
+    "2025-03-20\t5484690001\tK*BOKUS.COM\t-249,00\t21 851,62",
+]
+
+
+class _ModelCallCounter:
+    """before_model_callback that counts model calls per agent name."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def __call__(self, callback_context, llm_request):
+        self.calls[callback_context.agent_name] += 1
+        return None
+
+
+async def _run_mode(lookup_mode, messages):
+    counter = _ModelCallCounter()
+    root = build_root_agent(lookup_mode, shortcuts=False)
+    # Counted in front of the agents' own callbacks (the metrics' model turn counter among them).
+    root.before_model_callback = [counter, *root.canonical_before_model_callbacks]
+    gmail_callback = gmail_agent.before_model_callback
+    gmail_agent.before_model_callback = [counter, *gmail_agent.canonical_before_model_callbacks]
+    runner = InMemoryRunner(agent=root, app_name=APP_NAME)
+    rows = []
+    try:
+        for message in messages:
+            counter.calls.clear()
+            session = await runner.session_service.create_session(app_name=APP_NAME, user_id=USER_ID)
+            started = time.perf_counter()
+            final_text = ""
+            async for event in runner.run_async(
+                user_id=USER_ID,
+                session_id=session.id,
+                new_message=types.Content(role="user", parts=[types.Part(text=message)]),
+            ):
+                if event.author == root.name and event.content and event.content.parts:
+                    final_text = "".join(part.text or "" for part in event.content.parts) or final_text
+            rows.append({
+                "message": message,
+                "seconds": round(time.perf_counter() - started, 3),
+                "model_calls": sum(counter.calls.values()),
+                "model_calls_by_agent": dict(counter.calls),
+                "answer": final_text,
+            })
+    finally:
+        gmail_agent.before_model_callback = gmail_callback
+    return rows
+
+
+def _summary(rows):
+    seconds = [row["seconds"] for row in rows]
+    calls = [row["model_calls"] for row in rows]
+    return {
+        "transactions": len(rows),
+        "mean_model_calls": round(statistics.mean(calls), 2) if calls else 0.0,
+        "mean_seconds": round(statistics.mean(seconds), 3) if seconds else 0.0,
+        "p50_seconds": round(statistics.median(seconds), 3) if seconds else 0.0,
+        "max_seconds": max(seconds, default=0.0),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare model calls and latency of the Gmail lookup modes.")
+    parser.add_argument("statement", nargs="?", help="File with one statement row per line.")
+    parser.add_argument("--modes", default=",".join(GMAIL_LOOKUP_MODES))
+    parser.add_argument("--json", help="Also write the per-transaction results here.")
+    args = parser.parse_args(argv)
+
+    lines = Path(args.statement).read_text(encoding="utf-8").splitlines() if args.statement else SAMPLE_ROWS
+    messages = [
+        format_transaction_message(transaction)
+        for transaction in map(parse_transaction_message, lines) if transaction is not None
+    ]
+    results = {}
+    for lookup_mode in args.modes.split(","):
+        print(f"Running {len(messages)} transactions in '{lookup_mode}' mode...")
+        rows = asyncio.run(_run_mode(lookup_mode, messages))
+        results[lookup_mode] = {"summary": _summary(rows), "rows": rows}
+
+    print(f"\n{'mode':<8} {'txns':>5} {'model calls/txn':>16} {'mean s':>8} {'p50 s':>8} {'max s':>8}")
+    for lookup_mode, result in results.items():
+        summary = result["summary"]
+        print(f"{lookup_mode:<8} {summary['transactions']:>5} {summary['mean_model_calls']:>16} "
+              f"{summary['mean_seconds']:>8} {summary['p50_seconds']:>8} {summary['max_seconds']:>8}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
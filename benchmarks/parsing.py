@@ -0,0 +1,327 @@
+"""
+Microbenchmarks for the pure parsing functions on the Gmail tool's hot path:
+extract_email_body, _find_best_text_in_parts, _decode_email_part_data and
+is_text_clearly_a_url.
+
+The corpus is made of Gmail API format='full' message resources built from the
+anonymized documents in benchmarks/html_corpus/: a small plain-text receipt, HTML
+receipts with a plain-text alternative, a huge HTML newsletter, a deeply nested
+multipart message and messages with images only. It is generated the same way on
+every run; exported messages (one format='full' resource per *.json file) can be
+added with --corpus.
+
+For every function and message the benchmark reports the time per call (min, median
+and p95 over repeated calls), the throughput in MB/s of base64 text part data and the
+peak memory allocated during one call (tracemalloc, measured in a separate pass).
+
+Usage:
+    python benchmarks/parsing.py [--corpus dir] [--min_time 0.2] [--json out.json]
+                                 [--compare previous.json] [--dump dir]
+
+Results are written as JSON (default: benchmarks/results/parsing-<UTC time>.json);
+with --compare the medians are set against an earlier results file.
+"""
+import argparse
+import base64
+import datetime
+import gc
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from transaction_categorizer.sub_agents.gmail_agent.config import GMAIL_HTML_ENGINE
+from transaction_categorizer.sub_agents.gmail_agent.gmail_tool import (
+    _decode_email_part_data,
+    _find_best_text_in_parts,
+    extract_email_body,
+    is_text_clearly_a_url,
+)
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+HTML_CORPUS_DIR = BENCHMARK_DIR / "html_corpus"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+PLAIN_RECEIPT = """Tack för ditt köp!
+
+Kvitto nr 0042-118734
+Datum: 2025-03-19 14:02
+
+Klippning herr            1 x 850,00
+Skäggtrim                 1 x 114,00
+-----------------------------------
+Totalt                        964,00 SEK
+varav moms 25 %               192,80 SEK
+
+Betalt med Mastercard ****1234
+Välkommen åter!
+Barberaren AB, Storgatan 1, 111 22 Stockholm
+"""
+
+# Anchors of the kind is_text_clearly_a_url sees: (link text, href).
+_ANCHOR_PATTERN = re.compile(r'<a\b[^>]*href="([^"]*)"[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _text_part(mime_type, text):
+    data = _b64(text)
+    return {"mimeType": mime_type, "headers": [{"name": "Content-Type", "value": f"{mime_type}; charset=utf-8"}],
+            "body": {"size": len(text.encode("utf-8")), "data": data}}
+
+
+def _image_part(index, inline_bytes=0):
+    part = {"mimeType": "image/png", "filename": f"image{index}.png",
+            "headers": [{"name": "Content-ID", "value": f"<image{index}@example.invalid>"}]}
+    if inline_bytes:
+        payload = bytes((index * 31 + i) % 251 for i in range(inline_bytes))
+        part["body"] = {"size": inline_bytes, "data": base64.urlsafe_b64encode(payload).decode("ascii")}
+    else:
+        part["body"] = {"size": 48213, "attachmentId": f"ANGjdJ-attachment-{index}"}
+    return part
+
+
+def _multipart(mime_type, parts):
+    return {"mimeType": mime_type, "body": {"size": 0}, "parts": parts}
+
+
+def _message(message_id, subject, payload):
+    payload = dict(payload)
+    payload["headers"] = [
+        {"name": "From", "value": "Example Store <noreply@example.invalid>"},
+        {"name": "To", "value": "someone@example.invalid"},
+        {"name": "Subject", "value": subject},
+        {"name": "Date", "value": "Wed, 19 Mar 2025 14:02:11 +0100"},
+    ] + payload.get("headers", [])
+    return {"id": message_id, "threadId": message_id, "labelIds": ["INBOX"], "snippet": subject, "payload": payload}
+
+
+def _html_text(html):
+    return "\n".join(line.strip() for line in _TAG_PATTERN.sub("", html).splitlines() if line.strip())
+
+
+def _huge_newsletter(html, target_bytes):
+    """The newsletter with its product rows repeated until the document is about target_bytes."""
+    rows = re.findall(r'<tr>\s*<td class="col".*?</tr>', html, re.DOTALL)
+    block = "\n".join(rows)
+    repeats = max(1, target_bytes // max(len(block), 1))
+    insert_at = html.index(rows[-1]) + len(rows[-1])
+    return html[:insert_at] + ("\n" + block) * repeats + html[insert_at:]
+
+
+def _nested(depth, leaf_parts):
+    """multipart/mixed > related > alternative ... `depth` levels deep, with attachments beside every level."""
+    node = _multipart("multipart/alternative", leaf_parts)
+    for level in range(depth):
+        kind = ("multipart/related", "multipart/mixed", "multipart/alternative")[level % 3]
+        node = _multipart(kind, [_image_part(100 + level), node, _text_part("text/calendar", "BEGIN:VCALENDAR\nEND:VCALENDAR")])
+    return node
+
+
+def build_corpus():
+    """The generated benchmark messages as {name: format='full' message resource}."""
+    html = {path.stem: path.read_text(encoding="utf-8") for path in sorted(HTML_CORPUS_DIR.glob("*.html"))}
+    corpus = {
+        "plain_receipt": _message("m-plain", "Ditt kvitto", _text_part("text/plain", PLAIN_RECEIPT)),
+    }
+    for name in ("amazon_order", "apple_receipt", "sas_booking"):
+        if name in html:
+            corpus[f"html_{name}"] = _message(f"m-{name}", name, _multipart("multipart/alternative", [
+                _text_part("text/plain", _html_text(html[name])), _text_part("text/html", html[name]),
+            ]))
+    if "newsletter" in html:
+        big = _huge_newsletter(html["newsletter"], 1_000_000)
+        corpus["huge_newsletter"] = _message("m-newsletter", "Veckans erbjudanden", _multipart("multipart/alternative", [
+            _text_part("text/plain", _html_text(big)), _text_part("text/html", big),
+        ]))
+    receipt_html = html.get("apple_receipt", "<p>" + PLAIN_RECEIPT + "</p>")
+    corpus["nested_multipart"] = _message("m-nested", "Bokningsbekräftelse", _nested(24, [
+        _text_part("text/plain", PLAIN_RECEIPT), _text_part("text/html", receipt_html),
+    ]))
+    corpus["images_only"] = _message("m-images", "Foton", _multipart(
+        "multipart/mixed", [_image_part(index) for index in range(12)]
+    ))
+    corpus["inline_images_only"] = _message("m-inline", "Skärmdump", _multipart(
+        "multipart/related", [_image_part(index, inline_bytes=200_000) for index in range(3)]
+    ))
+    return corpus
+
+
+def load_corpus_dir(directory):
+    """Exported messages: one format='full' message resource per *.json file."""
+    return {f"file_{path.stem}": json.loads(path.read_text(encoding="utf-8")) for path in sorted(Path(directory).glob("*.json"))}
+
+
+def _walk_parts(payload):
+    yield payload
+    for part in payload.get("parts", []):
+        yield from _walk_parts(part)
+
+
+def _text_bytes(payload):
+    """Base64 data of the text parts: what the body extraction actually decodes."""
+    return sum(len(part.get("body", {}).get("data", "")) for part in _walk_parts(payload)
+               if part.get("mimeType", "").lower() in ("text/plain", "text/html"))
+
+
+def _anchors(payload):
+    anchors = []
+    for part in _walk_parts(payload):
+        data = part.get("body", {}).get("data")
+        if part.get("mimeType") == "text/html" and data:
+            text = base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+            anchors.extend((_TAG_PATTERN.sub("", inner).strip(), href) for href, inner in _ANCHOR_PATTERN.findall(text))
+    return anchors
+
+
+def _cases(corpus):
+    """(function name, message name, bytes, callable) for every benchmarked call."""
+    cases = []
+    for name, message in corpus.items():
+        payload = message.get("payload") or {}
+        size = _text_bytes(payload)
+        cases.append(("extract_email_body", name, size, lambda payload=payload: extract_email_body(payload)))
+        if "parts" in payload:
+            cases.append(("_find_best_text_in_parts", name, size,
+                          lambda parts=payload["parts"]: _find_best_text_in_parts(parts)))
+        text_parts = [part for part in _walk_parts(payload)
+                      if part.get("mimeType") in ("text/plain", "text/html") and part.get("body", {}).get("data")]
+        for part in text_parts:
+            data, mime_type = part["body"]["data"], part["mimeType"]
+            cases.append((f"_decode_email_part_data[{mime_type}]", name, len(data),
+                          lambda data=data, mime_type=mime_type: _decode_email_part_data(data, mime_type)))
+        anchors = _anchors(payload)
+        if anchors:
+            size = sum(len(text) + len(href) for text, href in anchors)
+            cases.append((f"is_text_clearly_a_url[x{len(anchors)}]", name, size,
+                          lambda anchors=anchors: [is_text_clearly_a_url(text, href) for text, href in anchors]))
+    return cases
+
+
+def _time_call(function, min_time, min_runs):
+    """Per-call times (seconds) from repeated calls for at least min_time seconds and min_runs calls."""
+    function()  # Warm-up: imports, regex compilation, caches.
+    times = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # As timeit does, so collections do not land in random calls.
+    try:
+        started = time.perf_counter()
+        while len(times) < min_runs or time.perf_counter() - started < min_time:
+            call_started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - call_started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return times
+
+
+def _peak_bytes(function):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        function()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(corpus, min_time, min_runs, only=None):
+    results = []
+    for function_name, message_name, size, function in _cases(corpus):
+        if only and only not in function_name:
+            continue
+        times = sorted(_time_call(function, min_time, min_runs))
+        median = statistics.median(times)
+        results.append({
+            "function": function_name,
+            "message": message_name,
+            "bytes": size,
+            "runs": len(times),
+            "min_ms": round(times[0] * 1000, 4),
+            "median_ms": round(median * 1000, 4),
+            "p95_ms": round(times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))] * 1000, 4),
+            "mb_per_s": round(size / median / 1e6, 2) if median and size else None,
+            "peak_kib": round(_peak_bytes(function) / 1024, 1),
+        })
+    return results
+
+
+def _print_table(results, previous=None):
+    baseline = {(row["function"], row["message"]): row for row in (previous or {}).get("results", [])}
+    header = f"{'function':<36} {'message':<22} {'KiB':>8} {'median ms':>10} {'p95 ms':>9} {'MB/s':>8} {'peak KiB':>9}"
+    print(header + (f" {'vs prev':>8}" if previous else ""))
+    for row in results:
+        line = (f"{row['function']:<36} {row['message']:<22} {row['bytes'] / 1024:>8.1f} {row['median_ms']:>10.3f} "
+                f"{row['p95_ms']:>9.3f} {row['mb_per_s'] if row['mb_per_s'] is not None else '-':>8} {row['peak_kib']:>9.1f}")
+        old = baseline.get((row["function"], row["message"]))
+        if previous:
+            change = f"{(row['median_ms'] / old['median_ms'] - 1) * 100:+.1f}%" if old and old["median_ms"] else "new"
+            line += f" {change:>8}"
+        print(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Gmail tool's email parsing functions.")
+    parser.add_argument("--corpus", action="append", default=[], help="Also benchmark the *.json messages in this directory.")
+    parser.add_argument("--min_time", type=float, default=0.2, help="Seconds to spend timing each case.")
+    parser.add_argument("--min_runs", type=int, default=5)
+    parser.add_argument("--only", help="Only run functions whose name contains this string.")
+    parser.add_argument("--json", help="Write the results here (default: benchmarks/results/parsing-<UTC time>.json).")
+    parser.add_argument("--compare", help="An earlier results file to compare the medians with.")
+    parser.add_argument("--dump", help="Write the generated corpus to this directory (one JSON file per message) and exit.")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus()
+    if args.dump:
+        Path(args.dump).mkdir(parents=True, exist_ok=True)
+        for name, message in corpus.items():
+            (Path(args.dump) / f"{name}.json").write_text(json.dumps(message, indent=1), encoding="utf-8")
+        print(f"Wrote {len(corpus)} messages to {args.dump}.")
+        return 0
+    for directory in args.corpus:
+        corpus.update(load_corpus_dir(directory))
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    results = run(corpus, args.min_time, args.min_runs, args.only)
+    previous = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    _print_table(results, previous)
+
+    report = {
+        "benchmark": "parsing",
+        "started_at": started.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "html_engine": GMAIL_HTML_ENGINE,
+        "min_time": args.min_time,
+        "results": results,
+    }
+    output = Path(args.json) if args.json else RESULTS_DIR / f"parsing-{started:%Y%m%dT%H%M%SZ}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
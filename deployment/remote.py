@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 
@@ -8,6 +9,9 @@ from vertexai import agent_engines
 from vertexai.preview import reasoning_engines
 
 from transaction_categorizer.agent import root_agent
+from transaction_categorizer.batch import categorize_transactions, read_transactions, remote_categorizer
+from transaction_categorizer.remote_client import get_remote_client
+from transaction_categorizer.remote_stream import TextChunk, format_event
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("project_id", None, "GCP project ID.")
@@ -23,11 +27,18 @@ flags.DEFINE_bool("create_session", False, "Creates a new session.")
 flags.DEFINE_bool("list_sessions", False, "Lists all sessions for a user.")
 flags.DEFINE_bool("get_session", False, "Gets a specific session.")
 flags.DEFINE_bool("send", False, "Sends a message to the deployed agent.")
+flags.DEFINE_bool("send_batch", False, "Categorizes every row of --batch_file with the deployed agent.")
+flags.DEFINE_bool("send_many", False, "Sends every line of --batch_file as a message, each in its own session.")
+flags.DEFINE_string("batch_file", None, "Statement file with one transaction per line, for --send_batch/--send_many.")
+flags.DEFINE_integer("concurrency", 4, "Number of rows sent in parallel by --send_batch and --send_many.")
 flags.DEFINE_string(
     "message",
     "2025-03-25	5071901772	WALLEY	-2 536,00",
     "Message to send to the agent.",
 )
+# Passed on to the deployment when set (see the Metrics section of config.py).
+METRICS_ENV_VARS = ("METRICS_SINK", "METRICS_PATH", "METRICS_FLUSH_SECONDS")
+
 flags.mark_bool_flags_as_mutual_exclusive(
     [
         "create",
@@ -37,40 +48,47 @@ flags.mark_bool_flags_as_mutual_exclusive(
         "list_sessions",
         "get_session",
         "send",
+        "send_batch",
+        "send_many",
     ]
 )
 
 
 def create() -> None:
     """Creates a new deployment."""
-    # First wrap the agent in AdkApp
+    # First wrap the agent in AdkApp. With enable_tracing the spans of
+    # transaction_categorizer.instrumentation go to Cloud Trace with the agent's own.
     app = reasoning_engines.AdkApp(
         agent=root_agent,
         enable_tracing=True,
     )
+    # The metrics file sink is only configured remotely when it is configured here.
+    metrics_env = {name: os.environ[name] for name in METRICS_ENV_VARS if os.environ.get(name)}
 
     # Now deploy to Agent Engine
     remote_app = agent_engines.create(
         agent_engine=app,
         requirements=[
             "google-cloud-aiplatform[adk,agent_engines]",
+            "google-adk>=1.0.0",
             "beautifulsoup4>=4.12.0",
             "python-dotenv>=1.0.0",
             "pydantic>=2.0.0",
             "google-auth>=2.22.0",
             "google-auth-oauthlib>=1.0.0",
             "google-api-python-client>=2.100.0",
-            "email-validator>=2.0.0"
+            "email-validator>=2.0.0",
+            "numpy>=1.24",
         ],
         extra_packages=["./transaction_categorizer"],
+        env_vars=metrics_env or None,
     )
     print(f"Created remote app: {remote_app.resource_name}")
 
 
 def delete(resource_id: str) -> None:
     """Deletes an existing deployment."""
-    remote_app = agent_engines.get(resource_id)
-    remote_app.delete(force=True)
+    get_remote_client(resource_id).app.delete(force=True)
     print(f"Deleted remote app: {resource_id}")
 
 
@@ -87,8 +105,7 @@ def list_deployments() -> None:
 
 def create_session(resource_id: str, user_id: str) -> None:
     """Creates a new session for the specified user."""
-    remote_app = agent_engines.get(resource_id)
-    remote_session = remote_app.create_session(user_id=user_id)
+    remote_session = get_remote_client(resource_id).create_session(user_id)
     print("Created session:")
     print(f"  Session ID: {remote_session['id']}")
     print(f"  User ID: {remote_session['user_id']}")
@@ -99,8 +116,7 @@ def create_session(resource_id: str, user_id: str) -> None:
 
 def list_sessions(resource_id: str, user_id: str) -> None:
     """Lists all sessions for the specified user."""
-    remote_app = agent_engines.get(resource_id)
-    sessions = remote_app.list_sessions(user_id=user_id)
+    sessions = get_remote_client(resource_id).list_sessions(user_id)
     # --- DEBUG PRINTS ---
     print(f"DEBUG: Type of sessions: {type(sessions)}")
     print(f"DEBUG: Value of sessions: {sessions}")
@@ -116,8 +132,7 @@ def list_sessions(resource_id: str, user_id: str) -> None:
 
 def get_session(resource_id: str, user_id: str, session_id: str) -> None:
     """Gets a specific session."""
-    remote_app = agent_engines.get(resource_id)
-    session = remote_app.get_session(user_id=user_id, session_id=session_id)
+    session = get_remote_client(resource_id).get_session(session_id, user_id)
     print("Session details:")
     print(f"  ID: {session['id']}")
     print(f"  User ID: {session['user_id']}")
@@ -127,17 +142,39 @@ def get_session(resource_id: str, user_id: str, session_id: str) -> None:
 
 def send_message(resource_id: str, user_id: str, session_id: str, message: str) -> None:
     """Sends a message to the deployed agent."""
-    remote_app = agent_engines.get(resource_id)
+    client = get_remote_client(resource_id)
 
     print(f"Sending message to session {session_id}:")
     print(f"Message: {message}")
     print("\nResponse:")
-    for event in remote_app.stream_query(
-        user_id=user_id,
-        session_id=session_id,
-        message=message,
-    ):
-        print(event)
+    for event in client.stream_events(session_id, message, user_id):
+        # Partial deltas are skipped: the turn's closing chunk carries the whole text.
+        if not (isinstance(event, TextChunk) and event.partial):
+            print(format_event(event))
+
+
+def send_batch(resource_id: str, user_id: str, batch_file: str, concurrency: int) -> None:
+    """Categorizes every transaction in a statement file, one session per row."""
+    with open(batch_file, encoding="utf-8") as f:
+        transactions = read_transactions(f.read().splitlines())
+    print(f"Categorizing {len(transactions)} transactions with concurrency {concurrency}...")
+    report = asyncio.run(categorize_transactions(
+        transactions, remote_categorizer(resource_id, user_id), concurrency=concurrency
+    ))
+    for row in report.rows:
+        print(f"{row.transaction.date}\t{row.transaction.description}\t{row.result or row.error}")
+    print(report.stats())
+
+
+def send_many(resource_id: str, user_id: str, batch_file: str, concurrency: int) -> None:
+    """Sends every non-empty line of a file as a message, each in a new session, in parallel."""
+    with open(batch_file, encoding="utf-8") as f:
+        messages = [line.strip() for line in f if line.strip()]
+    print(f"Sending {len(messages)} messages with concurrency {concurrency}...")
+    replies = get_remote_client(resource_id, user_id).send_many(messages, concurrency)
+    for reply in replies:
+        print(f"{reply.message}\t{reply.error or reply.final_text}\t{reply.seconds:.1f}s")
+    print(f"{sum(reply.error is None for reply in replies)}/{len(replies)} succeeded.")
 
 
 def main(argv=None):
@@ -209,9 +246,25 @@ def main(argv=None):
             print("session_id is required for send")
             return
         send_message(FLAGS.resource_id, user_id, FLAGS.session_id, FLAGS.message)
+    elif FLAGS.send_batch:
+        if not FLAGS.resource_id:
+            print("resource_id is required for send_batch")
+            return
+        if not FLAGS.batch_file:
+            print("batch_file is required for send_batch")
+            return
+        send_batch(FLAGS.resource_id, user_id, FLAGS.batch_file, FLAGS.concurrency)
+    elif FLAGS.send_many:
+        if not FLAGS.resource_id:
+            print("resource_id is required for send_many")
+            return
+        if not FLAGS.batch_file:
+            print("batch_file is required for send_many")
+            return
+        send_many(FLAGS.resource_id, user_id, FLAGS.batch_file, FLAGS.concurrency)
     else:
         print(
-            "Please specify one of: --create, --delete, --list, --create_session, --list_sessions, --get_session, or --send"
+            "Please specify one of: --create, --delete, --list, --create_session, --list_sessions, --get_session, --send, --send_batch or --send_many"
         )
 
     
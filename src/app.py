@@ -4,17 +4,17 @@ import sys
 import vertexai
 from absl import app, flags
 from dotenv import load_dotenv
-from vertexai import agent_engines
 from vertexai.preview import reasoning_engines
 
 from transaction_categorizer.agent import root_agent
+from transaction_categorizer.remote_client import get_remote_client
+from transaction_categorizer.remote_stream import FinalAnswer, format_event
 
 load_dotenv()
 
 def create_session(resource_id: str, user_id: str) -> None:
     """Creates a new session for the specified user."""
-    remote_app = agent_engines.get(resource_id)
-    remote_session = remote_app.create_session(user_id=user_id)
+    remote_session = get_remote_client(resource_id).create_session(user_id)
     session_id = remote_session['id']
     print("Created session:")
     print(f"  Session ID: {remote_session['id']}")
@@ -26,8 +26,7 @@ def create_session(resource_id: str, user_id: str) -> None:
 
 def list_sessions(resource_id: str, user_id: str) -> None:
     """Lists all sessions for the specified user."""
-    remote_app = agent_engines.get(resource_id)
-    sessions = remote_app.list_sessions(user_id=user_id)
+    sessions = get_remote_client(resource_id).list_sessions(user_id)
     # --- DEBUG PRINTS ---
     print(f"DEBUG: Type of sessions: {type(sessions)}")
     print(f"DEBUG: Value of sessions: {sessions}")
@@ -43,8 +42,7 @@ def list_sessions(resource_id: str, user_id: str) -> None:
 
 def get_session(resource_id: str, user_id: str, session_id: str) -> None:
     """Gets a specific session."""
-    remote_app = agent_engines.get(resource_id)
-    session = remote_app.get_session(user_id=user_id, session_id=session_id)
+    session = get_remote_client(resource_id).get_session(session_id, user_id)
     print("Session details:")
     print(f"  ID: {session['id']}")
     print(f"  User ID: {session['user_id']}")
@@ -52,20 +50,18 @@ def get_session(resource_id: str, user_id: str, session_id: str) -> None:
     print(f"  Last update time: {session['last_update_time']}")
 
 def send_message(resource_id: str, user_id: str, session_id: str, message: str) -> None:
-    """Sends a message to the deployed agent."""
-    remote_app = agent_engines.get(resource_id)
+    """Sends a message to the deployed agent and returns its parsed answer (None if it gave none)."""
+    client = get_remote_client(resource_id)
 
     print(f"Sending message to session {session_id}:")
     print(f"Message: {message}")
     print("\nResponse:")
-    events = []
-    for event in remote_app.stream_query(
-        user_id=user_id,
-        session_id=session_id,
-        message=message,
-    ):
-        events.append(event)
-    return events
+    answer = None
+    for event in client.stream_events(session_id, message, user_id):
+        print(format_event(event))
+        if isinstance(event, FinalAnswer):
+            answer = event.result
+    return answer
 
 
 if __name__ == "__main__":
@@ -77,6 +73,6 @@ if __name__ == "__main__":
 
     message = " Categorize this: 2025-03-19    5484689546      BARBER & BOO/25-03-18   -964,00 22 100,62"
     message = "Catagorize this: 2025-03-11	5484654361	EASYPARK    /25-03-11	-34,50	23 035,62"
-    events = send_message(resource_id, user_id, session_id, message)
-    print(events)
+    answer = send_message(resource_id, user_id, session_id, message)
+    print(answer)
 
@@ -1,14 +1,34 @@
 from google.adk.agents import Agent
+from google.adk.tools import FunctionTool
 from google.adk.tools.agent_tool import AgentTool
-from .prompt import ROOT_AGENT_INSTRUCTION
+from .prompt import DIRECT_LOOKUP_INSTRUCTION, ROOT_AGENT_INSTRUCTION
 from .config import GEMINI_MODEL_ID
 #from .tools import search_gmail_for_transactions as gmail_search_tool
 #from .tools import gmail_search_tool
 from google.adk.tools import VertexAiSearchTool
 from .sub_agents.gmail_agent.agent import gmail_agent
+from .sub_agents.gmail_agent import gmail_async, gmail_tool
+from .merchant_rules import get_rule_engine
+from .categorization_memo import get_memo, parse_agent_result
+from .history_knn import confident, get_history_index
+from .backend_data import check_result_category, get_backend_data, instruction_with_categories
+from .transactions import parse_transaction_message
+from .instrumentation import (
+    begin_transaction, end_transaction, finish_transaction,
+    record_model_response, record_model_turn, record_tool_output,
+)
+from .token_accounting import account_model_request, account_model_response, begin_token_account, finish_token_account
 from dotenv import load_dotenv
-from .config import GEMINI_MODEL_ID
+from .config import GEMINI_MODEL_ID, GMAIL_LOOKUP_MODE
+from .sub_agents.gmail_agent.config import GMAIL_ASYNC_TOOLS
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+from typing import Optional
 
+import json
 import os
 load_dotenv()
 
@@ -19,14 +39,179 @@ LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
 #     data_store_id=f"{MAIL_DATASTORE_ID}"
 # )
 
-gmail_search_tool = AgentTool(agent=gmail_agent)
+GMAIL_LOOKUP_MODES = ("direct", "agent")
 
 
-root_agent = Agent(
-    name="transaction_categorizer",
-    model=GEMINI_MODEL_ID,
-    description="A helpful financial assistant that categorizes personal transactions into predefined categories for use in a budget spreadsheet. Can search Gmail for transaction details through 'gmail_search_tool'.",
-    instruction=ROOT_AGENT_INSTRUCTION,
-    tools=[gmail_search_tool],
-)
+def build_gmail_lookup_tool(lookup_mode: str):
+    """The root agent's Gmail tool: a plain function tool ("direct") or the nested gmail_agent ("agent")."""
+    if lookup_mode == "agent":
+        return AgentTool(agent=gmail_agent)
+    if lookup_mode == "direct":
+        gmail_tools = gmail_async if GMAIL_ASYNC_TOOLS else gmail_tool
+        return FunctionTool(func=gmail_tools.lookup_transaction_receipts)
+    raise ValueError(f"Unknown GMAIL_LOOKUP_MODE '{lookup_mode}'. Use one of: {', '.join(GMAIL_LOOKUP_MODES)}")
+
+
+gmail_search_tool = build_gmail_lookup_tool(GMAIL_LOOKUP_MODE)
+
+
+def _user_message(callback_context: CallbackContext) -> str:
+    user_content = callback_context.user_content
+    if user_content is None or not user_content.parts:
+        return ""
+    return "".join(part.text or "" for part in user_content.parts)
+
+
+def _result_content(result: dict) -> types.Content:
+    return types.Content(role="model", parts=[types.Part(text=json.dumps(result, ensure_ascii=False))])
+
+
+def _shortcut_answer(result: dict, answered_by: str) -> types.Content:
+    """
+    The answer of a before_agent shortcut; the transaction ends here without a model turn,
+    so after_model's validate_category never sees it and its category is checked here.
+    """
+    snapshot = get_backend_data()
+    checked = check_result_category(result, snapshot) if snapshot is not None else None
+    if checked is not None:
+        print(f"{answered_by} chose category '{result.get('category')}', which is not in BackendData; using {checked['category']}.")
+        result = checked
+    finish_transaction(answered_by)
+    return _result_content(result)
+
+
+def categorize_with_merchant_rules(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Answers transactions from known merchants (see merchant_rules.json) directly,
+    with the same JSON the agent returns. Anything else goes on to the model.
+    """
+    engine = get_rule_engine()
+    if engine is None:
+        return None
+    result = engine.categorize_message(_user_message(callback_context))
+    return _shortcut_answer(result, "merchant_rules") if result else None
+
+
+def categorize_from_memo(callback_context: CallbackContext) -> Optional[types.Content]:
+    """Reuses a confident earlier decision for the same merchant instead of calling the model."""
+    memo = get_memo()
+    transaction = parse_transaction_message(_user_message(callback_context))
+    if memo is None or transaction is None:
+        return None
+    entry = memo.get(transaction.description)
+    return _shortcut_answer(entry.as_result(transaction.description), "memo") if memo.reusable(entry) else None
+
+
+def add_memo_hint(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """Gives the model a one-line hint when the merchant was categorized before, but not confidently."""
+    memo = get_memo()
+    transaction = parse_transaction_message(_user_message(callback_context))
+    if memo is None or transaction is None:
+        return None
+    entry = memo.get(transaction.description)
+    if entry is not None:
+        llm_request.append_instructions([entry.hint()])
+    return None
+
+
+def categorize_from_history(callback_context: CallbackContext) -> Optional[types.Content]:
+    """Uses the nearest categorized rows of the history when they agree confidently."""
+    index = get_history_index()
+    transaction = parse_transaction_message(_user_message(callback_context))
+    if index is None or transaction is None:
+        return None
+    result = index.classify(transaction.description, transaction.amount_ore)
+    return _shortcut_answer(result.as_result(transaction.description), "history") if confident(result) else None
+
+
+def add_history_hint(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """Gives the model the nearest categorized rows of the history as examples."""
+    index = get_history_index()
+    transaction = parse_transaction_message(_user_message(callback_context))
+    if index is None or transaction is None:
+        return None
+    result = index.classify(transaction.description, transaction.amount_ore)
+    if result.neighbours:
+        llm_request.append_instructions([result.hint()])
+    return None
+
+
+def _final_answer(llm_response: LlmResponse) -> Optional[dict]:
+    """The agent's output JSON if this response is the model's final answer (not a tool call)."""
+    content = llm_response.content
+    if llm_response.partial or content is None or not content.parts:
+        return None
+    if any(part.function_call for part in content.parts):
+        return None
+    return parse_agent_result("".join(part.text or "" for part in content.parts))
+
+
+def validate_category(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """Sends answers whose category is not listed in BackendData to MANUAL REVIEW (and keeps them out of the memo)."""
+    snapshot = get_backend_data()
+    result = _final_answer(llm_response) if snapshot is not None else None
+    checked = check_result_category(result, snapshot) if result is not None else None
+    if checked is None:
+        return None
+    print(f"Model chose category '{result.get('category')}', which is not in BackendData; using {checked['category']}.")
+    return LlmResponse(content=_result_content(checked))
+
+
+def record_in_memo(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """Remembers the model's final categorization for the transaction's merchant."""
+    memo = get_memo()
+    if memo is None:
+        return None
+    transaction = parse_transaction_message(_user_message(callback_context))
+    result = _final_answer(llm_response)
+    if transaction is not None and result is not None:
+        memo.record(transaction.description, result)
+    return None
+
+
+def build_instruction_provider(instruction: str):
+    """
+    Instruction provider that lists BackendData's current categories instead of the ones
+    in prompt.py. The instruction is only rebuilt when the category list changes.
+    """
+    def _instruction(context: ReadonlyContext) -> str:
+        snapshot = get_backend_data()
+        return instruction_with_categories(instruction, snapshot.categories) if snapshot is not None else instruction
+    return _instruction
+
+
+def build_root_agent(lookup_mode: str = GMAIL_LOOKUP_MODE, shortcuts: bool = True) -> Agent:
+    """
+    Builds the categorizer agent with the given Gmail lookup mode. With shortcuts=False
+    the merchant rules, the memo and the history kNN are left out, so every transaction
+    reaches the model.
+    """
+    instruction = ROOT_AGENT_INSTRUCTION
+    if lookup_mode == "direct":
+        instruction += DIRECT_LOOKUP_INSTRUCTION
+    return Agent(
+        name="transaction_categorizer",
+        model=GEMINI_MODEL_ID,
+        description="A helpful financial assistant that categorizes personal transactions into predefined categories for use in a budget spreadsheet. Can search Gmail for transaction details through 'gmail_search_tool'.",
+        instruction=build_instruction_provider(instruction),
+        tools=[gmail_search_tool if lookup_mode == GMAIL_LOOKUP_MODE else build_gmail_lookup_tool(lookup_mode)],
+        before_agent_callback=(
+            [begin_transaction, begin_token_account,
+             categorize_with_merchant_rules, categorize_from_memo, categorize_from_history]
+            if shortcuts else [begin_transaction, begin_token_account]
+        ),
+        # Tokens are accounted last, once the hints are part of the instruction.
+        before_model_callback=(
+            [record_model_turn, add_memo_hint, add_history_hint, account_model_request]
+            if shortcuts else [record_model_turn, account_model_request]
+        ),
+        after_model_callback=(
+            [record_model_response, account_model_response, validate_category, record_in_memo]
+            if shortcuts else [record_model_response, account_model_response, validate_category]
+        ),
+        after_tool_callback=record_tool_output,
+        after_agent_callback=[end_transaction, finish_token_account],
+    )
+
 
+root_agent = build_root_agent()
@@ -0,0 +1,108 @@
+import re
+from typing import List, Optional
+
+# Separators used between thousands groups: space, no-break space, narrow no-break space.
+_GROUP_SEPARATORS = " \u00a0\u202f"
+
+# An amount as written in Swedish or English text:
+# "1 049,12", "1049.12", "1.049,12", "1,049.12", "1,049", "-34,50", "149".
+# A comma followed by three digits is a thousands separator, never a two-digit fraction.
+AMOUNT_PATTERN = re.compile(
+    r'(?<![\d,.])-?(?:\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?(?![\d,.])'
+    r'|\d{1,3}(?:[ \u00a0\u202f.]\d{3})+(?:,\d{1,2})?'
+    r'|\d+(?!,\d{3})(?:[,.]\d{1,2})?)(?![\d])'
+)
+# English comma grouping without decimals ("1,049").
+_COMMA_GROUPED_PATTERN = re.compile(r'-?\d{1,3}(?:,\d{3})+')
+# A currency written right after or right before an amount.
+_CURRENCY_AFTER = re.compile(r'\s*(?:kr\b|sek\b|usd\b|eur\b|:-|[$€£])', re.IGNORECASE)
+_GROUP_SPLIT_PATTERN = re.compile(r'[ \u00a0\u202f]')
+_CURRENCY_BEFORE = re.compile(r'(?:\b(?:sek|usd|eur)|[$€£])\s*$', re.IGNORECASE)
+
+
+def parse_amount(text: str) -> Optional[int]:
+    """
+    Parses an amount such as "1 049,12", "-34,50", "1049.12", "1,049.12", "1,049" or "149" into
+    integer öre (cents). Returns None if the text is not a single amount.
+    """
+    cleaned = text.strip()
+    for suffix in ("kr", "sek", ":-"):
+        if cleaned.lower().endswith(suffix):
+            cleaned = cleaned[:-len(suffix)].strip()
+    if not AMOUNT_PATTERN.fullmatch(cleaned):
+        return None
+
+    negative = cleaned.startswith('-')
+    cleaned = cleaned.lstrip('-')
+    for separator in _GROUP_SEPARATORS:
+        cleaned = cleaned.replace(separator, '')
+    if _COMMA_GROUPED_PATTERN.fullmatch(cleaned) or (
+            ',' in cleaned and '.' in cleaned and cleaned.rfind('.') > cleaned.rfind(',')):
+        # English: commas are thousands separators, the dot is the decimal separator.
+        whole, _, fraction = cleaned.replace(',', '').partition('.')
+    elif ',' in cleaned:
+        # Comma is the decimal separator; any dots are thousands separators.
+        whole, _, fraction = cleaned.replace('.', '').partition(',')
+    elif cleaned.count('.') == 1 and len(cleaned.partition('.')[2]) <= 2:
+        whole, _, fraction = cleaned.partition('.')
+    else:
+        whole, fraction = cleaned.replace('.', ''), ''
+    ore = int(whole) * 100 + int(fraction.ljust(2, '0') or 0)
+    return -ore if negative else ore
+
+
+def _has_currency(text: str, start: int, end: int) -> bool:
+    return bool(_CURRENCY_AFTER.match(text, end) or _CURRENCY_BEFORE.search(text, max(0, start - 4), start))
+
+
+def find_amounts(text: str) -> List[int]:
+    """
+    Returns every amount found in free text, in öre.
+
+    Space-grouped numbers are ambiguous in running text ("Order 123 456", "Antal 1 149,00 kr"),
+    so they only count as one amount when they have a decimal part or a currency. Without
+    either, each group is read on its own; with one, the number without its first group
+    ("149,00") is returned as well, in case that group was a quantity. Comma-grouped whole
+    numbers ("$1,049") follow the same rule: without a currency they are not read at all.
+    """
+    text = text or ''
+    amounts = []
+    for match in AMOUNT_PATTERN.finditer(text):
+        written = match.group(0)
+        if _COMMA_GROUPED_PATTERN.fullmatch(written):
+            if _has_currency(text, match.start(), match.end()):
+                amounts.append(parse_amount(written))
+            continue
+        space_grouped = any(separator in written for separator in _GROUP_SEPARATORS)
+        if not space_grouped:
+            ore = parse_amount(written)
+            if ore is not None:
+                amounts.append(ore)
+            continue
+        groups = _GROUP_SPLIT_PATTERN.split(written.lstrip('-'))
+        if ',' not in written and not _has_currency(text, match.start(), match.end()):
+            amounts.append(parse_amount(groups[0]))
+            amounts.extend(parse_amount(group) for group in groups[1:] if not group.startswith('0'))
+            continue
+        amounts.append(parse_amount(written))
+        if not groups[1].startswith('0'):
+            amounts.append(parse_amount(_GROUP_SPLIT_PATTERN.split(written, maxsplit=1)[1]))
+    return amounts
+
+
+def amounts_match(wanted_ore: int, found_ore: int) -> bool:
+    """
+    True if an amount found in text matches the wanted amount, ignoring sign.
+    A whole-krona wanted amount (e.g. "1049") also matches "1049,12".
+    """
+    wanted_ore, found_ore = abs(wanted_ore), abs(found_ore)
+    if wanted_ore == found_ore:
+        return True
+    return wanted_ore % 100 == 0 and found_ore // 100 == wanted_ore // 100
+
+
+def format_amount(ore: int) -> str:
+    """Formats öre the way Swedish bank statements do: -104912 -> "-1 049,12"."""
+    sign = "-" if ore < 0 else ""
+    kronor, rest = divmod(abs(ore), 100)
+    return f"{sign}{kronor:,}".replace(",", " ") + f",{rest:02d}"
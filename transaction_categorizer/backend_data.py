@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Optional, Sequence, Tuple
+
+from .categorization_memo import MANUAL_REVIEW_CATEGORY
+from .config import BACKEND_DATA_CACHE_PATH, BACKEND_DATA_CHECK_SECONDS, BACKEND_DATA_ENABLED, SHEETS_TOKEN_PATH
+from .prompt import CATEGORIES_WITH_DESCRIPTIONS
+from .sheets import SheetsClient, get_sheets_client
+
+# One entry of CATEGORIES_WITH_DESCRIPTIONS: "- **Bensin:** Gas for car, e.g. OKQ8, CircleK etc."
+_CATEGORY_LINE_PATTERN = re.compile(r'^- \*\*(?P<category>.+?):\*\*')
+
+
+@dataclass(frozen=True)
+class BackendSnapshot:
+    """The account and category lists of BackendData as of one revision of the spreadsheet."""
+    revision: str  # Drive modifiedTime; empty if it could not be read
+    accounts: Tuple[str, ...]
+    categories: Tuple[str, ...]
+    checked_at: float = 0.0  # When the revision was last compared (time.time())
+    account_set: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    category_set: FrozenSet[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "account_set", frozenset(self.accounts))
+        object.__setattr__(self, "category_set", frozenset(self.categories))
+
+    def is_valid_category(self, category: str) -> bool:
+        return category in self.category_set or category == MANUAL_REVIEW_CATEGORY
+
+    def is_valid_account(self, account: str) -> bool:
+        return account in self.account_set
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"revision": self.revision, "checked_at": self.checked_at,
+                "accounts": list(self.accounts), "categories": list(self.categories)}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "BackendSnapshot":
+        return cls(data.get("revision") or "", tuple(data["accounts"]), tuple(data["categories"]),
+                   float(data.get("checked_at") or 0.0))
+
+
+class BackendDataCache:
+    """
+    Local copy of the valid accounts and categories in BackendData.
+
+    The snapshot is kept in memory and in a JSON file, together with the spreadsheet's
+    Drive modifiedTime. At most every check_seconds the modifiedTime is asked for (one
+    small Drive request) and the two columns are only read again when it changed. If
+    the modifiedTime cannot be read, the columns are read on every check instead.
+    """
+
+    def __init__(self, path: Path, client_factory: Callable[[], Optional[SheetsClient]],
+                 check_seconds: int = BACKEND_DATA_CHECK_SECONDS):
+        self.path = Path(path)
+        self.check_seconds = check_seconds
+        self.checks = 0
+        self.reads = 0
+        self._client_factory = client_factory
+        self._client: Optional[SheetsClient] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._attempted_at = 0.0  # When the last refresh was started, whether or not it succeeded
+        self.snapshot = self._load()
+
+    def _load(self) -> Optional[BackendSnapshot]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return BackendSnapshot.from_json(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable BackendData cache {self.path}: {e}")
+            return None
+
+    def _save(self, snapshot: BackendSnapshot) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".backend-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot.to_json(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, force: bool = False) -> Optional[BackendSnapshot]:
+        """Compares the revision now and reads the lists if it changed (or if force)."""
+        if self._client is None:
+            self._client = self._client_factory()
+            if self._client is None:
+                return self.snapshot
+        revision = self._client.modified_time()
+        self.checks += 1
+        current = self.snapshot
+        if not force and current is not None and revision is not None and revision == current.revision:
+            snapshot = BackendSnapshot(current.revision, current.accounts, current.categories, time.time())
+        else:
+            lists = self._client.read_backend_lists()
+            self.reads += 1
+            if not lists["categories"]:
+                print("BackendData has no categories; keeping the cached lists.")
+                return current
+            snapshot = BackendSnapshot(revision or "", tuple(lists["accounts"]), tuple(lists["categories"]), time.time())
+            if current is not None and snapshot.categories != current.categories:
+                added = set(snapshot.categories) - current.category_set
+                removed = current.category_set - set(snapshot.categories)
+                print(f"BackendData categories changed: added {sorted(added)}, removed {sorted(removed)}.")
+        self._save(snapshot)
+        self.snapshot = snapshot
+        return snapshot
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            # The cached lists stay in use; get() tries again after another interval.
+            print(f"Could not refresh BackendData: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self) -> Optional[BackendSnapshot]:
+        """
+        The current snapshot, without waiting for the network. If the last check is too
+        old, one refresh is started on a background thread and the cached snapshot (None
+        before the first fetch) is served until it finishes: get() is called from agent
+        callbacks on the event loop, and a refresh can take minutes of backoff. Refreshes
+        that fail or cannot run (no Sheets token) are tried again after check_seconds.
+        """
+        snapshot = self.snapshot
+        now = time.time()
+        if snapshot is not None and now - snapshot.checked_at < self.check_seconds:
+            return snapshot
+        with self._lock:
+            if self._refreshing or now - self._attempted_at < self.check_seconds:
+                return snapshot
+            self._refreshing = True
+            self._attempted_at = now
+        threading.Thread(target=self._refresh_in_background, name="backend-data-refresh", daemon=True).start()
+        return snapshot
+
+
+def _category_descriptions() -> Dict[str, str]:
+    """The entries of CATEGORIES_WITH_DESCRIPTIONS keyed by category name."""
+    descriptions = {}
+    for line in CATEGORIES_WITH_DESCRIPTIONS.splitlines():
+        match = _CATEGORY_LINE_PATTERN.match(line)
+        if match:
+            descriptions[match.group("category")] = line
+    return descriptions
+
+
+def category_block(categories: Sequence[str]) -> str:
+    """The category list for the instruction: BackendData's categories in sheet order, described as in prompt.py."""
+    descriptions = _category_descriptions()
+    lines = [descriptions.get(category, f"- **{category}:** (No description yet.)") for category in categories]
+    return "\n" + "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=8)
+def instruction_with_categories(instruction: str, categories: Tuple[str, ...]) -> str:
+    """
+    The instruction with its category list replaced by one for `categories`. Cached by
+    the list, so it is only built again when BackendData's categories actually change.
+    """
+    return instruction.replace(CATEGORIES_WITH_DESCRIPTIONS, category_block(categories), 1)
+
+
+def check_result_category(result: Dict[str, Any], snapshot: BackendSnapshot) -> Optional[Dict[str, Any]]:
+    """
+    None if the result's category is valid; otherwise the result sent to MANUAL REVIEW,
+    with the model's suggestion kept in the summary.
+    """
+    category = (result.get("category") or "").strip()
+    if snapshot.is_valid_category(category):
+        return None
+    summary = result.get("summary") or ""
+    return {**result, "category": MANUAL_REVIEW_CATEGORY,
+            "summary": f"{summary} (suggested category '{category}' is not in BackendData)".strip()}
+
+
+def _default_client() -> Optional[SheetsClient]:
+    # Never start an interactive OAuth flow in the middle of a conversation: without a
+    # Sheets token the cached lists are used as they are.
+    return get_sheets_client() if Path(SHEETS_TOKEN_PATH).exists() else None
+
+
+_cache: Optional[BackendDataCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_backend_data() -> Optional[BackendSnapshot]:
+    """Returns the current BackendData snapshot, or None if it is disabled or was never fetched."""
+    global _cache
+    if not BACKEND_DATA_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = BackendDataCache(BACKEND_DATA_CACHE_PATH, _default_client)
+    return _cache.get()
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.backend_data refresh [--fake sheet.json]
+    # python -m transaction_categorizer.backend_data show
+    # python -m transaction_categorizer.backend_data check "Bensin"
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ("show", [])
+    fake_path = args[args.index("--fake") + 1] if "--fake" in args else None
+    cache = BackendDataCache(BACKEND_DATA_CACHE_PATH, lambda: get_sheets_client(fake_path))
+    if command == "refresh":
+        cache.refresh(force=True)
+    snapshot = cache.snapshot
+    if snapshot is None:
+        print(f"No BackendData cached at {BACKEND_DATA_CACHE_PATH}; run 'refresh' first.")
+        sys.exit(1)
+    if command == "check" and args:
+        print("valid" if snapshot.is_valid_category(args[0]) else "not a BackendData category")
+    else:
+        print(f"Revision: {snapshot.revision or 'unknown'}")
+        print(f"Accounts ({len(snapshot.accounts)}): {', '.join(snapshot.accounts)}")
+        print(f"Categories ({len(snapshot.categories)}): {', '.join(snapshot.categories)}")
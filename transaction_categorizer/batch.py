@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from .categorization_memo import parse_agent_result
+from .config import BATCH_CONCURRENCY, BATCH_MAX_RETRIES, BATCH_MAX_ROWS_PER_MINUTE
+from .statements import STATEMENT_FORMATS, iter_statement
+from .transactions import Transaction, format_transaction_message, parse_transaction_message
+
+BATCH_APP_NAME = "transaction_categorizer_batch"
+BATCH_USER_ID = "batch"
+
+# Categorizes one chat message and returns the agent's final text.
+CategorizeFn = Callable[[str], Awaitable[str]]
+
+
+@dataclass
+class BatchRowResult:
+    """Outcome for one input row; result is the agent's output JSON, or None if every attempt failed."""
+    index: int
+    transaction: Transaction
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    latency_seconds: float = 0.0
+
+
+@dataclass
+class BatchReport:
+    """All row results in input order plus throughput statistics."""
+    rows: List[BatchRowResult] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Rows, failures, rows/s and p50/p95 per-row latency (seconds, successful rows only)."""
+        latencies = sorted(row.latency_seconds for row in self.rows if row.result is not None)
+        p50 = statistics.median(latencies) if latencies else 0.0
+        p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))] if latencies else 0.0
+        return {
+            "rows": len(self.rows),
+            "succeeded": len(latencies),
+            "failed": len(self.rows) - len(latencies),
+            "retries": sum(max(row.attempts - 1, 0) for row in self.rows),
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "rows_per_second": round(len(self.rows) / self.elapsed_seconds, 3) if self.elapsed_seconds else 0.0,
+            "p50_latency_seconds": round(p50, 3),
+            "p95_latency_seconds": round(p95, 3),
+        }
+
+
+class _RateLimiter:
+    """Spaces out row starts so at most max_per_minute start in any minute (0 = unlimited)."""
+
+    def __init__(self, max_per_minute: int):
+        self.interval = 60.0 / max_per_minute if max_per_minute > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    # Quota errors (HTTP 429 / RESOURCE_EXHAUSTED) back off longer than other failures.
+    base = 10.0 if getattr(error, 'code', None) == 429 else 2.0
+    ceiling = min(base * (2 ** attempt), 120.0)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+async def categorize_transactions(
+    transactions: Sequence[Transaction],
+    categorize: CategorizeFn,
+    concurrency: int = BATCH_CONCURRENCY,
+    max_retries: int = BATCH_MAX_RETRIES,
+    max_rows_per_minute: int = BATCH_MAX_ROWS_PER_MINUTE,
+    on_row_done: Optional[Callable[[BatchRowResult], None]] = None,
+    labels: Optional[Sequence[str]] = None
+) -> BatchReport:
+    """
+    Categorizes many transactions with at most `concurrency` rows in flight.
+
+    Each row is an independent conversation. A row whose call fails or whose answer
+    has no category is retried on its own, with backoff, up to max_retries times.
+    Results are returned in input order whatever order the rows finish in. labels name
+    the rows in log messages (e.g. their sheet row); by default "Row <index>".
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    rate_limiter = _RateLimiter(max_rows_per_minute)
+    report = BatchReport(rows=[BatchRowResult(index, transaction) for index, transaction in enumerate(transactions)])
+
+    async def _run_row(row: BatchRowResult) -> None:
+        label = labels[row.index] if labels is not None else f"Row {row.index}"
+        message = format_transaction_message(row.transaction)
+        async with semaphore:
+            while True:
+                await rate_limiter.wait()
+                row.attempts += 1
+                started = time.perf_counter()
+                try:
+                    result = parse_agent_result(await categorize(message))
+                    if not result or not result.get('category'):
+                        raise ValueError("agent answer contained no category")
+                    row.result, row.error = result, None
+                    row.latency_seconds = time.perf_counter() - started
+                    break
+                except Exception as e:
+                    row.error = f"{type(e).__name__}: {e}"
+                    if row.attempts > max_retries:
+                        print(f"{label} failed after {row.attempts} attempts: {row.error}")
+                        break
+                    delay = _retry_delay(row.attempts - 1, e)
+                    print(f"{label} failed ({row.error}); retrying in {delay:.1f}s.")
+                    await asyncio.sleep(delay)
+        if on_row_done:
+            on_row_done(row)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_row(row) for row in report.rows))
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
+
+
+def in_process_categorizer() -> CategorizeFn:
+    """Runs root_agent in this process, one fresh session per row."""
+    from google.adk.runners import InMemoryRunner
+    from google.genai import types
+
+    from .agent import root_agent
+
+    runner = InMemoryRunner(agent=root_agent, app_name=BATCH_APP_NAME)
+
+    async def _categorize(message: str) -> str:
+        session = await runner.session_service.create_session(app_name=BATCH_APP_NAME, user_id=BATCH_USER_ID)
+        final_text = ""
+        async for event in runner.run_async(
+            user_id=BATCH_USER_ID,
+            session_id=session.id,
+            new_message=types.Content(role="user", parts=[types.Part(text=message)]),
+        ):
+            if event.author == root_agent.name and event.content and event.content.parts:
+                text = "".join(part.text or "" for part in event.content.parts)
+                if text:
+                    final_text = text
+        return final_text
+
+    return _categorize
+
+
+def remote_categorizer(resource_id: str, user_id: str = BATCH_USER_ID) -> CategorizeFn:
+    """Sends each row to a deployed Agent Engine app, in its own session, from a worker thread."""
+    from .remote_client import get_remote_client
+
+    client = get_remote_client(resource_id, user_id)
+
+    def _categorize_blocking(message: str) -> str:
+        reply = client.send(message)
+        if reply.error is not None:
+            raise RuntimeError(reply.error)
+        return reply.final_text
+
+    async def _categorize(message: str) -> str:
+        return await asyncio.to_thread(_categorize_blocking, message)
+
+    return _categorize
+
+
+def read_transactions(lines: Sequence[str]) -> List[Transaction]:
+    """Parses statement rows (one per line); lines without a transaction are skipped."""
+    transactions = []
+    for line in lines:
+        transaction = parse_transaction_message(line)
+        if transaction is not None:
+            transactions.append(transaction)
+    return transactions
+
+
+def _print_token_report(remote: bool) -> None:
+    from .token_accounting import format_report, get_token_ledger
+
+    ledger = get_token_ledger()
+    if remote:
+        print("Token accounting happens where the agent runs; set TOKEN_LEDGER_PATH on the deployment instead.",
+              file=sys.stderr)
+    elif ledger is None:
+        print("Token accounting is disabled (TOKEN_ACCOUNTING_ENABLED=false).", file=sys.stderr)
+    else:
+        print(format_report(ledger.accounts), file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Categorize every transaction in a statement file.")
+    parser.add_argument("statement", help="Text/TSV file with one statement row per line ('-' for stdin).")
+    parser.add_argument("--account", choices=sorted(STATEMENT_FORMATS),
+                        help="Read the file as this account's statement export instead of pasted rows.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--max_retries", type=int, default=BATCH_MAX_RETRIES)
+    parser.add_argument("--resource_id", help="Use this deployed Agent Engine app instead of an in-process runner.")
+    parser.add_argument("--output", help="Write one JSON result per line here (default: stdout).")
+    parser.add_argument("--token_report", action="store_true",
+                        help="Print which prompt sources used the most (approximate) tokens; in-process runs only.")
+    args = parser.parse_args(argv)
+
+    if args.account:
+        transactions = list(iter_statement(sys.stdin if args.statement == "-" else args.statement, args.account))
+    elif args.statement == "-":
+        transactions = read_transactions(sys.stdin.read().splitlines())
+    else:
+        with open(args.statement, encoding="utf-8") as f:
+            transactions = read_transactions(f.read().splitlines())
+    print(f"Categorizing {len(transactions)} transactions with concurrency {args.concurrency}...", file=sys.stderr)
+
+    categorize = remote_categorizer(args.resource_id) if args.resource_id else in_process_categorizer()
+    report = asyncio.run(categorize_transactions(
+        transactions, categorize, concurrency=args.concurrency, max_retries=args.max_retries
+    ))
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for row in report.rows:
+            out.write(json.dumps(asdict(row), ensure_ascii=False, default=str) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(report.stats()), file=sys.stderr)
+    if args.token_report:
+        _print_token_report(bool(args.resource_id))
+    return 0 if all(row.result is not None for row in report.rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
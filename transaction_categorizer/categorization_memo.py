@@ -0,0 +1,227 @@
+import ast
+import json
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .config import MEMO_DB_PATH, MEMO_ENABLED, MEMO_MAX_ENTRIES, MEMO_REUSE_CONFIDENCE
+from .merchant_rules import NO_EMAIL_FOUND, normalize_description
+from .sub_agents.gmail_agent.gmail_cache import connect_db
+
+# The model's "I am not sure" category; never memoized.
+MANUAL_REVIEW_CATEGORY = "MANUAL REVIEW"
+
+_JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+
+@dataclass
+class MemoEntry:
+    """A remembered decision for one normalized merchant description."""
+    merchant_key: str
+    category: str
+    summary: str
+    hit_count: int
+    confidence: float
+    source: str  # "model" or "manual"
+
+    def hint(self) -> str:
+        """One-line hint for the model about how this merchant was categorized before."""
+        times = "a manual correction" if self.source == "manual" else f"{self.hit_count} earlier transaction(s)"
+        return (f"Hint: transactions described as '{self.merchant_key}' were categorized as "
+                f"'{self.category}' in {times} (confidence {self.confidence:.2f}). Use it unless the details say otherwise.")
+
+    def as_result(self, description: str) -> Dict[str, str]:
+        """
+        The agent's output JSON for a reused decision about a raw description. The stored
+        summary described another purchase (its email), so it is not reused.
+        """
+        return {
+            "category": self.category,
+            "summary": f"{description.strip()} (categorized like earlier {self.merchant_key} transactions)",
+            "query": "",
+            "email_subject": NO_EMAIL_FOUND,
+        }
+
+
+def parse_agent_result(text: str) -> Optional[Dict[str, Any]]:
+    """Extracts the agent's output JSON object from its final text (tolerates code fences and single quotes)."""
+    match = _JSON_OBJECT_PATTERN.search(text or '')
+    if not match:
+        return None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            result = parse(match.group(0))
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(result, dict):
+            return result
+    return None
+
+
+class CategorizationMemo:
+    """
+    Persistent memo of categorization decisions keyed by normalized merchant description.
+
+    Consistent model decisions raise the confidence (hits / (hits + 1)); a different
+    decision for the same merchant starts over. Manual corrections have confidence 1.0.
+    The memo holds at most max_entries merchants and evicts the least recently used.
+    """
+
+    def __init__(self, db_path: str, max_entries: int, reuse_confidence: float):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.reuse_confidence = reuse_confidence
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = connect_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memo (
+                    merchant_key TEXT PRIMARY KEY,
+                    category TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    hit_count INTEGER NOT NULL,
+                    confidence REAL NOT NULL,
+                    source TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS memo_last_used ON memo(last_used)")
+
+    def get(self, description: str) -> Optional[MemoEntry]:
+        """Returns the remembered decision for a raw description, or None."""
+        merchant_key = normalize_description(description)
+        if not merchant_key:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT merchant_key, category, summary, hit_count, confidence, source FROM memo WHERE merchant_key = ?",
+                (merchant_key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE memo SET last_used = ? WHERE merchant_key = ?", (time.time(), merchant_key))
+        return MemoEntry(*row)
+
+    def reusable(self, entry: Optional[MemoEntry]) -> bool:
+        """True if a decision is confident enough to be reused without the model."""
+        return entry is not None and entry.confidence >= self.reuse_confidence
+
+    def record(self, description: str, result: Dict[str, Any]) -> None:
+        """Stores a model decision ({"category", "summary", ...}) for a raw description."""
+        merchant_key = normalize_description(description)
+        category = result.get('category')
+        if not merchant_key or not category or category == MANUAL_REVIEW_CATEGORY:
+            return
+        summary = result.get('summary') or ''
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT category, hit_count, source FROM memo WHERE merchant_key = ?", (merchant_key,)
+            ).fetchone()
+            if row and row[2] == "manual":
+                # A manual correction wins over later model decisions.
+                return
+            hit_count = row[1] + 1 if row and row[0] == category else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memo (merchant_key, category, summary, hit_count, confidence, source, last_used) "
+                "VALUES (?, ?, ?, ?, ?, 'model', ?)",
+                (merchant_key, category, summary, hit_count, hit_count / (hit_count + 1), time.time()),
+            )
+            self._evict_unlocked()
+
+    def correct(self, description: str, category: str, summary: Optional[str] = None) -> None:
+        """Records a manual correction; it is reused from now on and never overwritten by the model."""
+        merchant_key = normalize_description(description)
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM memo WHERE merchant_key = ?", (merchant_key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memo (merchant_key, category, summary, hit_count, confidence, source, last_used) "
+                "VALUES (?, ?, ?, 1, 1.0, 'manual', ?)",
+                (merchant_key, category, summary or (row[0] if row else description.strip()), time.time()),
+            )
+            self._evict_unlocked()
+
+    def invalidate(self, description: str) -> bool:
+        """Forgets the decision for one merchant. Returns True if there was one."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM memo WHERE merchant_key = ?", (normalize_description(description),)
+            )
+        return cursor.rowcount > 0
+
+    def invalidate_category(self, category: str) -> int:
+        """Forgets every decision for a category, e.g. after it was renamed or split. Returns the number removed."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM memo WHERE category = ?", (category,))
+        return cursor.rowcount
+
+    def _evict_unlocked(self) -> None:
+        """Deletes least recently used entries until at most max_entries remain."""
+        entries = self._conn.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+        excess = entries - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM memo WHERE merchant_key IN (SELECT merchant_key FROM memo ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def clear(self) -> None:
+        """Removes every remembered decision."""
+        with self._lock:
+            self._conn.execute("DELETE FROM memo")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss/eviction counters and the number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+            manual = self._conn.execute("SELECT COUNT(*) FROM memo WHERE source = 'manual'").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": entries, "manual": manual}
+
+
+_memo: Optional[CategorizationMemo] = None
+_memo_lock = threading.Lock()
+
+
+def get_memo() -> Optional[CategorizationMemo]:
+    """Returns the process-wide categorization memo, or None if it is disabled."""
+    global _memo
+    if not MEMO_ENABLED:
+        return None
+    if _memo is None:
+        with _memo_lock:
+            if _memo is None:
+                _memo = CategorizationMemo(str(MEMO_DB_PATH), MEMO_MAX_ENTRIES, MEMO_REUSE_CONFIDENCE)
+    return _memo
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.categorization_memo stats
+    # python -m transaction_categorizer.categorization_memo correct "K*BOKUS.COM" "Böcker"
+    # python -m transaction_categorizer.categorization_memo invalidate "EASYPARK /25-03-11"
+    # python -m transaction_categorizer.categorization_memo invalidate-category "SL"
+    memo = CategorizationMemo(str(MEMO_DB_PATH), MEMO_MAX_ENTRIES, MEMO_REUSE_CONFIDENCE)
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ("stats", [])
+    if command == "correct" and len(args) >= 2:
+        memo.correct(args[0], args[1], args[2] if len(args) > 2 else None)
+        print(f"Recorded '{normalize_description(args[0])}' -> '{args[1]}'.")
+    elif command == "invalidate" and args:
+        print("Removed." if memo.invalidate(args[0]) else "No entry found.")
+    elif command == "invalidate-category" and args:
+        print(f"Removed {memo.invalidate_category(args[0])} entries.")
+    elif command == "clear":
+        memo.clear()
+        print("Cleared.")
+    else:
+        print(memo.stats())
@@ -11,6 +11,9 @@ GEMINI_MODEL_ID = "gemini-2.5-flash-preview-04-17" #os.getenv("GEMINI_MODEL_ID")
 
 # --- Google API Configuration ---
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# The Sheets token also reads the spreadsheet's Drive metadata (modifiedTime), to tell
+# whether BackendData may have changed. If modifying these scopes, delete sheets_token.pickle.
+SHEETS_SCOPES = SCOPES + ["https://www.googleapis.com/auth/drive.metadata.readonly"]
 
 # Credentials paths (relative to project root assumed)
 CREDENTIALS_DIR = Path("credentials")
@@ -60,3 +63,81 @@ PLACEHOLDER_CATEGORY = "PENDING_AI"
 DEFAULT_STATUS = "✅"
 TARGET_COLUMNS = ['Date', 'Outflow', 'Inflow', 'Category', 'Account', 'Memo', 'Status']
 
+
+# --- Merchant Rules ---
+# Transactions from merchants listed in this file are categorized directly, without the model.
+MERCHANT_RULES_ENABLED = os.environ.get("MERCHANT_RULES_ENABLED", "true").lower() == "true"
+MERCHANT_RULES_FILE = Path(os.environ.get("MERCHANT_RULES_FILE", Path(__file__).parent / "merchant_rules.json"))
+
+# --- Categorization Memo ---
+# Past decisions per normalized merchant description. Decisions at or above
+# MEMO_REUSE_CONFIDENCE are reused directly; weaker ones are given to the model as a hint.
+MEMO_ENABLED = os.environ.get("MEMO_ENABLED", "true").lower() == "true"
+MEMO_DB_PATH = Path(os.environ.get("MEMO_DB_PATH", CREDENTIALS_DIR / "categorization_memo.sqlite3"))
+MEMO_MAX_ENTRIES = int(os.environ.get("MEMO_MAX_ENTRIES", "5000"))
+MEMO_REUSE_CONFIDENCE = float(os.environ.get("MEMO_REUSE_CONFIDENCE", "0.75"))
+
+# --- Batch Categorization ---
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_RETRIES = int(os.environ.get("BATCH_MAX_RETRIES", "3"))
+# Upper bound on rows started per minute, to stay under the model quota; 0 means no limit.
+BATCH_MAX_ROWS_PER_MINUTE = int(os.environ.get("BATCH_MAX_ROWS_PER_MINUTE", "0"))
+
+# --- Gmail Lookup ---
+# "direct": the root agent calls one function tool that searches Gmail and returns
+# receipt records. "agent": the root agent asks the nested gmail_agent (an extra
+# model conversation per lookup).
+GMAIL_LOOKUP_MODE = os.environ.get("GMAIL_LOOKUP_MODE", "direct").lower()
+
+# --- History kNN ---
+# Nearest neighbours among already-categorized rows of the Transactions sheet, built
+# offline from a CSV export (python -m transaction_categorizer.history_knn build export.csv).
+# Results at or above KNN_CONFIDENCE_THRESHOLD are used directly; weaker ones give the
+# model the nearest rows as examples.
+KNN_ENABLED = os.environ.get("KNN_ENABLED", "true").lower() == "true"
+KNN_INDEX_PATH = Path(os.environ.get("KNN_INDEX_PATH", CREDENTIALS_DIR / "history_knn.npz"))
+KNN_NEIGHBOURS = int(os.environ.get("KNN_NEIGHBOURS", "5"))
+KNN_CONFIDENCE_THRESHOLD = float(os.environ.get("KNN_CONFIDENCE_THRESHOLD", "0.85"))
+KNN_HASH_DIMENSIONS = int(os.environ.get("KNN_HASH_DIMENSIONS", "512"))
+
+# --- Sheets I/O ---
+# The Sheets token is kept apart from the Gmail token (token.pickle), which has other scopes.
+SHEETS_TOKEN_PATH = Path(os.environ.get("SHEETS_TOKEN_PATH", CREDENTIALS_DIR / "sheets_token.pickle"))
+# Value ranges per values.batchUpdate request; writes for a batch are coalesced into as few ranges as possible.
+SHEETS_MAX_RANGES_PER_REQUEST = int(os.environ.get("SHEETS_MAX_RANGES_PER_REQUEST", "200"))
+# Retries for 429/5xx responses, with truncated exponential backoff and jitter.
+SHEETS_MAX_RETRIES = int(os.environ.get("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE_SECONDS = float(os.environ.get("SHEETS_BACKOFF_BASE_SECONDS", "1.0"))
+SHEETS_BACKOFF_MAX_SECONDS = float(os.environ.get("SHEETS_BACKOFF_MAX_SECONDS", "64.0"))
+
+# --- Pending Row Processing ---
+# Progress of the PENDING_AI processor (high-water mark and per-row results) is kept
+# in this journal so an interrupted run resumes without repeating finished rows.
+PENDING_JOURNAL_PATH = Path(os.environ.get("PENDING_JOURNAL_PATH", CREDENTIALS_DIR / "pending_journal.sqlite3"))
+PENDING_CHUNK_SIZE = int(os.environ.get("PENDING_CHUNK_SIZE", "25"))
+
+# --- BackendData Snapshot ---
+# The valid accounts and categories of BackendData, cached locally together with the
+# spreadsheet's modifiedTime. The time is checked at most every BACKEND_DATA_CHECK_SECONDS
+# and the lists are only read again when it changed.
+BACKEND_DATA_ENABLED = os.environ.get("BACKEND_DATA_ENABLED", "true").lower() == "true"
+BACKEND_DATA_CACHE_PATH = Path(os.environ.get("BACKEND_DATA_CACHE_PATH", CREDENTIALS_DIR / "backend_data.json"))
+BACKEND_DATA_CHECK_SECONDS = int(os.environ.get("BACKEND_DATA_CHECK_SECONDS", "300"))
+
+# --- Metrics ---
+# Per-stage counters and timings (instrumentation.py). METRICS_SINK is "prometheus"
+# (text exposition file, replaced on every flush), "otlp" (OTLP/JSON, one export per
+# line) or empty to keep them in memory only. Spans go to the OpenTelemetry tracer
+# either way, e.g. to Cloud Trace when AdkApp runs with enable_tracing=True.
+METRICS_SINK = os.environ.get("METRICS_SINK", "").lower()
+METRICS_PATH = Path(os.environ.get(
+    "METRICS_PATH", CREDENTIALS_DIR / ("metrics.otlp.jsonl" if METRICS_SINK == "otlp" else "metrics.prom")
+))
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "10"))
+
+# --- Token Accounting ---
+# Approximate prompt tokens per model call, split by source (instruction, category list,
+# hints, tool results, ...), for the batch report. TOKEN_LEDGER_PATH, if set, also keeps
+# every transaction's account as a JSON line (python -m transaction_categorizer.token_accounting).
+TOKEN_ACCOUNTING_ENABLED = os.environ.get("TOKEN_ACCOUNTING_ENABLED", "true").lower() == "true"
+TOKEN_LEDGER_PATH = Path(os.environ["TOKEN_LEDGER_PATH"]) if os.environ.get("TOKEN_LEDGER_PATH") else None
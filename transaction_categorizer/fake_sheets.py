@@ -0,0 +1,129 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Sequence
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from .sheets import parse_a1_range
+
+
+class _FakeRequest:
+    """Stands in for a googleapiclient HttpRequest: nothing happens until execute()."""
+
+    def __init__(self, run: Callable[[], Dict[str, Any]]):
+        self._run = run
+
+    def execute(self) -> Dict[str, Any]:
+        return self._run()
+
+
+class FakeSheetsService:
+    """
+    File-backed stand-in for the Sheets v4 service, for running SheetsClient offline.
+
+    The spreadsheet is a JSON file {"Tab name": [[cell, ...], ...], ...}; every write
+    is saved back atomically, so the file can be inspected or edited between runs.
+    Supports spreadsheets().values().batchGet/batchUpdate with A1 ranges and, standing
+    in for the Drive service, files().get (modifiedTime is the file's mtime). Counts the
+    calls made (calls["batchGet"], ...) and can fail the next calls with fail_next().
+    """
+
+    def __init__(self, path: str, tabs: Dict[str, List[List[str]]] = None):
+        self.path = path
+        self.calls: Counter = Counter()
+        self._failures: List[int] = []
+        self._lock = threading.Lock()
+        if tabs is not None or not os.path.exists(path):
+            self._save(tabs or {})
+
+    # The real service is reached through spreadsheets().values().
+    def spreadsheets(self) -> "FakeSheetsService":
+        return self
+
+    def values(self) -> "FakeSheetsService":
+        return self
+
+    # ...and the Drive service through files().
+    def files(self) -> "FakeSheetsService":
+        return self
+
+    def fail_next(self, count: int = 1, status: int = 429) -> None:
+        """Makes the next `count` requests raise HttpError with this status."""
+        self._failures.extend([status] * count)
+
+    def _load(self) -> Dict[str, List[List[str]]]:
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, tabs: Dict[str, List[List[str]]]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".sheet-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(tabs, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def _call(self, method: str, run: Callable[[], Dict[str, Any]]) -> _FakeRequest:
+        def _execute() -> Dict[str, Any]:
+            with self._lock:
+                self.calls[method] += 1
+                if self._failures:
+                    status = self._failures.pop(0)
+                    raise HttpError(httplib2.Response({"status": status}), b'{"error": "injected"}')
+                return run()
+        return _FakeRequest(_execute)
+
+    def batchGet(self, spreadsheetId: str, ranges: Sequence[str], **kwargs: Any) -> _FakeRequest:
+        def _run() -> Dict[str, Any]:
+            tabs = self._load()
+            value_ranges = []
+            for range_name in ranges:
+                sheet, first_row, last_row, first_column, last_column = parse_a1_range(range_name)
+                if sheet not in tabs:
+                    raise HttpError(httplib2.Response({"status": 400}), f"Unable to parse range: {range_name}".encode())
+                rows = tabs[sheet][first_row - 1:last_row]
+                values = [
+                    [str(cell) for cell in row[first_column:None if last_column is None else last_column + 1]]
+                    for row in rows
+                ]
+                # Like the real API: trailing empty cells and rows are left out.
+                values = [row[:max((i + 1 for i, cell in enumerate(row) if cell != ""), default=0)] for row in values]
+                while values and not values[-1]:
+                    values.pop()
+                value_ranges.append({"range": range_name, "majorDimension": "ROWS", "values": values})
+            return {"spreadsheetId": spreadsheetId, "valueRanges": value_ranges}
+        return self._call("batchGet", _run)
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict[str, Any], **kwargs: Any) -> _FakeRequest:
+        def _run() -> Dict[str, Any]:
+            tabs = self._load()
+            updated_cells = 0
+            responses = []
+            for value_range in body.get("data", []):
+                sheet, first_row, _, first_column, _ = parse_a1_range(value_range["range"])
+                grid = tabs.setdefault(sheet, [])
+                for row_offset, row_values in enumerate(value_range.get("values", [])):
+                    row_index = first_row - 1 + row_offset
+                    while len(grid) <= row_index:
+                        grid.append([])
+                    row = grid[row_index]
+                    for column_offset, value in enumerate(row_values):
+                        column = first_column + column_offset
+                        while len(row) <= column:
+                            row.append("")
+                        row[column] = value
+                        updated_cells += 1
+                responses.append({"updatedRange": value_range["range"]})
+            self._save(tabs)
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedCells": updated_cells, "responses": responses}
+        return self._call("batchUpdate", _run)
+
+    def get(self, fileId: str, fields: str = "", **kwargs: Any) -> _FakeRequest:
+        def _run() -> Dict[str, Any]:
+            modified = datetime.datetime.fromtimestamp(os.stat(self.path).st_mtime_ns / 1e9, datetime.timezone.utc)
+            return {"id": fileId, "modifiedTime": modified.isoformat(timespec="microseconds").replace("+00:00", "Z")}
+        return self._call("files.get", _run)
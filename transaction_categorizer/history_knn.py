@@ -0,0 +1,309 @@
+import csv
+import math
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .amounts import format_amount, parse_amount
+from .categorization_memo import MANUAL_REVIEW_CATEGORY
+from .config import (
+    KNN_CONFIDENCE_THRESHOLD,
+    KNN_ENABLED,
+    KNN_HASH_DIMENSIONS,
+    KNN_INDEX_PATH,
+    KNN_NEIGHBOURS,
+    PLACEHOLDER_CATEGORY,
+)
+from .merchant_rules import NO_EMAIL_FOUND, normalize_description
+
+NGRAM_SIZE = 3
+# Amounts are bucketed by sign and order of magnitude (log2 of whole kronor).
+_AMOUNT_BUCKETS = 32
+# Weight of the amount bucket relative to the (unit length) description vector.
+_AMOUNT_WEIGHT = 0.35
+# Categories that say nothing about the merchant and are never learned from.
+_IGNORED_CATEGORIES = {"", PLACEHOLDER_CATEGORY, MANUAL_REVIEW_CATEGORY, "➡️ Starting Balance", "🔢 Balance Adjustment"}
+# Rows classified per matrix product when many transactions are looked up at once.
+_QUERY_BATCH = 256
+# Smaller batches are scored query by query over their non-zero dimensions only.
+_SPARSE_QUERY_LIMIT = 16
+
+
+def amount_bucket(amount_ore: int) -> int:
+    """Buckets an amount by sign and log2 magnitude: outflows 0..15, inflows 16..31."""
+    magnitude = min(int(math.log2(abs(amount_ore) // 100 + 1)), _AMOUNT_BUCKETS // 2 - 1)
+    return magnitude if amount_ore < 0 else _AMOUNT_BUCKETS // 2 + magnitude
+
+
+def featurize(merchant_key: str, dimensions: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Unit-length vector of signed hashed character n-grams of a normalized description.
+    CRC32 is used so vectors are the same in every process.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32) if out is None else out
+    padded = f" {merchant_key} "
+    for start in range(max(len(padded) - NGRAM_SIZE + 1, 1)):
+        digest = zlib.crc32(padded[start:start + NGRAM_SIZE].encode("utf-8"))
+        vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm:
+        vector /= norm
+    return vector
+
+
+@dataclass
+class Neighbour:
+    """One indexed (merchant, amount bucket, category) group near the query."""
+    example: str
+    category: str
+    count: int
+    similarity: float
+
+
+@dataclass
+class KnnResult:
+    """The kNN vote for one transaction."""
+    category: Optional[str]
+    confidence: float
+    neighbours: List[Neighbour] = field(default_factory=list)
+
+    def hint(self) -> str:
+        """Few-shot hint for the model listing the nearest categorized rows."""
+        examples = "; ".join(
+            f"'{neighbour.example}' -> '{neighbour.category}' ({neighbour.count}x, similarity {neighbour.similarity:.2f})"
+            for neighbour in self.neighbours
+        )
+        return f"Hint: similar transactions from the history were categorized as: {examples}."
+
+    def as_result(self, description: str) -> Dict[str, str]:
+        """The agent's output JSON for a confident kNN decision about a raw description."""
+        return {
+            "category": self.category or MANUAL_REVIEW_CATEGORY,
+            "summary": f"{description.strip()} (categorized like earlier transactions)",
+            "query": "",
+            "email_subject": NO_EMAIL_FOUND,
+        }
+
+
+def read_history_csv(path: Path) -> Iterator[Tuple[str, int, str]]:
+    """
+    Streams (raw description, amount in öre, category) out of a CSV/TSV export of the
+    Transactions sheet (TARGET_COLUMNS headers). Rows without a usable category are skipped.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        first_line = f.readline()
+        delimiter = "\t" if first_line.count("\t") >= first_line.count(",") else ","
+        header = next(csv.reader([first_line], delimiter=delimiter))
+        for row in csv.DictReader(f, fieldnames=[name.strip() for name in header], delimiter=delimiter):
+            category = (row.get("Category") or "").strip()
+            description = (row.get("Memo") or "").strip()
+            if category in _IGNORED_CATEGORIES or not description:
+                continue
+            outflow = parse_amount(row.get("Outflow") or "") or 0
+            inflow = parse_amount(row.get("Inflow") or "") or 0
+            yield description, abs(inflow) - abs(outflow), category
+
+
+class HistoryIndex:
+    """
+    kNN classifier over categorized history.
+
+    Rows are grouped by (normalized description, amount bucket, category), so repeated
+    merchants cost nothing extra however long the history is. The description vectors
+    of the distinct merchants form one float32 matrix, stored dimension-major: a query
+    has only a few dozen non-zero n-gram dimensions, so a single lookup reads just those
+    rows. Batches of lookups use one dense matrix product. Exact description matches
+    skip both. The amount bucket then adjusts the similarity of each candidate group as if it
+    were an extra one-hot dimension of weight _AMOUNT_WEIGHT.
+    """
+
+    def __init__(self, columns: np.ndarray, keys: np.ndarray, group_keys: np.ndarray, buckets: np.ndarray,
+                 labels: np.ndarray, counts: np.ndarray, examples: np.ndarray, categories: Sequence[str]):
+        self.columns = columns  # (dimensions, merchants)
+        self.keys = keys
+        self.group_keys = group_keys
+        self.buckets = buckets
+        self.labels = labels
+        self.counts = counts
+        self.examples = examples
+        self.categories = list(categories)
+        self.dimensions = columns.shape[0]
+        self._key_rows = {key: row for row, key in enumerate(keys.tolist())}
+        # Groups are stored sorted by merchant, so each merchant's groups are one slice.
+        self._group_offsets = np.searchsorted(group_keys, np.arange(len(keys) + 1))
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, int, str]], dimensions: int = KNN_HASH_DIMENSIONS) -> "HistoryIndex":
+        """Builds the index from (raw description, amount in öre, category) rows."""
+        groups: Dict[Tuple[str, int, str], List] = {}
+        for description, amount_ore, category in rows:
+            merchant_key = normalize_description(description)
+            if not merchant_key:
+                continue
+            # [row count, example description]
+            group = groups.setdefault((merchant_key, amount_bucket(amount_ore), category), [0, description])
+            group[0] += 1
+        ordered = sorted(groups.items())
+        keys = sorted({merchant_key for merchant_key, _, _ in groups})
+        key_rows = {key: row for row, key in enumerate(keys)}
+        categories = sorted({category for _, _, category in groups})
+        category_index = {category: index for index, category in enumerate(categories)}
+        vectors = np.zeros((len(keys), dimensions), dtype=np.float32)
+        for row, key in enumerate(keys):
+            featurize(key, dimensions, out=vectors[row])
+        return cls(
+            columns=np.ascontiguousarray(vectors.T),
+            keys=np.array(keys, dtype=str),
+            group_keys=np.array([key_rows[key] for (key, _, _), _ in ordered], dtype=np.int32),
+            buckets=np.array([bucket for (_, bucket, _), _ in ordered], dtype=np.int8),
+            labels=np.array([category_index[category] for (_, _, category), _ in ordered], dtype=np.int32),
+            counts=np.array([group[0] for _, group in ordered], dtype=np.int32),
+            examples=np.array([group[1] for _, group in ordered], dtype=str),
+            categories=categories,
+        )
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path, columns=self.columns, keys=self.keys, group_keys=self.group_keys, buckets=self.buckets,
+            labels=self.labels, counts=self.counts, examples=self.examples,
+            categories=np.array(self.categories, dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "HistoryIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                columns=data["columns"], keys=data["keys"], group_keys=data["group_keys"], buckets=data["buckets"],
+                labels=data["labels"], counts=data["counts"], examples=data["examples"],
+                categories=data["categories"].tolist(),
+            )
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def classify(self, description: str, amount_ore: int, k: int = KNN_NEIGHBOURS) -> KnnResult:
+        """Classifies one transaction; see classify_many."""
+        return self.classify_many([(description, amount_ore)], k)[0]
+
+    def classify_many(self, transactions: Sequence[Tuple[str, int]], k: int = KNN_NEIGHBOURS) -> List[KnnResult]:
+        """
+        Votes among the k most similar groups, weighted by similarity times row count.
+        Confidence is the winning share of the vote scaled by the best similarity, so a
+        unanimous but distant neighbourhood is not trusted, and by n / (n + 1) for the n
+        rows behind the winning category, like the memo's hits / (hits + 1): a single
+        earlier row gives at most 0.5. Transactions whose
+        description is not in the index are scored together, one matrix product per batch.
+        """
+        results: List[KnnResult] = [KnnResult(category=None, confidence=0.0)] * len(transactions)
+        pending: List[Tuple[int, str, int]] = []
+        for position, (description, amount_ore) in enumerate(transactions):
+            merchant_key = normalize_description(description)
+            if not merchant_key or not len(self.keys):
+                continue
+            exact = self._key_rows.get(merchant_key)
+            if exact is not None:
+                results[position] = self._vote(np.array([exact]), np.ones(1, dtype=np.float32), amount_ore, k)
+            else:
+                pending.append((position, merchant_key, amount_ore))
+
+        top_keys = min(k, len(self.keys))
+        for start in range(0, len(pending), _QUERY_BATCH):
+            batch = pending[start:start + _QUERY_BATCH]
+            queries = np.zeros((len(batch), self.dimensions), dtype=np.float32)
+            for query_row, (_, merchant_key, _) in enumerate(batch):
+                featurize(merchant_key, self.dimensions, out=queries[query_row])
+            if len(batch) < _SPARSE_QUERY_LIMIT:
+                similarities = np.stack([self._sparse_similarities(query) for query in queries])
+            else:
+                similarities = queries @ self.columns
+            nearest = np.argpartition(-similarities, top_keys - 1, axis=1)[:, :top_keys]
+            for (position, _, amount_ore), key_rows, key_similarities in zip(batch, nearest, similarities):
+                results[position] = self._vote(key_rows, key_similarities[key_rows], amount_ore, k)
+        return results
+
+    def _sparse_similarities(self, query: np.ndarray) -> np.ndarray:
+        dimensions = np.flatnonzero(query)
+        return query[dimensions] @ self.columns[dimensions]
+
+    def _vote(self, key_rows: np.ndarray, key_similarities: np.ndarray, amount_ore: int, k: int) -> KnnResult:
+        groups = np.concatenate([
+            np.arange(self._group_offsets[row], self._group_offsets[row + 1]) for row in key_rows.tolist()
+        ])
+        text_similarity = np.repeat(key_similarities, np.diff(self._group_offsets)[key_rows])
+        same_bucket = self.buckets[groups] == amount_bucket(amount_ore)
+        # Cosine of [text, w * one-hot bucket] vectors, both sides of length sqrt(1 + w^2).
+        similarities = (text_similarity + _AMOUNT_WEIGHT ** 2 * same_bucket) / (1 + _AMOUNT_WEIGHT ** 2)
+        order = np.argsort(-similarities, kind="stable")[:k]
+        groups, similarities = groups[order], np.clip(similarities[order], 0.0, 1.0)
+
+        votes: Dict[int, float] = {}
+        support: Dict[int, int] = {}
+        for group, similarity in zip(groups.tolist(), similarities.tolist()):
+            label = int(self.labels[group])
+            votes[label] = votes.get(label, 0.0) + similarity * int(self.counts[group])
+            support[label] = support.get(label, 0) + int(self.counts[group])
+        total = sum(votes.values())
+        if not total:
+            return KnnResult(category=None, confidence=0.0)
+        label, score = max(votes.items(), key=lambda item: item[1])
+        neighbours = [
+            Neighbour(str(self.examples[group]), self.categories[self.labels[group]], int(self.counts[group]), similarity)
+            for group, similarity in zip(groups.tolist(), similarities.tolist())
+        ]
+        rows = support[label]
+        return KnnResult(self.categories[label], score / total * similarities[0] * rows / (rows + 1), neighbours)
+
+
+_index: Optional[HistoryIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_history_index() -> Optional[HistoryIndex]:
+    """Returns the process-wide history index, or None if it is disabled or has not been built."""
+    global _index
+    if not KNN_ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = HistoryIndex.load(KNN_INDEX_PATH)
+                except FileNotFoundError:
+                    return None
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not load the history index from {KNN_INDEX_PATH}: {e}")
+                    return None
+    return _index
+
+
+def confident(result: KnnResult) -> bool:
+    """True if a kNN result is good enough to be used without the model."""
+    return result.category is not None and result.confidence >= KNN_CONFIDENCE_THRESHOLD
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.history_knn build transactions_export.csv
+    # python -m transaction_categorizer.history_knn query "ICA NARA JAR/25-03-20" -- -249,00
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ("", [])
+    if command == "build" and args:
+        started = time.perf_counter()
+        index = HistoryIndex.build(read_history_csv(Path(args[0])))
+        index.save(KNN_INDEX_PATH)
+        print(f"Indexed {len(index)} rows ({len(index.keys)} merchants, {len(index.counts)} groups) in "
+              f"{time.perf_counter() - started:.1f}s -> {KNN_INDEX_PATH}")
+    elif command == "query" and args:
+        index = HistoryIndex.load(KNN_INDEX_PATH)
+        amount = parse_amount(args[-1]) if len(args) > 1 else None
+        result = index.classify(args[0], amount or 0)
+        print(f"{result.category} (confidence {result.confidence:.2f}, amount {format_amount(amount or 0)})")
+        for neighbour in result.neighbours:
+            print(f"  {neighbour.similarity:.3f}  {neighbour.category:<30} {neighbour.count:>5}x  {neighbour.example}")
+    else:
+        print("Usage: python -m transaction_categorizer.history_knn build <export.csv> | query <description> [amount]")
@@ -0,0 +1,338 @@
+import atexit
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import METRICS_FLUSH_SECONDS, METRICS_PATH, METRICS_SINK
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # Spans are then only timed, not traced.
+    _otel_trace = None
+
+METRIC_PREFIX = "transaction_categorizer_"
+METRICS_SINKS = ("prometheus", "otlp")
+
+_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+_TURN_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24)
+_HISTOGRAM_BUCKETS = {
+    "stage_seconds": _SECONDS_BUCKETS,
+    "model_turn_seconds": _SECONDS_BUCKETS,
+    "transaction_seconds": _SECONDS_BUCKETS,
+    "tool_output_bytes": _BYTES_BUCKETS,
+    "model_turns_per_transaction": _TURN_BUCKETS,
+}
+_UNITS = {"stage_seconds": "s", "model_turn_seconds": "s", "transaction_seconds": "s", "tool_output_bytes": "By"}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ("bounds", "bucket_counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.bucket_counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape_label(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _otlp_attributes(labels: Labels) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": {"stringValue": value}} for key, value in labels]
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms, keyed by metric name and labels.
+
+    Everything is cumulative since start (or the last reset) and can be rendered in the
+    Prometheus text exposition format or as an OTLP/JSON ExportMetricsServiceRequest.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self.started_ns = time.time_ns()
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = _Histogram(_HISTOGRAM_BUCKETS.get(name, _SECONDS_BUCKETS))
+            histogram.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started_ns = time.time_ns()
+
+    def to_prometheus_text(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(histogram.bounds) + ["+Inf"], histogram.bucket_counts):
+                        cumulative += bucket_count
+                        le = 'le="' + (bound if isinstance(bound, str) else f"{bound:g}") + '"'
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_otlp_json(self) -> Dict[str, Any]:
+        now_ns = str(time.time_ns())
+        metrics: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            start_ns = str(self.started_ns)
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = metrics.setdefault(name, {
+                    "name": METRIC_PREFIX + name,
+                    "sum": {"aggregationTemporality": 2, "isMonotonic": True, "dataPoints": []},
+                })
+                metric["sum"]["dataPoints"].append({
+                    "attributes": _otlp_attributes(labels), "startTimeUnixNano": start_ns,
+                    "timeUnixNano": now_ns, "asDouble": value,
+                })
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                metric = metrics.setdefault(name, {
+                    "name": METRIC_PREFIX + name, "unit": _UNITS.get(name, "1"),
+                    "histogram": {"aggregationTemporality": 2, "dataPoints": []},
+                })
+                metric["histogram"]["dataPoints"].append({
+                    "attributes": _otlp_attributes(labels), "startTimeUnixNano": start_ns, "timeUnixNano": now_ns,
+                    "count": str(histogram.count), "sum": histogram.sum,
+                    "bucketCounts": [str(bucket_count) for bucket_count in histogram.bucket_counts],
+                    "explicitBounds": list(histogram.bounds),
+                })
+        return {"resourceMetrics": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "transaction_categorizer"}}]},
+            "scopeMetrics": [{"scope": {"name": "transaction_categorizer.instrumentation"}, "metrics": list(metrics.values())}],
+        }]}
+
+
+_registry = MetricsRegistry()
+_tracer = _otel_trace.get_tracer("transaction_categorizer") if _otel_trace is not None else None
+_flush_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """Adds value to the counter `name` (use a _total suffix) with these labels."""
+    _registry.add(name, value, _labels(labels))
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """Records one value of the histogram `name` with these labels."""
+    _registry.observe(name, value, _labels(labels))
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Times one stage (e.g. "gmail.messages.list") into stage_seconds{stage=...} and, when
+    OpenTelemetry is installed, opens a span of the same name. With AdkApp(enable_tracing=True)
+    that span is exported with the agent's own spans, as a child of the current tool call.
+    Yields the OpenTelemetry span (or None) so attributes can be added once known.
+    """
+    started = time.perf_counter()
+    failed = False
+    try:
+        if _tracer is None:
+            yield None
+        else:
+            with _tracer.start_as_current_span(stage, attributes=attributes or None) as otel_span:
+                yield otel_span
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+        if failed:
+            count("stage_errors_total", stage=stage)
+        maybe_flush()
+
+
+# --- Transactions ---
+
+# The transaction being categorized in this context. The gmail_agent's turns run inside
+# the root agent's tool call, so they see (and count into) the same transaction.
+_transaction: ContextVar[Optional[Dict[str, Any]]] = ContextVar("transaction", default=None)
+
+
+def start_transaction() -> None:
+    _transaction.set({"started": time.perf_counter(), "model_turns": 0, "turn_started": {}})
+
+
+def finish_transaction(answered_by: str) -> None:
+    """Records the transaction's duration and model turns; answered_by is e.g. "model" or "memo"."""
+    transaction = _transaction.get()
+    if transaction is None:
+        return
+    _transaction.set(None)
+    count("transactions_total", answered_by=answered_by)
+    observe("transaction_seconds", time.perf_counter() - transaction["started"], answered_by=answered_by)
+    observe("model_turns_per_transaction", transaction["model_turns"], answered_by=answered_by)
+    maybe_flush()
+
+
+# --- ADK callbacks ---
+
+def begin_transaction(callback_context: Any) -> None:
+    """before_agent_callback of the root agent; must come before any callback that may answer."""
+    start_transaction()
+    return None
+
+
+def end_transaction(callback_context: Any) -> None:
+    """after_agent_callback of the root agent: the model answered."""
+    finish_transaction("model")
+    return None
+
+
+def record_model_turn(callback_context: Any, llm_request: Any) -> None:
+    """before_model_callback: counts one model turn for the agent (and the current transaction)."""
+    agent = callback_context.agent_name
+    count("model_turns_total", agent=agent)
+    transaction = _transaction.get()
+    if transaction is not None:
+        transaction["model_turns"] += 1
+        transaction["turn_started"][agent] = time.perf_counter()
+    return None
+
+
+def record_model_response(callback_context: Any, llm_response: Any) -> None:
+    """after_model_callback: the model turn's duration."""
+    transaction = _transaction.get()
+    if transaction is None or getattr(llm_response, "partial", False):
+        return None
+    started = transaction["turn_started"].pop(callback_context.agent_name, None)
+    if started is not None:
+        observe("model_turn_seconds", time.perf_counter() - started, agent=callback_context.agent_name)
+    return None
+
+
+def record_tool_output(tool: Any, args: Dict[str, Any], tool_context: Any, tool_response: Any) -> None:
+    """after_tool_callback: the size of what the tool hands back to the model."""
+    size = len(json.dumps(tool_response, ensure_ascii=False, default=str).encode("utf-8"))
+    count("tool_calls_total", tool=tool.name)
+    count("tool_output_bytes_total", size, tool=tool.name)
+    observe("tool_output_bytes", size, tool=tool.name)
+    return None
+
+
+# --- Sinks ---
+
+def flush(sink: str = METRICS_SINK, path: Path = METRICS_PATH) -> Optional[Path]:
+    """
+    Writes the metrics to the sink: "prometheus" replaces path with the text exposition
+    format (for node_exporter's textfile collector or a scrape), "otlp" appends one
+    OTLP/JSON export request per line (the OpenTelemetry Collector file format).
+    """
+    global _last_flush
+    if sink not in METRICS_SINKS:
+        return None
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if sink == "prometheus":
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".metrics-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(_registry.to_prometheus_text())
+        os.replace(tmp_path, path)
+    else:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(_registry.to_otlp_json(), separators=(",", ":")) + "\n")
+    _last_flush = time.monotonic()
+    return path
+
+
+def maybe_flush() -> None:
+    """Flushes to the configured sink if the last flush is more than METRICS_FLUSH_SECONDS ago."""
+    if METRICS_SINK not in METRICS_SINKS or time.monotonic() - _last_flush < METRICS_FLUSH_SECONDS:
+        return
+    if _flush_lock.acquire(blocking=False):
+        try:
+            flush()
+        except OSError as e:
+            print(f"Could not write metrics to {METRICS_PATH}: {e}")
+        finally:
+            _flush_lock.release()
+
+
+def _flush_at_exit() -> None:
+    if _registry.counters or _registry.histograms:
+        flush()
+
+
+if METRICS_SINK in METRICS_SINKS:
+    atexit.register(_flush_at_exit)
+elif METRICS_SINK:
+    print(f"Unknown METRICS_SINK '{METRICS_SINK}'. Use one of: {', '.join(METRICS_SINKS)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.instrumentation [metrics.otlp.jsonl]
+    # Prints the last OTLP snapshot of a file sink in the Prometheus text format.
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else METRICS_PATH
+    with open(source, encoding="utf-8") as f:
+        last = None
+        for line in f:
+            last = line
+    if last is None:
+        print(f"No metrics in {source}.")
+        sys.exit(1)
+    for metric in json.loads(last)["resourceMetrics"][0]["scopeMetrics"][0]["metrics"]:
+        points = (metric.get("sum") or metric.get("histogram"))["dataPoints"]
+        for point in points:
+            labels = ",".join(f"{a['key']}={a['value']['stringValue']}" for a in point["attributes"])
+            value = point.get("asDouble", point.get("sum"))
+            extra = f" count={point['count']}" if "count" in point else ""
+            print(f"{metric['name']}{'{' + labels + '}' if labels else ''} {value:g}{extra}")
@@ -0,0 +1,168 @@
+import json
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from .config import MERCHANT_RULES_ENABLED, MERCHANT_RULES_FILE
+from .transactions import Transaction, parse_transaction_message
+
+T = TypeVar("T")
+
+# Card statement descriptions end with the purchase date: "ICA NARA JAR/25-03-20".
+_DATE_SUFFIX_PATTERN = re.compile(r'\s*/\s*\d{2}-\d{2}-\d{2}\s*$')
+# Card processors put their own prefix before the merchant: "K*BOKUS.COM", "PAYPAL *SPOTIFY", "SQ *CAFE".
+_PROCESSOR_PREFIX_PATTERN = re.compile(
+    r'^\s*(?:k|sq|iz|sumup|zettle|paypal|klarna|nets|bambora|dnh|swedbank pay)\s*[*_]\s*',
+    re.IGNORECASE,
+)
+_NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+NO_EMAIL_FOUND = "NO_EMAIL_FOUND"
+
+
+def normalize_description(description: str) -> str:
+    """
+    Normalizes a raw bank description for matching: lower-cased, trailing purchase
+    date and card-processor prefix removed, punctuation and whitespace collapsed.
+    "EASYPARK    /25-03-11" -> "easypark", "K*BOKUS.COM" -> "bokus com".
+    """
+    text = _DATE_SUFFIX_PATTERN.sub('', description or '')
+    text = _PROCESSOR_PREFIX_PATTERN.sub('', text)
+    return _NON_WORD_PATTERN.sub(' ', text.lower()).strip()
+
+
+class AhoCorasick(Generic[T]):
+    """Aho-Corasick automaton: finds every occurrence of a fixed set of patterns in one pass over the text."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, T]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, T]]] = [[]]
+        for pattern, value in patterns:
+            self._add(pattern, value)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, value: T) -> None:
+        state = 0
+        for character in pattern:
+            next_state = self._goto[state].get(character)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][character] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(pattern), value))
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and character not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(character, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> Iterator[Tuple[int, int, T]]:
+        """Yields (start, end, value) for every pattern occurrence, overlapping ones included."""
+        state = 0
+        for index, character in enumerate(text):
+            while state and character not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(character, 0)
+            for length, value in self._output[state]:
+                yield index + 1 - length, index + 1, value
+
+
+@dataclass
+class MerchantRule:
+    """A merchant whose transactions always belong to one category."""
+    id: str
+    patterns: List[str]
+    category: str
+    summary: str
+
+
+class MerchantRuleEngine:
+    """
+    Categorizes obvious transactions from a rule file without calling the model.
+
+    Patterns are matched as whole words against the normalized description. A match
+    is only used when it is unambiguous: if rules for different categories match,
+    the transaction is left to the agent.
+    """
+
+    def __init__(self, rules: List[MerchantRule]):
+        self.rules = rules
+        self._automaton: AhoCorasick[MerchantRule] = AhoCorasick(
+            (f" {normalize_description(pattern)} ", rule) for rule in rules for pattern in rule.patterns
+        )
+
+    @classmethod
+    def from_file(cls, path: Path) -> "MerchantRuleEngine":
+        """Loads rules from a JSON file of the form {"rules": [{"id", "patterns", "category", "summary"}, ...]}."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([
+            MerchantRule(id=rule['id'], patterns=rule['patterns'], category=rule['category'], summary=rule['summary'])
+            for rule in data.get('rules', [])
+        ])
+
+    def match(self, description: str) -> Optional[MerchantRule]:
+        """Returns the rule for a raw description, or None if no rule or conflicting rules match."""
+        text = f" {normalize_description(description)} "
+        best: Optional[Tuple[int, MerchantRule]] = None
+        categories = set()
+        for start, end, rule in self._automaton.find_all(text):
+            categories.add(rule.category)
+            if best is None or end - start > best[0]:
+                best = (end - start, rule)
+        if best is None or len(categories) > 1:
+            return None
+        return best[1]
+
+    def categorize(self, transaction: Transaction) -> Optional[Dict[str, str]]:
+        """Returns the agent's output JSON for a confidently matched transaction, or None."""
+        rule = self.match(transaction.description)
+        if rule is None:
+            return None
+        return {
+            "category": rule.category,
+            "summary": rule.summary,
+            "query": "",
+            "email_subject": NO_EMAIL_FOUND,
+        }
+
+    def categorize_message(self, message: str) -> Optional[Dict[str, str]]:
+        """Like categorize, for a message that contains a pasted statement row."""
+        transaction = parse_transaction_message(message)
+        if transaction is None:
+            return None
+        return self.categorize(transaction)
+
+
+_engine: Optional[MerchantRuleEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_rule_engine() -> Optional[MerchantRuleEngine]:
+    """Returns the process-wide rule engine, or None if rules are disabled or the rule file cannot be loaded."""
+    global _engine
+    if not MERCHANT_RULES_ENABLED:
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    _engine = MerchantRuleEngine.from_file(MERCHANT_RULES_FILE)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not load merchant rules from {MERCHANT_RULES_FILE}: {e}")
+                    return None
+    return _engine
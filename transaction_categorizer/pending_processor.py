@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .batch import BatchRowResult, CategorizeFn, categorize_transactions, in_process_categorizer, remote_categorizer
+from .config import (
+    BATCH_CONCURRENCY,
+    DEFAULT_STATUS,
+    NEW_TRANSACTIONS_SHEET_NAME,
+    PENDING_CHUNK_SIZE,
+    PENDING_JOURNAL_PATH,
+    SPREADSHEET_ID,
+)
+from .sheets import RowUpdate, SheetRow, SheetsClient, get_sheets_client
+from .sub_agents.gmail_agent.gmail_cache import connect_db
+from .transactions import transaction_from_target_row
+
+# Row states in the journal. "categorized": the model answered but the sheet is not
+# updated yet; "written": the answer is in the sheet; "failed": every attempt failed.
+CATEGORIZED = "categorized"
+WRITTEN = "written"
+FAILED = "failed"
+
+
+def row_fingerprint(row: SheetRow) -> str:
+    """Identifies a row's transaction, so a journaled result is never applied to a row that was edited or moved."""
+    key = "|".join(row.get(column).strip() for column in ("Date", "Outflow", "Inflow", "Account", "Memo"))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ProcessingJournal:
+    """
+    Local checkpoint of the PENDING_AI processor for one tab of one spreadsheet.
+
+    Holds the high-water mark (the last row known to need no more work; the next scan
+    starts below it) and the model's answer for every row it has categorized, so a run
+    that stops half-way can write those answers without asking the model again.
+    """
+
+    def __init__(self, db_path: str, spreadsheet_id: str = SPREADSHEET_ID, sheet: str = NEW_TRANSACTIONS_SHEET_NAME):
+        self.db_path = db_path
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet = sheet
+        self._lock = threading.Lock()
+        self._conn = connect_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    spreadsheet_id TEXT NOT NULL,
+                    sheet TEXT NOT NULL,
+                    high_water_mark INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (spreadsheet_id, sheet)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rows (
+                    spreadsheet_id TEXT NOT NULL,
+                    sheet TEXT NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (spreadsheet_id, sheet, row_number)
+                )
+                """
+            )
+
+    def high_water_mark(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT high_water_mark FROM state WHERE spreadsheet_id = ? AND sheet = ?",
+                (self.spreadsheet_id, self.sheet),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def set_high_water_mark(self, row_number: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (spreadsheet_id, sheet, high_water_mark, updated_at) VALUES (?, ?, ?, ?)",
+                (self.spreadsheet_id, self.sheet, row_number, time.time()),
+            )
+
+    def _put(self, row_number: int, fingerprint: str, status: str,
+             result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rows (spreadsheet_id, sheet, row_number, fingerprint, status, result, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.spreadsheet_id, self.sheet, row_number, fingerprint, status,
+                 json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time()),
+            )
+
+    def record_result(self, row_number: int, fingerprint: str, result: Dict[str, Any]) -> None:
+        self._put(row_number, fingerprint, CATEGORIZED, result=result)
+
+    def record_failure(self, row_number: int, fingerprint: str, error: str) -> None:
+        self._put(row_number, fingerprint, FAILED, error=error)
+
+    def mark_written(self, row_numbers: List[int]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE rows SET status = ?, updated_at = ? WHERE spreadsheet_id = ? AND sheet = ? AND row_number = ?",
+                [(WRITTEN, time.time(), self.spreadsheet_id, self.sheet, row_number) for row_number in row_numbers],
+            )
+
+    def results(self) -> Dict[int, Tuple[str, Dict[str, Any]]]:
+        """row_number -> (fingerprint, result) for rows the model has answered."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_number, fingerprint, result FROM rows "
+                "WHERE spreadsheet_id = ? AND sheet = ? AND status IN (?, ?)",
+                (self.spreadsheet_id, self.sheet, CATEGORIZED, WRITTEN),
+            ).fetchall()
+        return {row_number: (fingerprint, json.loads(result)) for row_number, fingerprint, result in rows}
+
+    def failed_rows(self) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_number FROM rows WHERE spreadsheet_id = ? AND sheet = ? AND status = ? ORDER BY row_number",
+                (self.spreadsheet_id, self.sheet, FAILED),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def reset(self) -> None:
+        """Forgets the high-water mark and every journaled row of this tab."""
+        with self._lock:
+            for table in ("state", "rows"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE spreadsheet_id = ? AND sheet = ?", (self.spreadsheet_id, self.sheet)
+                )
+
+
+@dataclass
+class ProcessingReport:
+    """What one run did: rows scanned from, pending rows found and how each was handled."""
+    scanned_from: int = 0
+    pending: int = 0
+    categorized: int = 0
+    reused: int = 0
+    written: int = 0
+    skipped: List[int] = field(default_factory=list)  # Rows that are not a usable transaction
+    failed: List[int] = field(default_factory=list)
+    high_water_mark: int = 0
+    sheet_requests: int = 0
+    elapsed_seconds: float = 0.0
+
+
+class PendingProcessor:
+    """
+    Categorizes the PENDING_AI rows of a tab incrementally and resumably.
+
+    Only rows below the journal's high-water mark are read. Pending rows are sent to the
+    model in chunks; every answer is journaled as soon as it arrives, and after each
+    chunk the answers are written to the sheet (Category and Status; Memo keeps the raw
+    bank description) and the high-water mark is moved past the chunk. If a row fails
+    (e.g. quota exhausted after all retries) the run writes what it has, leaves the
+    mark just above the failed row and stops, so the next run starts exactly there and
+    reuses journaled answers instead of asking the model (and Gmail) again. Rows that
+    are not a usable transaction do not stop the run; they are journaled as failed so
+    --retry_failed scans from them again once they are fixed.
+    """
+
+    def __init__(self, client: SheetsClient, journal: ProcessingJournal, categorize: CategorizeFn,
+                 chunk_size: int = PENDING_CHUNK_SIZE, concurrency: int = BATCH_CONCURRENCY):
+        self.client = client
+        self.journal = journal
+        self.categorize = categorize
+        self.chunk_size = max(chunk_size, 1)
+        self.concurrency = concurrency
+
+    def _write(self, header: List[str], rows: List[SheetRow], results: Dict[int, Dict[str, Any]]) -> int:
+        updates = [
+            RowUpdate(row.row_number, {"Category": results[row.row_number]["category"], "Status": DEFAULT_STATUS})
+            for row in rows if row.row_number in results
+        ]
+        if not updates:
+            return 0
+        self.client.write_updates(self.journal.sheet, header, updates)
+        self.journal.mark_written([update.row_number for update in updates])
+        return len(updates)
+
+    async def run(self, full_scan: bool = False, retry_failed: bool = False) -> ProcessingReport:
+        started = time.perf_counter()
+        requests_before = self.client.requests
+        report = ProcessingReport()
+        high_water_mark = 0 if full_scan else self.journal.high_water_mark()
+        failed_before = self.journal.failed_rows() if retry_failed else []
+        if failed_before:
+            high_water_mark = min(high_water_mark, failed_before[0] - 1)
+        report.scanned_from = high_water_mark + 1
+
+        # The mark row itself is read too: if it is gone, rows were deleted or the tab was
+        # replaced, and the mark no longer means anything, so the whole tab is scanned.
+        table = self.client.read_rows_from(self.journal.sheet, max(high_water_mark, 1))
+        if high_water_mark > 1 and (not table.rows or table.rows[0].row_number != high_water_mark):
+            print(f"Row {high_water_mark} of '{self.journal.sheet}' is gone; rescanning the whole tab.")
+            table = self.client.read_rows_from(self.journal.sheet, 1)
+            high_water_mark, report.scanned_from = 0, 1
+        table.rows = [row for row in table.rows if row.row_number > high_water_mark]
+        last_row = table.rows[-1].row_number if table.rows else high_water_mark
+        pending = table.pending()
+        report.pending = len(pending)
+
+        journaled = self.journal.results()
+        chunk_start = 0
+        while chunk_start < len(pending):
+            chunk = pending[chunk_start:chunk_start + self.chunk_size]
+            chunk_start += len(chunk)
+            results: Dict[int, Dict[str, Any]] = {}
+            to_send, send_rows = [], []
+            for row in chunk:
+                fingerprint = row_fingerprint(row)
+                previous = journaled.get(row.row_number)
+                if previous and previous[0] == fingerprint:
+                    results[row.row_number] = previous[1]
+                    report.reused += 1
+                    continue
+                transaction = transaction_from_target_row(row.values)
+                if transaction is None:
+                    # The mark still moves past it, so it is journaled like a failure for --retry_failed.
+                    print(f"Row {row.row_number} of '{self.journal.sheet}' is not a usable transaction; "
+                          f"leaving it pending (--retry_failed scans it again).")
+                    self.journal.record_failure(row.row_number, fingerprint, "not a usable transaction")
+                    report.skipped.append(row.row_number)
+                    continue
+                to_send.append(transaction)
+                send_rows.append((row, fingerprint))
+
+            def _on_row_done(batch_row: BatchRowResult) -> None:
+                row, fingerprint = send_rows[batch_row.index]
+                if batch_row.result is not None:
+                    results[row.row_number] = batch_row.result
+                    self.journal.record_result(row.row_number, fingerprint, batch_row.result)
+                else:
+                    self.journal.record_failure(row.row_number, fingerprint, batch_row.error or "no result")
+
+            if to_send:
+                batch = await categorize_transactions(
+                    to_send, self.categorize, concurrency=self.concurrency, on_row_done=_on_row_done,
+                    labels=[f"Row {row.row_number} of '{self.journal.sheet}'" for row, _ in send_rows],
+                )
+                report.categorized += sum(1 for row in batch.rows if row.result is not None)
+                report.failed.extend(send_rows[row.index][0].row_number for row in batch.rows if row.result is None)
+
+            report.written += self._write(table.header, chunk, results)
+            if report.failed:
+                high_water_mark = min(report.failed) - 1
+                self.journal.set_high_water_mark(high_water_mark)
+                print(f"{len(report.failed)} row(s) failed; stopping. The next run resumes at row {high_water_mark + 1}.")
+                break
+            high_water_mark = chunk[-1].row_number
+            self.journal.set_high_water_mark(high_water_mark)
+            print(f"Wrote {report.written}/{report.pending} pending rows (through row {high_water_mark}).")
+        else:
+            # Everything scanned is done; rows after the last pending one need nothing either.
+            high_water_mark = max(high_water_mark, last_row)
+            self.journal.set_high_water_mark(high_water_mark)
+
+        report.high_water_mark = high_water_mark
+        report.sheet_requests = self.client.requests - requests_before
+        report.elapsed_seconds = round(time.perf_counter() - started, 3)
+        return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Categorize the PENDING_AI rows of the budget spreadsheet.")
+    parser.add_argument("--sheet", default=NEW_TRANSACTIONS_SHEET_NAME)
+    parser.add_argument("--fake", help="Use this file-backed fake spreadsheet instead of Google Sheets.")
+    parser.add_argument("--journal", default=str(PENDING_JOURNAL_PATH))
+    parser.add_argument("--chunk_size", type=int, default=PENDING_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--resource_id", help="Use this deployed Agent Engine app instead of an in-process runner.")
+    parser.add_argument("--full_scan", action="store_true", help="Ignore the high-water mark and scan the whole tab.")
+    parser.add_argument("--retry_failed", action="store_true", help="Scan again from the first row that failed before.")
+    parser.add_argument("--reset", action="store_true", help="Forget the journal of this tab before running.")
+    args = parser.parse_args(argv)
+
+    client = get_sheets_client(args.fake)
+    if client is None:
+        return 1
+    journal = ProcessingJournal(args.journal, client.spreadsheet_id, args.sheet)
+    if args.reset:
+        journal.reset()
+    categorize = remote_categorizer(args.resource_id) if args.resource_id else in_process_categorizer()
+    processor = PendingProcessor(client, journal, categorize, chunk_size=args.chunk_size, concurrency=args.concurrency)
+    report = asyncio.run(processor.run(full_scan=args.full_scan, retry_failed=args.retry_failed))
+    print(json.dumps(report.__dict__))
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.pending_processor [--fake sheet.json] [--resource_id ...]
+    sys.exit(main())
@@ -111,14 +111,12 @@ You MUST follow these steps sequentially for EVERY transaction:
 <INSTRUCTIONS_FOR_EMAIL_SEARCH>
 ## INSTRUCTIONS FOR EMAIL SEARCH
 ONLY do this if the transaction cannot be categorized using the instructions in the <CATEGORIES_WITH_DESCRIPTIONS> list below.
-1_EMAIL_SEARCH:  **Construct Gmail Query:** Create a Gmail search query string. This query MUST include:
-    * The transaction `Amount` (often useful to include it in quotes, e.g., `"1123.45"`. Note that the amount could also have the format "1123,45" or "1 123,45" so make sure to create a query with proper use of "OR" operator for gmail search).
-    * Date constraints using `after:` and `before:`. Set a narrow window around the transaction `Date`, typically +/- 3 days (e.g., if Date is 2025-05-01, use `after:2025/04/28 before:2025/05/04`). Format dates as YYYY/MM/DD for Gmail search.
-    * *Example Query Construction:* For a transaction (Date: 2025-05-01, Amount: 1 049,12 kr, Raw Description: "CIRCLE K STOCKHOLM", Account: "SEB"), a good query would be: `"1049" OR "1049,12" OR "1049.12" OR "1 049" OR "1 049,12" OR "1 049.12" after:2025/04/28 before:2025/05/04`
-2_EMAIL_SEARCH:  **Execute Tool Call:** Call the `gmail_search_tool` tool with the constructed query string. Store the query you used.
-    * When calling the `gmail_search_tool`, pass the Gmail query string as a single string argument.
+1_EMAIL_SEARCH:  **Prepare the search:** Do NOT write a Gmail query yourself. The Gmail query (all formats of the amount such as "1049,12", "1049.12" and "1 049,12", keywords from the `Raw Description`, and a +/- 3 day date window) is built by the tool.
+2_EMAIL_SEARCH:  **Execute Tool Call:** Call the `gmail_search_tool` tool with the transaction exactly as given: `Date` (YYYY-MM-DD), `Amount` and `Raw Description`.
+    * The result contains the field "query" with the Gmail search query that was used; use it as the `query` in your output.
     * You will receive a JSON object with the following fields:
         {{
+            "query": "The Gmail search query that was used",
             "status": "success" if an email was found and processed or "error" if no email was found in which case the emails list will be []
             "emails": [
                 {{
@@ -157,3 +155,11 @@ The output MUST be a valid JSON object in this format:
 }}
 ONLY return the JSON object, nothing else.
 """
+
+# Appended to ROOT_AGENT_INSTRUCTION when the Gmail lookup is a plain function tool.
+DIRECT_LOOKUP_INSTRUCTION = """
+**Gmail lookup:** The `gmail_search_tool` is the `lookup_transaction_receipts` function. Call it with
+`date` (YYYY-MM-DD), `amount` and `description` (the `Raw Description`) exactly as given. It returns
+"query", "status" and "emails", where each email has "id", "subject", "date", "amount", "company",
+"summary" and "payment_details". Use the "subject" of the most relevant email as `email_subject`.
+"""
@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from .config import BATCH_CONCURRENCY
+from .remote_stream import FinalAnswer, StreamEvent, TextChunk, ToolCallStarted, iter_stream_events
+
+DEFAULT_USER_ID = "batch"
+
+
+@dataclass
+class RemoteReply:
+    """The deployed agent's answer to one message; error is set instead if the call failed."""
+    message: str
+    session_id: Optional[str] = None
+    final_text: str = ""  # The answer object's text, or the last text if there was no answer object
+    result: Optional[Dict[str, Any]] = None  # The parsed answer object
+    tool_calls: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def _drain(events: Iterator[Dict[str, Any]]) -> None:
+    try:
+        for _ in events:
+            pass
+    except Exception as e:
+        print(f"Error reading the rest of a stream_query response: {e}")
+
+
+# Reads streams to their end after the answer was taken from them, so the server-side
+# run is not cancelled halfway while the caller already moves on.
+_drain_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="remote-agent-drain")
+
+
+class RemoteAgentClient:
+    """
+    Handle on one deployed Agent Engine app.
+
+    The engine is resolved (agent_engines.get, a control-plane round trip) once, on first
+    use, and the resulting AgentEngine is kept: its execution client holds one gRPC channel
+    whose connection is reused by every later call, including concurrent ones from
+    send_many's worker threads.
+    """
+
+    def __init__(self, resource_id: str, user_id: str = DEFAULT_USER_ID):
+        self.resource_id = resource_id
+        self.user_id = user_id
+        self._app: Optional[Any] = None
+        self._lock = threading.Lock()
+
+    @property
+    def app(self) -> Any:
+        """The resolved AgentEngine."""
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    from vertexai import agent_engines
+
+                    self._app = agent_engines.get(self.resource_id)
+        return self._app
+
+    def create_session(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        return self.app.create_session(user_id=user_id or self.user_id)
+
+    def list_sessions(self, user_id: Optional[str] = None) -> Any:
+        return self.app.list_sessions(user_id=user_id or self.user_id)
+
+    def get_session(self, session_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        return self.app.get_session(user_id=user_id or self.user_id, session_id=session_id)
+
+    def stream(self, session_id: str, message: str, user_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """The agent's events for message in an existing session, as they arrive."""
+        return self.app.stream_query(user_id=user_id or self.user_id, session_id=session_id, message=message)
+
+    def stream_events(self, session_id: str, message: str, user_id: Optional[str] = None) -> Iterator[StreamEvent]:
+        """Typed events (tool calls, text, the final answer) for message, as they arrive."""
+        return iter_stream_events(self.stream(session_id, message, user_id))
+
+    def send(self, message: str, session_id: Optional[str] = None) -> RemoteReply:
+        """
+        Sends one message, in a new session unless session_id is given; errors end up in
+        the reply. Returns as soon as the (validated, non-partial) turn holding the answer
+        object arrives: the rest of the stream is read in the background.
+        """
+        started = time.perf_counter()
+        reply = RemoteReply(message, session_id)
+        try:
+            if reply.session_id is None:
+                reply.session_id = self.create_session()['id']
+            raw_events = iter(self.stream(reply.session_id, message))
+            for event in iter_stream_events(raw_events):
+                if isinstance(event, ToolCallStarted):
+                    reply.tool_calls.append(event.name)
+                elif isinstance(event, TextChunk) and not event.partial:
+                    reply.final_text = event.text
+                elif isinstance(event, FinalAnswer):
+                    reply.result, reply.final_text = event.result, event.text
+                    _drain_pool.submit(_drain, raw_events)
+                    break
+        except Exception as e:
+            reply.error = f"{type(e).__name__}: {e}"
+        reply.seconds = time.perf_counter() - started
+        return reply
+
+    def send_many(
+        self,
+        messages: Sequence[str],
+        concurrency: int = BATCH_CONCURRENCY,
+        on_reply: Optional[Callable[[int, RemoteReply], None]] = None,
+    ) -> List[RemoteReply]:
+        """
+        Sends every message in its own session, at most `concurrency` at a time, and
+        returns the replies in input order. on_reply(index, reply) is called from the
+        worker thread as each one finishes.
+        """
+        def _send(index: int) -> RemoteReply:
+            reply = self.send(messages[index])
+            if on_reply is not None:
+                on_reply(index, reply)
+            return reply
+
+        self.app  # Resolve once up front instead of racing for it in every worker.
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="remote-agent") as pool:
+            return list(pool.map(_send, range(len(messages))))
+
+
+_clients: Dict[tuple, RemoteAgentClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_remote_client(resource_id: str, user_id: str = DEFAULT_USER_ID) -> RemoteAgentClient:
+    """Returns the process-wide client for a deployed app, so it is resolved only once."""
+    key = (resource_id, user_id)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = RemoteAgentClient(resource_id, user_id)
+    return client
@@ -0,0 +1,148 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from .categorization_memo import parse_agent_result
+
+# Longest answer object the scanner buffers; anything longer is not the agent's answer.
+MAX_ANSWER_CHARS = 64 * 1024
+
+
+@dataclass(frozen=True)
+class ToolCallStarted:
+    author: str
+    name: str
+    args: Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class ToolCallFinished:
+    author: str
+    name: str
+    response: Any
+
+
+@dataclass(frozen=True)
+class TextChunk:
+    """Model text as it arrives; partial chunks are deltas, a non-partial chunk is a whole turn."""
+    author: str
+    text: str
+    partial: bool
+
+
+@dataclass(frozen=True)
+class FinalAnswer:
+    """The agent's {category, summary, query, email_subject} object, parsed from the turn that completed it."""
+    author: str
+    result: Dict[str, Any]
+    text: str
+
+
+StreamEvent = Union[ToolCallStarted, ToolCallFinished, TextChunk, FinalAnswer]
+
+
+class AnswerScanner:
+    """
+    Finds complete top-level JSON objects in text fed chunk by chunk.
+
+    Only the object being read is buffered (never the text before it), so memory stays
+    bounded however long the stream is. Strings in double or single quotes are skipped
+    when counting braces, as parse_agent_result accepts both.
+    """
+
+    def __init__(self, max_chars: int = MAX_ANSWER_CHARS):
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self) -> None:
+        self._buffer: List[str] = []
+        self._size = 0
+        self._depth = 0
+        self._quote: Optional[str] = None
+        self._escaped = False
+
+    def feed(self, text: str) -> List[str]:
+        """The objects whose closing brace was in this chunk (usually none), in order."""
+        found = []
+        start = 0
+        for index, char in enumerate(text):
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    start = index
+                continue
+            if self._quote is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == self._quote:
+                    self._quote = None
+            elif char in '"\'':
+                self._quote = char
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buffer.append(text[start:index + 1])
+                    found.append("".join(self._buffer))
+                    self.reset()
+        if self._depth:
+            self._buffer.append(text[start:])
+            self._size += len(text) - start
+            if self._size > self.max_chars:
+                self.reset()
+        return found
+
+
+def format_event(event: StreamEvent) -> str:
+    """One line describing an event, for printing a conversation as it streams."""
+    if isinstance(event, ToolCallStarted):
+        return f"[{event.author}] calls {event.name}({json.dumps(event.args, ensure_ascii=False)})"
+    if isinstance(event, ToolCallFinished):
+        size = len(json.dumps(event.response, ensure_ascii=False, default=str))
+        return f"[{event.author}] {event.name} returned {size} chars"
+    if isinstance(event, FinalAnswer):
+        return f"[{event.author}] answer: {json.dumps(event.result, ensure_ascii=False)}"
+    return f"[{event.author}] {event.text}"
+
+
+def _is_answer(result: Optional[Dict[str, Any]]) -> bool:
+    return result is not None and "category" in result
+
+
+def iter_stream_events(events: Iterable[Dict[str, Any]]) -> Iterator[StreamEvent]:
+    """
+    Turns stream_query's event dicts into typed events as they arrive.
+
+    A FinalAnswer is yielded, at most once per stream, when a complete (non-partial)
+    text turn holds the answer object. Partial chunks are passed on as TextChunks only:
+    validate_category rewrites the final response, not the deltas streamed before it,
+    so an answer read from them could carry a category that is not in BackendData.
+    Events are not kept.
+    """
+    scanner = AnswerScanner()
+    answered = False
+    for event in events:
+        author = event.get('author') or ""
+        partial = bool(event.get('partial'))
+        for part in (event.get('content') or {}).get('parts') or []:
+            if part.get('function_call'):
+                call = part['function_call']
+                yield ToolCallStarted(author, call.get('name') or "", call.get('args') or {})
+            elif part.get('function_response'):
+                response = part['function_response']
+                yield ToolCallFinished(author, response.get('name') or "", response.get('response'))
+            elif part.get('text') and not part.get('thought'):
+                text = part['text']
+                yield TextChunk(author, text, partial)
+                if answered or partial:
+                    continue
+                for found in scanner.feed(text):
+                    result = parse_agent_result(found)
+                    if _is_answer(result):
+                        answered = True
+                        yield FinalAnswer(author, result, found)
+                        break
+        scanner.reset()
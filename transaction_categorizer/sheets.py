@@ -0,0 +1,360 @@
+import argparse
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from googleapiclient.errors import HttpError
+
+from .config import (
+    ACCOUNTS_COLUMN,
+    BACKEND_DATA_SHEET_NAME,
+    CATEGORIES_COLUMN,
+    CREDENTIALS_DIR,
+    DEFAULT_CLIENT_SECRET_PATTERN,
+    HEADER_ROW_BACKEND,
+    HEADER_ROW_TRANSACTIONS,
+    NEW_TRANSACTIONS_SHEET_NAME,
+    PLACEHOLDER_CATEGORY,
+    SHEETS_SCOPES,
+    SHEETS_BACKOFF_BASE_SECONDS,
+    SHEETS_BACKOFF_MAX_SECONDS,
+    SHEETS_MAX_RANGES_PER_REQUEST,
+    SHEETS_MAX_RETRIES,
+    SHEETS_TOKEN_PATH,
+    SPREADSHEET_ID,
+    TARGET_COLUMNS,
+)
+from .sub_agents.gmail_agent.gmail_service import GmailServiceHolder
+
+_A1_CELL_PATTERN = re.compile(r'^([A-Z]*)(\d*)$')
+
+
+def column_letter(index: int) -> str:
+    """0 -> "A", 25 -> "Z", 26 -> "AA"."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def column_index(letters: str) -> int:
+    """"A" -> 0, "AA" -> 26."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def quote_sheet_name(sheet: str) -> str:
+    return "'" + sheet.replace("'", "''") + "'"
+
+
+def a1_range(sheet: str, first_row: int, last_row: int, first_column: int, last_column: int) -> str:
+    """A1 notation for a rectangle; rows are 1-based, columns 0-based: ('Tab', 2, 3, 0, 1) -> "'Tab'!A2:B3"."""
+    return (f"{quote_sheet_name(sheet)}!{column_letter(first_column)}{first_row}:"
+            f"{column_letter(last_column)}{last_row}")
+
+
+def parse_a1_range(range_name: str) -> Tuple[str, int, Optional[int], int, Optional[int]]:
+    """
+    Splits "'Tab'!B2:D" into (sheet, first_row, last_row, first_column, last_column); open
+    ends are None and a bare sheet name covers the whole sheet. Rows 1-based, columns 0-based.
+    """
+    sheet, _, cells = range_name.rpartition("!") if "!" in range_name else (range_name, "", "")
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    if not cells:
+        return sheet, 1, None, 0, None
+    start, _, end = cells.partition(":")
+    start_letters, start_digits = _A1_CELL_PATTERN.match(start.upper()).groups()
+    end_letters, end_digits = _A1_CELL_PATTERN.match((end or start).upper()).groups()
+    return (
+        sheet,
+        int(start_digits) if start_digits else 1,
+        int(end_digits) if end_digits else None,
+        column_index(start_letters) if start_letters else 0,
+        column_index(end_letters) if end_letters else None,
+    )
+
+
+@dataclass
+class SheetRow:
+    """One data row of a tab, with values keyed by header name."""
+    row_number: int  # 1-based, as shown in the sheet
+    values: Dict[str, str]
+
+    def get(self, column: str) -> str:
+        return self.values.get(column, "")
+
+
+@dataclass
+class SheetTable:
+    """A tab read as a header row plus data rows."""
+    sheet: str
+    header: List[str]
+    rows: List[SheetRow] = field(default_factory=list)
+
+    def pending(self) -> List[SheetRow]:
+        """Rows still waiting for a category (Category == PLACEHOLDER_CATEGORY)."""
+        return [row for row in self.rows if row.get("Category").strip() == PLACEHOLDER_CATEGORY]
+
+
+@dataclass
+class RowUpdate:
+    """New values for some columns (by header name) of one row."""
+    row_number: int
+    values: Dict[str, str]
+
+
+def coalesce_updates(sheet: str, header: Sequence[str], updates: Iterable[RowUpdate]) -> List[Dict[str, Any]]:
+    """
+    Turns row updates into as few value ranges as possible: each row's columns are split
+    into runs of adjacent columns, and runs spanning the same columns on consecutive rows
+    are merged into one rectangle. Later updates of the same cell win.
+    """
+    positions = {name: index for index, name in enumerate(header)}
+    cells: Dict[int, Dict[int, str]] = {}
+    for update in updates:
+        row_cells = cells.setdefault(update.row_number, {})
+        for column, value in update.values.items():
+            if column not in positions:
+                raise KeyError(f"Column '{column}' is not in the header of '{sheet}'.")
+            row_cells[positions[column]] = "" if value is None else str(value)
+
+    runs: List[Tuple[int, int, int, List[str]]] = []  # (first column, last column, row, values)
+    for row_number, row_cells in cells.items():
+        columns = sorted(row_cells)
+        start = 0
+        for position in range(1, len(columns) + 1):
+            if position == len(columns) or columns[position] != columns[position - 1] + 1:
+                run = columns[start:position]
+                runs.append((run[0], run[-1], row_number, [row_cells[column] for column in run]))
+                start = position
+    runs.sort(key=lambda run: (run[0], run[1], run[2]))
+
+    data: List[Dict[str, Any]] = []
+    block: List[Tuple[int, int, int, List[str]]] = []
+    for run in runs + [None]:
+        if block and (run is None or run[:2] != block[-1][:2] or run[2] != block[-1][2] + 1):
+            first_column, last_column = block[0][0], block[0][1]
+            data.append({
+                "range": a1_range(sheet, block[0][2], block[-1][2], first_column, last_column),
+                "values": [values for _, _, _, values in block],
+            })
+            block = []
+        if run is not None:
+            block.append(run)
+    return data
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def _retry_delay(attempt: int) -> float:
+    ceiling = min(SHEETS_BACKOFF_BASE_SECONDS * (2 ** attempt), SHEETS_BACKOFF_MAX_SECONDS)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class SheetsClient:
+    """
+    Bulk reads and writes against the budget spreadsheet.
+
+    Reads fetch every needed range in one values.batchGet; writes are coalesced into
+    rectangles and sent with values.batchUpdate, SHEETS_MAX_RANGES_PER_REQUEST ranges
+    per request. Quota (429) and server errors are retried with backoff. Works with
+    the real Sheets service or FakeSheetsService (see fake_sheets.py). With a Drive
+    service the spreadsheet's modifiedTime can be asked for as well.
+    """
+
+    def __init__(self, service: Any, spreadsheet_id: str = SPREADSHEET_ID,
+                 max_ranges_per_request: int = SHEETS_MAX_RANGES_PER_REQUEST,
+                 max_retries: int = SHEETS_MAX_RETRIES, drive_service: Any = None):
+        self.service = service
+        self.drive_service = drive_service
+        self.spreadsheet_id = spreadsheet_id
+        self.max_ranges_per_request = max_ranges_per_request
+        self.max_retries = max_retries
+        self.requests = 0
+
+    def _execute(self, request: Any, description: str) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                return request.execute()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                delay = _retry_delay(attempt)
+                attempt += 1
+                print(f"Sheets {description} failed ({e}); retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries}).")
+                time.sleep(delay)
+
+    def batch_get(self, ranges: Sequence[str]) -> List[List[List[str]]]:
+        """Returns the values of each range (a list of rows), in the order asked for."""
+        response = self._execute(
+            self.service.spreadsheets().values().batchGet(
+                spreadsheetId=self.spreadsheet_id, ranges=list(ranges),
+                valueRenderOption="FORMATTED_VALUE", majorDimension="ROWS",
+            ),
+            "batchGet",
+        )
+        return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+    def modified_time(self) -> Optional[str]:
+        """The spreadsheet's Drive modifiedTime (RFC 3339), or None if it cannot be read."""
+        if self.drive_service is None:
+            return None
+        try:
+            response = self._execute(
+                self.drive_service.files().get(fileId=self.spreadsheet_id, fields="modifiedTime"), "files.get"
+            )
+        except HttpError as e:
+            print(f"Could not read the spreadsheet's modifiedTime: {e}")
+            return None
+        return response.get("modifiedTime")
+
+    def read_tables(self, sheets: Sequence[str], header_row: int = HEADER_ROW_TRANSACTIONS) -> Dict[str, SheetTable]:
+        """Reads whole tabs in one request; the row header_row holds the column names."""
+        tables = {}
+        for sheet, values in zip(sheets, self.batch_get([quote_sheet_name(sheet) for sheet in sheets])):
+            header = [str(name).strip() for name in (values[header_row - 1] if len(values) >= header_row else [])]
+            table = SheetTable(sheet, header)
+            for offset, row in enumerate(values[header_row:]):
+                if not any(str(cell).strip() for cell in row):
+                    continue
+                padded = list(row) + [""] * (len(header) - len(row))
+                table.rows.append(SheetRow(header_row + 1 + offset, dict(zip(header, map(str, padded)))))
+            tables[sheet] = table
+        return tables
+
+    def read_rows_from(self, sheet: str, first_row: int, width: int = len(TARGET_COLUMNS),
+                       header_row: int = HEADER_ROW_TRANSACTIONS) -> SheetTable:
+        """
+        Reads the header row and the rows from first_row down (the first `width` columns),
+        in one request, so a scan can start where the previous one stopped.
+        """
+        last_column = column_letter(width - 1)
+        header_values, values = self.batch_get([
+            f"{quote_sheet_name(sheet)}!A{header_row}:{last_column}{header_row}",
+            f"{quote_sheet_name(sheet)}!A{max(first_row, header_row + 1)}:{last_column}",
+        ])
+        header = [str(name).strip() for name in (header_values[0] if header_values else [])]
+        table = SheetTable(sheet, header)
+        for offset, row in enumerate(values):
+            if any(str(cell).strip() for cell in row):
+                padded = list(row) + [""] * (len(header) - len(row))
+                table.rows.append(SheetRow(max(first_row, header_row + 1) + offset, dict(zip(header, map(str, padded)))))
+        return table
+
+    def read_pending(self, sheet: str = NEW_TRANSACTIONS_SHEET_NAME) -> SheetTable:
+        """Reads a tab and keeps only the rows that still need a category."""
+        table = self.read_tables([sheet])[sheet]
+        table.rows = table.pending()
+        return table
+
+    def read_backend_lists(self) -> Dict[str, List[str]]:
+        """The valid accounts and categories listed in BackendData, in one request."""
+        first_row = HEADER_ROW_BACKEND + 1
+        accounts, categories = self.batch_get([
+            f"{quote_sheet_name(BACKEND_DATA_SHEET_NAME)}!{column}{first_row}:{column}"
+            for column in (ACCOUNTS_COLUMN, CATEGORIES_COLUMN)
+        ])
+        return {
+            "accounts": [row[0].strip() for row in accounts if row and str(row[0]).strip()],
+            "categories": [row[0].strip() for row in categories if row and str(row[0]).strip()],
+        }
+
+    def write_updates(self, sheet: str, header: Sequence[str], updates: Iterable[RowUpdate]) -> int:
+        """
+        Writes row updates (e.g. Category, Memo and Status) with as few requests as possible.
+        Values are written as RAW so memo text is never interpreted as a formula.
+        Returns the number of cells written.
+        """
+        data = coalesce_updates(sheet, header, updates)
+        written = 0
+        for start in range(0, len(data), self.max_ranges_per_request):
+            response = self._execute(
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "RAW", "data": data[start:start + self.max_ranges_per_request]},
+                ),
+                "batchUpdate",
+            )
+            written += response.get("totalUpdatedCells", 0)
+        return written
+
+
+_service_holders: Dict[str, GmailServiceHolder] = {}
+_service_holder_lock = threading.Lock()
+
+
+def _client_secret_file() -> str:
+    matches = sorted(Path(CREDENTIALS_DIR).glob(DEFAULT_CLIENT_SECRET_PATTERN))
+    return str(matches[0] if matches else Path(CREDENTIALS_DIR) / "client_secret.json")
+
+
+def _get_service(api_name: str, api_version: str) -> Optional[Any]:
+    """This thread's service for the API, authenticated with the shared Sheets token."""
+    holder = _service_holders.get(api_name)
+    if holder is None:
+        with _service_holder_lock:
+            holder = _service_holders.get(api_name)
+            if holder is None:
+                Path(CREDENTIALS_DIR).mkdir(parents=True, exist_ok=True)
+                holder = _service_holders[api_name] = GmailServiceHolder(
+                    str(SHEETS_TOKEN_PATH), _client_secret_file(), SHEETS_SCOPES,
+                    discovery_document_file=None, api_name=api_name, api_version=api_version,
+                )
+    return holder.get_service()
+
+
+def get_sheets_service() -> Optional[Any]:
+    """Authenticates with the Sheets API and returns this thread's service object."""
+    return _get_service("sheets", "v4")
+
+
+def get_drive_service() -> Optional[Any]:
+    """The Drive service, used only to read the spreadsheet's modifiedTime."""
+    return _get_service("drive", "v3")
+
+
+def get_sheets_client(fake_path: Optional[str] = None) -> Optional[SheetsClient]:
+    """A client for SPREADSHEET_ID, or for the file-backed fake spreadsheet at fake_path."""
+    if fake_path:
+        from .fake_sheets import FakeSheetsService
+        fake = FakeSheetsService(fake_path)
+        return SheetsClient(fake, drive_service=fake)
+    service = get_sheets_service()
+    if service is None:
+        print("Failed to get Sheets service.")
+        return None
+    return SheetsClient(service, drive_service=get_drive_service())
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.sheets pending [--fake sheet.json]
+    # python -m transaction_categorizer.sheets backend [--fake sheet.json]
+    parser = argparse.ArgumentParser(description="Inspect the budget spreadsheet.")
+    parser.add_argument("command", choices=["pending", "backend"])
+    parser.add_argument("--fake", help="Use this file-backed fake spreadsheet instead of Google Sheets.")
+    args = parser.parse_args()
+    client = get_sheets_client(args.fake)
+    if client is not None:
+        if args.command == "pending":
+            table = client.read_pending()
+            for row in table.rows:
+                print(row.row_number, "\t".join(row.get(column) for column in table.header))
+            print(f"{len(table.rows)} pending rows in '{table.sheet}'.")
+        else:
+            for name, values in client.read_backend_lists().items():
+                print(f"{name}: {', '.join(values)}")
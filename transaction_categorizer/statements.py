@@ -0,0 +1,240 @@
+import csv
+import datetime
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+from .config import TARGET_COLUMNS
+from .transactions import Transaction, account_display_name
+
+# Rows are parsed and normalized in chunks of this many lines.
+CHUNK_SIZE = 4096
+
+# Joins a chunk of amount strings so they can be normalized with one translate() call.
+_FIELD_SEPARATOR = "\x1f"
+
+
+@dataclass(frozen=True)
+class StatementFormat:
+    """
+    How to read one bank's export. Columns are found by header name (first match
+    wins); headerless files fall back to the positional columns.
+    """
+    date_columns: Tuple[str, ...]
+    description_columns: Tuple[str, ...]
+    amount_columns: Tuple[str, ...]
+    reference_columns: Tuple[str, ...] = ()
+    fee_columns: Tuple[str, ...] = ()
+    state_columns: Tuple[str, ...] = ()
+    skipped_states: Tuple[str, ...] = ()
+    decimal_separator: str = ","
+    # Card statements list purchases as positive amounts; they are outflows.
+    positive_is_outflow: bool = False
+    # (date, reference or None, description, amount) positions for files without a header row.
+    positional_columns: Optional[Tuple[int, Optional[int], int, int]] = None
+
+
+# Keyed like ACCOUNT_NAME_MAP.
+STATEMENT_FORMATS: Dict[str, StatementFormat] = {
+    # "2025-03-11\t5484654361\tEASYPARK    /25-03-11\t-34,50\t23 035,62"
+    "seb": StatementFormat(
+        date_columns=("Bokföringsdatum", "Bokförd", "Datum"),
+        description_columns=("Text/mottagare", "Text", "Mottagare"),
+        amount_columns=("Belopp",),
+        reference_columns=("Verifikationsnummer",),
+        positional_columns=(0, 1, 2, 3),
+    ),
+    # "CARD_PAYMENT,Current,2025-03-10 18:01:22,2025-03-11 09:12:40,Spotify,-119.00,0.00,SEK,COMPLETED,1520.30"
+    "revolut": StatementFormat(
+        date_columns=("Completed Date", "Started Date"),
+        description_columns=("Description",),
+        amount_columns=("Amount",),
+        fee_columns=("Fee",),
+        state_columns=("State",),
+        skipped_states=("REVERTED", "DECLINED", "FAILED"),
+        decimal_separator=".",
+    ),
+    "firstcard": StatementFormat(
+        date_columns=("Datum", "Köpdatum", "Transaktionsdatum"),
+        description_columns=("Reseinformation / Inköpsplats", "Inköpsplats", "Beskrivning", "Specifikation", "Text"),
+        amount_columns=("Belopp", "Belopp i SEK"),
+        positive_is_outflow=True,
+        positional_columns=(0, None, 1, 2),
+    ),
+    "strawberry": StatementFormat(
+        date_columns=("Datum", "Köpdatum", "Bokfört"),
+        description_columns=("Specifikation", "Beskrivning", "Text"),
+        amount_columns=("Belopp", "Belopp i SEK"),
+        positive_is_outflow=True,
+        positional_columns=(0, None, 1, 2),
+    ),
+}
+
+
+def normalize_amounts(values: Sequence[str], decimal_separator: str = ",") -> List[Optional[int]]:
+    """
+    Converts a column of amount strings to integer öre in one pass: the whole chunk
+    is cleaned with a single str.translate call, then split and converted.
+    Unparseable values become None.
+    """
+    thousands_separator = "." if decimal_separator == "," else ","
+    table = str.maketrans({
+        " ": None, "\u00a0": None, "\u202f": None, "'": None,
+        thousands_separator: None, decimal_separator: ".", "\u2212": "-",
+    })
+    cleaned = _FIELD_SEPARATOR.join(values).translate(table).split(_FIELD_SEPARATOR)
+    amounts: List[Optional[int]] = []
+    for value in cleaned:
+        negative = value.startswith("-")
+        whole, _, fraction = value.lstrip("+-").partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()) or len(fraction) > 2:
+            amounts.append(None)
+            continue
+        ore = int(whole) * 100 + (int(fraction.ljust(2, "0")) if fraction else 0)
+        amounts.append(-ore if negative else ore)
+    return amounts
+
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d.%m.%Y", "%Y%m%d")
+
+
+def _parse_date(value: str, cache: Dict[str, Optional[datetime.date]]) -> Optional[datetime.date]:
+    # Statements repeat the same few dates many times; parse each one once.
+    if value in cache:
+        return cache[value]
+    text = value.strip()[:10]
+    parsed = None
+    for date_format in _DATE_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, date_format).date()
+            break
+        except ValueError:
+            continue
+    cache[value] = parsed
+    return parsed
+
+
+def _sniff_delimiter(first_line: str) -> str:
+    counts = {delimiter: first_line.count(delimiter) for delimiter in ("\t", ";", ",")}
+    return max(counts, key=counts.get) if any(counts.values()) else "\t"
+
+
+def _column_index(header: List[str], candidates: Tuple[str, ...]) -> Optional[int]:
+    normalized = [name.strip().lower() for name in header]
+    for candidate in candidates:
+        if candidate.lower() in normalized:
+            return normalized.index(candidate.lower())
+    return None
+
+
+class _Columns:
+    """Resolved column positions for one file."""
+
+    def __init__(self, statement_format: StatementFormat, header: Optional[List[str]]):
+        if header is not None:
+            self.date = _column_index(header, statement_format.date_columns)
+            self.description = _column_index(header, statement_format.description_columns)
+            self.amount = _column_index(header, statement_format.amount_columns)
+            self.reference = _column_index(header, statement_format.reference_columns)
+            self.fee = _column_index(header, statement_format.fee_columns)
+            self.state = _column_index(header, statement_format.state_columns)
+        else:
+            self.date, self.reference, self.description, self.amount = statement_format.positional_columns
+            self.fee = self.state = None
+        if self.date is None or self.description is None or self.amount is None:
+            raise ValueError(f"Statement header {header} lacks a date, description or amount column.")
+
+
+def iter_statement(
+    source: Union[str, TextIO, Iterable[str]],
+    account: str,
+    chunk_size: int = CHUNK_SIZE
+) -> Iterator[Transaction]:
+    """
+    Streams Transaction records out of a statement export for one account
+    (a key of ACCOUNT_NAME_MAP / STATEMENT_FORMATS).
+
+    `source` is a file path, an open text file or any iterable of lines. Only one
+    chunk of rows is held at a time, so files of any size use constant memory.
+    Rows without a valid date or amount (headers, totals, blank lines) are skipped.
+    """
+    statement_format = STATEMENT_FORMATS.get(account.lower())
+    if statement_format is None:
+        raise ValueError(f"Unknown statement format '{account}'. Known: {', '.join(STATEMENT_FORMATS)}")
+    if isinstance(source, str):
+        with open(source, encoding="utf-8-sig", newline="") as f:
+            yield from iter_statement(f, account, chunk_size)
+        return
+
+    lines = iter(source)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    delimiter = _sniff_delimiter(first_line)
+    rows = csv.reader(_chain_first(first_line, lines), delimiter=delimiter)
+    first_row = next(rows, [])
+    has_header = _column_index(first_row, statement_format.date_columns + statement_format.amount_columns) is not None
+    if not has_header and statement_format.positional_columns is None:
+        raise ValueError(f"The {account} statement format needs a header row.")
+    columns = _Columns(statement_format, first_row if has_header else None)
+    display_name = account_display_name(account)
+    date_cache: Dict[str, Optional[datetime.date]] = {}
+
+    chunk: List[List[str]] = [] if has_header else [first_row]
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from _parse_chunk(chunk, columns, statement_format, display_name, date_cache)
+            chunk = []
+    if chunk:
+        yield from _parse_chunk(chunk, columns, statement_format, display_name, date_cache)
+
+
+def _chain_first(first_line: str, lines: Iterator[str]) -> Iterator[str]:
+    yield first_line
+    yield from lines
+
+
+def _cell(row: List[str], index: Optional[int]) -> str:
+    return row[index] if index is not None and index < len(row) else ""
+
+
+def _parse_chunk(
+    chunk: List[List[str]],
+    columns: _Columns,
+    statement_format: StatementFormat,
+    account: str,
+    date_cache: Dict[str, Optional[datetime.date]]
+) -> Iterator[Transaction]:
+    amounts = normalize_amounts([_cell(row, columns.amount) for row in chunk], statement_format.decimal_separator)
+    fees = (normalize_amounts([_cell(row, columns.fee) or "0" for row in chunk], statement_format.decimal_separator)
+            if columns.fee is not None else None)
+    sign = -1 if statement_format.positive_is_outflow else 1
+    for position, row in enumerate(chunk):
+        amount = amounts[position]
+        if amount is None:
+            continue
+        if columns.state is not None and _cell(row, columns.state).strip().upper() in statement_format.skipped_states:
+            continue
+        date = _parse_date(_cell(row, columns.date), date_cache)
+        if date is None:
+            continue
+        if fees is not None and fees[position]:
+            # Revolut lists fees separately; they are part of what left the account.
+            amount -= abs(fees[position])
+        yield Transaction(
+            date=date,
+            description=_cell(row, columns.description).strip(),
+            amount_ore=sign * amount,
+            reference=_cell(row, columns.reference).strip() or None,
+            account=account,
+        )
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.statements seb export.csv
+    # Prints the rows as TARGET_COLUMNS TSV, ready to paste into the sheet.
+    writer = csv.writer(sys.stdout, delimiter="\t", lineterminator="\n")
+    writer.writerow(TARGET_COLUMNS)
+    for transaction in iter_statement(sys.argv[2], sys.argv[1]):
+        writer.writerow(transaction.to_target_row().values())
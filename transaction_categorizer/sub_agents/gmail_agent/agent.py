@@ -1,11 +1,17 @@
 from google.adk.agents import Agent
 from .prompt import ROOT_AGENT_INSTRUCTION
-from .config import GEMINI_MODEL_ID
-from .gmail_tool import query_gmail_emails_structured
+from .config import GEMINI_MODEL_ID, GMAIL_ASYNC_TOOLS
+from . import gmail_async, gmail_tool
 from google.adk.tools import FunctionTool
 from pydantic import BaseModel, Field
+from ...instrumentation import record_model_response, record_model_turn, record_tool_output
+from ...token_accounting import account_model_request, account_model_response
 
-query_gmail_tool = FunctionTool(func=query_gmail_emails_structured)
+# The async tools keep Gmail round trips off the event loop shared by all sessions.
+_gmail_tools = gmail_async if GMAIL_ASYNC_TOOLS else gmail_tool
+search_transaction_tool = FunctionTool(func=_gmail_tools.search_gmail_for_transaction)
+query_gmail_tool = FunctionTool(func=_gmail_tools.query_gmail_emails_structured)
+get_emails_by_id_tool = FunctionTool(func=_gmail_tools.get_gmail_emails_by_id)
 # --- Define Output Schema ---
 class EmailContent(BaseModel):
     date: str = Field(
@@ -35,21 +41,20 @@ gmail_agent = Agent(
     This note is not always very instructive but you will use it as a guide to find the correct email.
 
     **INSTRUCTIONS**:
-    1. Create a query to search for gmail.
-    2. Be smart to take only the parts from the "note" that seem like good search criteria. E.g.:
+    1. Call 'search_gmail_for_transaction' with the date (YYYY-MM-DD), the amount and the note exactly as given.
+       It builds the Gmail query itself (every format of the amount, keywords from the note, a few days around
+       the date) and returns the query it used under "query".
+    2. Only if that finds nothing relevant, you may try one more search with 'query_gmail_emails_structured'
+       using better keywords from the note, e.g.:
         - The note: "ICA NARA JAR/25-03-20" you would only take "ICA" "ICA NARA JAR" as the search criteria 
         - The note: "BRÖD & SALT /25-03-18" you would only take "BRÖD & SALT" as the search criteria
         - The note: "VATTENFALL KUNDSERVICE AB/25-03-18" you would only take "VATTENFALL" as the search criteria
         - The note: "NORDEA BANK ABP, FILIAL" you would only take "NORDEA" as the search criteria
-    2. Use the 'query_gmail_emails_structured' tool to search for emails matching the details given by the user:
-        - before: two days after the given date
-        - after: two days before the given date
-        - query: the query to search for. Include the amount and 
-
-    3. The amount could be in different formats: e.g. "1234,56" or "1 234,56" or "1234.56". Make sure to query for all of them using gmail "or" operator.
-
-    4. Exclude all emails that seem to be promotional or marketing emails.
-    5. For each email that matches the query and that seems like a receipt for an online purchase, extract the following information:
+       Pass the same after/before dates as the first query.
+    3. Exclude all emails that seem to be promotional or marketing emails.
+       Only likely receipts are returned in full under "emails". Other matches are listed under "other_candidates"
+       with subject, sender and snippet only; if one of them looks like the receipt, fetch it with 'get_gmail_emails_by_id'.
+    4. For each email that matches the query and that seems like a receipt for an online purchase, extract the following information:
         - date: the date of the email. Format: YYYY-MM-DD
         - amount: the amount of money spent. Format: 1234,56
         - company: the company that sold the product. Exactly as it is in the original email.
@@ -58,6 +63,7 @@ gmail_agent = Agent(
 
     Return the following JSON object:
     {
+        "query": the Gmail query that found the emails (the "query" returned by 'search_gmail_for_transaction' or the one you wrote),
         "status": "success" if an email was found and processed or "error" if no email was found in which case the emails list will be []
         "emails": [
             {
@@ -72,7 +78,10 @@ gmail_agent = Agent(
     }
     IMPORTANT: only return the JSON object, nothing else.
     """,
-    tools=[query_gmail_tool],
+    tools=[search_transaction_tool, query_gmail_tool, get_emails_by_id_tool],
+    before_model_callback=[record_model_turn, account_model_request],
+    after_model_callback=[record_model_response, account_model_response],
+    after_tool_callback=record_tool_output,
     #output_schema=EmailContent,
 )
 
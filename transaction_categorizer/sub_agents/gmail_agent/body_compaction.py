@@ -0,0 +1,122 @@
+import re
+from typing import List, Optional, Tuple
+
+from ...amounts import amounts_match, find_amounts
+
+# Rough characters-per-token ratio used to turn a token budget into a character budget.
+CHARS_PER_TOKEN = 4
+
+# Lines with these words carry the totals of a receipt.
+_TOTAL_PATTERN = re.compile(
+    r'\b(totalt?|summa|total|att betala|belopp|amount|subtotal|delsumma|moms|vat|betalat|paid|charged)\b',
+    re.IGNORECASE,
+)
+# Lines with order, booking or receipt numbers.
+_ORDER_NUMBER_PATTERN = re.compile(
+    r'\b(order\s*(nr|no|number|nummer|id)?|ordernummer|ordernr|beställningsnummer|kvittonummer|kvittonr|'
+    r'bokningsnummer|bokningsreferens|booking\s*(ref|reference|number)|referens|reference|'
+    r'invoice\s*(no|number)|fakturanummer|transaktions?\s*(id|nummer))\b\s*[:#]?',
+    re.IGNORECASE,
+)
+# The display name part of a From header: 'Apple <no_reply@email.apple.com>' -> 'Apple'.
+_DISPLAY_NAME_PATTERN = re.compile(r'^\s*"?([^"<]+?)"?\s*<')
+
+_OMISSION_MARKER = "[...]"
+
+
+def sender_display_name(sender: Optional[str]) -> Optional[str]:
+    """Returns the display name of a From header, or None if it has none."""
+    match = _DISPLAY_NAME_PATTERN.match(sender or '')
+    return match.group(1).strip() if match else None
+
+
+def _anchor_priority(line: str, amounts: List[int], merchants: List[str]) -> Optional[int]:
+    """Ranks a line as a window anchor: 0 = searched amount, 1 = total, 2 = order number, 3 = merchant."""
+    if amounts and any(amounts_match(wanted, found) for found in find_amounts(line) for wanted in amounts):
+        return 0
+    if _TOTAL_PATTERN.search(line):
+        return 1
+    if _ORDER_NUMBER_PATTERN.search(line):
+        return 2
+    lowered = line.lower()
+    if any(merchant in lowered for merchant in merchants):
+        return 3
+    return None
+
+
+def compact_body(
+    body: Optional[str],
+    amounts: List[int],
+    merchants: List[str],
+    max_chars: int,
+    head_lines: int = 3,
+    context_lines: int = 2
+) -> Tuple[Optional[str], int]:
+    """
+    Shrinks an extracted email body to at most max_chars, keeping what identifies a receipt.
+
+    Keeps the first head_lines non-empty lines, then windows of context_lines around
+    lines with a searched amount, a total, an order number or a merchant name (in that
+    order of priority) until the budget is used. Kept lines stay in document order;
+    gaps are marked with '[...]'.
+
+    Args:
+        body: The extracted body text.
+        amounts: Searched amounts in öre, as returned by amounts.parse_amount.
+        merchants: Lower-cased merchant names or keywords.
+        max_chars: Character budget for the returned text; 0 or less disables compaction.
+
+    Returns:
+        Tuple: (compacted body, number of characters dropped).
+    """
+    if not body or max_chars <= 0 or len(body) <= max_chars:
+        return body, 0
+
+    lines = body.splitlines()
+    non_empty = [index for index, line in enumerate(lines) if line.strip()]
+    anchors = []
+    for index in non_empty:
+        priority = _anchor_priority(lines[index], amounts, merchants)
+        if priority is not None:
+            anchors.append((priority, index))
+    anchors.sort()
+
+    kept = set()
+    used = 0
+
+    def _keep(indexes: List[int]) -> bool:
+        nonlocal used
+        new = [index for index in indexes if index not in kept]
+        cost = sum(len(lines[index]) + 1 for index in new)
+        if used + cost > max_chars:
+            return False
+        kept.update(new)
+        used += cost
+        return True
+
+    for index in non_empty[:head_lines]:
+        if not _keep([index]):
+            break
+    for _, anchor in anchors:
+        window = [index for index in range(anchor - context_lines, anchor + context_lines + 1)
+                  if 0 <= index < len(lines) and lines[index].strip()]
+        # If the whole window does not fit, the anchor line alone still might.
+        if not _keep(window):
+            _keep([anchor])
+
+    if not kept:
+        compacted = body[:max_chars]
+        return compacted, len(body) - len(compacted)
+
+    parts: List[str] = []
+    previous = None
+    for index in sorted(kept):
+        if previous is not None and any(lines[gap].strip() for gap in range(previous + 1, index)):
+            parts.append(_OMISSION_MARKER)
+        parts.append(lines[index])
+        previous = index
+    if any(line.strip() for line in lines[previous + 1:]):
+        parts.append(_OMISSION_MARKER)
+
+    compacted = "\n".join(parts)
+    return compacted, max(len(body) - len(compacted), 0)
@@ -60,3 +60,74 @@ PLACEHOLDER_CATEGORY = "PENDING_AI"
 DEFAULT_STATUS = "✅"
 TARGET_COLUMNS = ['Date', 'Outflow', 'Inflow', 'Category', 'Account', 'Memo', 'Status']
 
+
+# --- Gmail Tool Configuration ---
+# Refresh the OAuth access token this many seconds before it expires so that a
+# long batch never hits an expired token mid-request.
+GMAIL_TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("GMAIL_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Optional path to a Gmail v1 discovery document. When unset, the document
+# bundled with google-api-python-client is used, so no network fetch is needed.
+GMAIL_DISCOVERY_DOCUMENT = os.environ.get("GMAIL_DISCOVERY_DOCUMENT") or None
+# How message bodies are fetched after a search: "batch" sends them through the
+# Gmail batch endpoint, "sequential" issues one messages.get call per message.
+GMAIL_FETCH_MODE = os.environ.get("GMAIL_FETCH_MODE", "batch")
+# Gmail accepts up to 100 calls per batch but starts rate limiting above ~50.
+GMAIL_BATCH_SIZE = int(os.environ.get("GMAIL_BATCH_SIZE", "50"))
+# Directory for the local Gmail caches (SQLite). Defaults to the credentials dir.
+GMAIL_CACHE_DIR = Path(os.environ.get("GMAIL_CACHE_DIR", str(CREDENTIALS_DIR)))
+# Parsed messages never change once sent, so they are cached on disk by id.
+GMAIL_MESSAGE_CACHE_ENABLED = os.environ.get("GMAIL_MESSAGE_CACHE_ENABLED", "true").lower() == "true"
+GMAIL_MESSAGE_CACHE_MAX_BYTES = int(os.environ.get("GMAIL_MESSAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Search results (including empty ones) are cached per normalized query string.
+GMAIL_QUERY_CACHE_ENABLED = os.environ.get("GMAIL_QUERY_CACHE_ENABLED", "true").lower() == "true"
+GMAIL_QUERY_CACHE_TTL_SECONDS = int(os.environ.get("GMAIL_QUERY_CACHE_TTL_SECONDS", str(60 * 60)))
+# Queries whose before: date has already passed cannot gain new matches, so they live longer.
+GMAIL_QUERY_CACHE_PAST_TTL_SECONDS = int(os.environ.get("GMAIL_QUERY_CACHE_PAST_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+# Optional local mirror of the receipt-relevant part of the mailbox. When enabled
+# and fresh, searches are answered from a local full-text index.
+GMAIL_MIRROR_ENABLED = os.environ.get("GMAIL_MIRROR_ENABLED", "false").lower() == "true"
+GMAIL_MIRROR_BACKFILL_QUERY = os.environ.get(
+    "GMAIL_MIRROR_BACKFILL_QUERY",
+    "category:purchases OR subject:(kvitto OR receipt OR order OR orderbekräftelse OR faktura OR invoice OR betalning OR payment)",
+)
+GMAIL_MIRROR_BACKFILL_DAYS = int(os.environ.get("GMAIL_MIRROR_BACKFILL_DAYS", "730"))
+# The mirror is synced via history.list when older than this; if that fails the live API is used.
+GMAIL_MIRROR_MAX_STALENESS_SECONDS = int(os.environ.get("GMAIL_MIRROR_MAX_STALENESS_SECONDS", "900"))
+# HTML-to-text engine for email bodies: "stdlib" (streaming, default), "lxml"
+# (fastest, needs lxml installed) or "bs4" (the original BeautifulSoup tree walk).
+GMAIL_HTML_ENGINE = os.environ.get("GMAIL_HTML_ENGINE", "stdlib")
+# Two-phase fetch: get metadata for every search hit, then download and decode the
+# body only for likely receipts (not promotions, amount in subject/snippet, or a
+# known merchant/keyword in the sender).
+GMAIL_TWO_PHASE_FETCH = os.environ.get("GMAIL_TWO_PHASE_FETCH", "true").lower() == "true"
+GMAIL_KNOWN_MERCHANT_SENDERS = [
+    sender.strip().lower()
+    for sender in os.environ.get(
+        "GMAIL_KNOWN_MERCHANT_SENDERS",
+        "apple.com,amazon,flysas,sas.se,sj.se,sl.se,ica.se,coop.se,easypark,okq8,circlek,spotify,netflix,"
+        "storytel,audible,adobe,microsoft,dropbox,google.com,synsam,trygghansa,vattenfall,telge,bahnhof,"
+        "hemfrid,verisure,klarna,paypal,walley,uber,bolt.eu,foodora,wolt,kvitto,receipt",
+    ).split(",")
+    if sender.strip()
+]
+# Per-email body budget for what the tool returns to the model. Bodies over budget are
+# compacted to the header lines plus windows around amounts, totals, order numbers and
+# merchant names. GMAIL_BODY_MAX_TOKENS (about 4 characters per token) takes precedence
+# over GMAIL_BODY_MAX_CHARS; 0 returns bodies in full.
+GMAIL_BODY_MAX_CHARS = int(os.environ.get("GMAIL_BODY_MAX_TOKENS", "0")) * 4 or int(os.environ.get("GMAIL_BODY_MAX_CHARS", "2000"))
+GMAIL_BODY_CONTEXT_LINES = int(os.environ.get("GMAIL_BODY_CONTEXT_LINES", "2"))
+# Async Gmail tools: at most this many Gmail requests in flight per process, retried
+# with exponential backoff (honouring Retry-After) on 429, 5xx and rate-limit 403s.
+GMAIL_ASYNC_TOOLS = os.environ.get("GMAIL_ASYNC_TOOLS", "true").lower() == "true"
+GMAIL_ASYNC_MAX_CONCURRENCY = int(os.environ.get("GMAIL_ASYNC_MAX_CONCURRENCY", "8"))
+GMAIL_MAX_RETRIES = int(os.environ.get("GMAIL_MAX_RETRIES", "5"))
+GMAIL_BACKOFF_BASE_SECONDS = float(os.environ.get("GMAIL_BACKOFF_BASE_SECONDS", "1.0"))
+GMAIL_BACKOFF_MAX_SECONDS = float(os.environ.get("GMAIL_BACKOFF_MAX_SECONDS", "32.0"))
+# Deterministic transaction queries (gmail_query.build_gmail_query): search +/- this many
+# days around the booking date, with at most this many merchant keywords.
+GMAIL_QUERY_WINDOW_DAYS = int(os.environ.get("GMAIL_QUERY_WINDOW_DAYS", "3"))
+GMAIL_QUERY_MAX_KEYWORDS = int(os.environ.get("GMAIL_QUERY_MAX_KEYWORDS", "2"))
+# Direct receipt lookup (lookup_transaction_receipts): at most this many receipt records
+# per transaction, each with a summary of at most this many characters of the body.
+GMAIL_DIRECT_MAX_RECEIPTS = int(os.environ.get("GMAIL_DIRECT_MAX_RECEIPTS", "3"))
+GMAIL_DIRECT_SUMMARY_CHARS = int(os.environ.get("GMAIL_DIRECT_SUMMARY_CHARS", "400"))
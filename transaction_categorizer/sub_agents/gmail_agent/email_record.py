@@ -0,0 +1,74 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+@dataclass(slots=True)
+class EmailRecord:
+    """
+    Compact, slotted form of a structured email dict.
+
+    Holds the parsed headers, the extracted body text and the message metadata.
+    The raw MIME payload is only kept when it was explicitly asked for.
+    """
+    id: str
+    thread_id: Optional[str] = None
+    snippet: Optional[str] = None
+    history_id: Optional[str] = None
+    internal_date: Optional[str] = None
+    label_ids: List[str] = field(default_factory=list)
+    size_estimate: Optional[int] = None
+    # Header values are strings, or lists of strings when a header occurs more than once.
+    subject: Any = None
+    sender: Any = None
+    to: Any = None
+    cc: Any = None
+    date: Any = None
+    message_id: Any = None
+    body: Optional[str] = None
+    raw_payload: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_structured(cls, email: Dict[str, Any], keep_payload: bool = False) -> "EmailRecord":
+        """Builds a record from a structured email dict (as returned by the Gmail tool or the caches)."""
+        headers = email.get('headers_parsed') or {}
+        return cls(
+            id=email['id'],
+            thread_id=email.get('threadId'),
+            snippet=email.get('snippet'),
+            history_id=email.get('historyId'),
+            internal_date=email.get('internalDate'),
+            label_ids=list(email.get('labelIds') or []),
+            size_estimate=email.get('sizeEstimate'),
+            subject=headers.get('subject'),
+            sender=headers.get('from'),
+            to=headers.get('to'),
+            cc=headers.get('cc'),
+            date=headers.get('date'),
+            message_id=headers.get('message_id'),
+            body=email.get('extracted_body_text'),
+            raw_payload=email.get('raw_payload') if keep_payload else None,
+        )
+
+    def to_structured(self) -> Dict[str, Any]:
+        """Returns the record as a structured email dict, e.g. for the caches or _email_result_fields."""
+        email: Dict[str, Any] = {
+            "id": self.id,
+            "threadId": self.thread_id,
+            "snippet": self.snippet,
+            "historyId": self.history_id,
+            "internalDate": self.internal_date,
+            "labelIds": self.label_ids,
+            "sizeEstimate": self.size_estimate,
+            "headers_parsed": {
+                "subject": self.subject,
+                "from": self.sender,
+                "to": self.to,
+                "cc": self.cc,
+                "date": self.date,
+                "message_id": self.message_id,
+            },
+            "extracted_body_text": self.body,
+        }
+        if self.raw_payload is not None:
+            email["raw_payload"] = self.raw_payload
+        return email
@@ -0,0 +1,368 @@
+import asyncio
+import random
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from googleapiclient.errors import HttpError
+
+from .config import (
+    GMAIL_ASYNC_MAX_CONCURRENCY,
+    GMAIL_BACKOFF_BASE_SECONDS,
+    GMAIL_BACKOFF_MAX_SECONDS,
+    GMAIL_DIRECT_MAX_RECEIPTS,
+    GMAIL_DIRECT_SUMMARY_CHARS,
+    GMAIL_FETCH_MODE,
+    GMAIL_MAX_RETRIES,
+    GMAIL_TWO_PHASE_FETCH,
+)
+from ...amounts import parse_amount
+from ...instrumentation import count, span
+from . import gmail_tool
+from .gmail_tool import (
+    _email_result_fields,
+    _message_get_request,
+    _partition_candidates,
+    _receipt_hints,
+    _structure_message_resource,
+    build_search_query,
+    fetch_email_details_batch,
+)
+from .gmail_query import build_gmail_query
+from .receipt_records import select_receipts
+
+T = TypeVar("T")
+
+# 403 reasons that mean "slow down" rather than "not allowed".
+_RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# One semaphore per event loop; normally there is a single loop per process.
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _gmail_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(GMAIL_ASYNC_MAX_CONCURRENCY)
+    return semaphore
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for quota and transient server errors (429, 5xx, rate-limit 403) and network errors."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        if status == 403:
+            content = error.content.decode('utf-8', errors='replace') if isinstance(error.content, bytes) else str(error.content)
+            return any(reason in content for reason in _RATE_LIMIT_REASONS)
+        return False
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Seconds to wait before retry number attempt+1: Retry-After if given, else exponential backoff with jitter."""
+    if isinstance(error, HttpError):
+        retry_after = error.resp.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), GMAIL_BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+    ceiling = min(GMAIL_BACKOFF_BASE_SECONDS * (2 ** attempt), GMAIL_BACKOFF_MAX_SECONDS)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def _run_with_service(operation: Callable[[Any], T]) -> T:
+    # Runs in a worker thread; get_gmail_service hands out one service object per thread.
+    service = gmail_tool.get_gmail_service()
+    if service is None:
+        raise RuntimeError("Failed to get Gmail service.")
+    return operation(service)
+
+
+async def call_gmail(operation: Callable[[Any], T], description: str) -> T:
+    """
+    Runs operation(service) in a worker thread without blocking the event loop.
+
+    At most GMAIL_ASYNC_MAX_CONCURRENCY operations run at once. Retryable errors are
+    retried up to GMAIL_MAX_RETRIES times; the backoff sleep does not hold a slot.
+    """
+    attempt = 0
+    while True:
+        async with _gmail_semaphore():
+            try:
+                return await asyncio.to_thread(_run_with_service, operation)
+            except Exception as e:
+                if attempt >= GMAIL_MAX_RETRIES or not is_retryable_error(e):
+                    raise
+                error = e
+        delay = retry_delay(attempt, error)
+        attempt += 1
+        print(f"Gmail {description} failed ({error}); retrying in {delay:.1f}s (attempt {attempt}/{GMAIL_MAX_RETRIES}).")
+        await asyncio.sleep(delay)
+
+
+async def fetch_message(user_id: str, msg_id: str, message_format: str = 'full') -> Optional[Dict[str, Any]]:
+    """Fetches and structures one message (without its raw payload); None on error."""
+    def _get(service: Any) -> Optional[Dict[str, Any]]:
+        message_resource = _message_get_request(service, user_id, msg_id, message_format).execute()
+        return _structure_message_resource(message_resource, include_payload=False) if message_resource else None
+
+    try:
+        return await call_gmail(_get, f"messages.get {msg_id}")
+    except Exception as e:
+        print(f"Error fetching message details for ID {msg_id}: {e}")
+        return None
+
+
+async def _fetch_messages_batch(
+    user_id: str,
+    msg_ids: List[str],
+    message_format: str
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    def _get_batch(service: Any) -> Tuple[Dict[str, Optional[Dict[str, Any]]], Dict[str, Exception]]:
+        errors: Dict[str, Exception] = {}
+        results = fetch_email_details_batch(
+            service, user_id, msg_ids, message_format=message_format, include_payload=False, errors=errors
+        )
+        return results, errors
+
+    results, errors = await call_gmail(_get_batch, "batch messages.get")
+    retry_ids = []
+    for msg_id, error in errors.items():
+        if is_retryable_error(error):
+            retry_ids.append(msg_id)
+        else:
+            print(f"Error fetching message details for ID {msg_id}: {error}")
+    if retry_ids:
+        print(f"Batch fetch: {len(retry_ids)} messages hit quota or server errors; fetching them again with backoff.")
+        count("gmail_messages_refetched_total", len(retry_ids))
+        emails = await asyncio.gather(*(fetch_message(user_id, msg_id, message_format) for msg_id in retry_ids))
+        results.update(zip(retry_ids, emails))
+    return results
+
+
+async def fetch_messages(
+    user_id: str,
+    msg_ids: List[str],
+    message_format: str = 'full'
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetches messages without blocking the event loop, bypassing the cache.
+    In 'batch' mode this is one batch request per GMAIL_BATCH_SIZE messages; otherwise
+    one request per message, run concurrently within the process-wide limit.
+    Messages whose batch sub-request hit a quota or server error are fetched again one
+    by one, with the same backoff as any other Gmail call.
+    """
+    unique_ids = list(dict.fromkeys(msg_ids))
+    if not unique_ids:
+        return {}
+    count("gmail_messages_fetched_total", len(unique_ids), mode=GMAIL_FETCH_MODE)
+    with span("gmail.messages.get", messages=len(unique_ids), mode=GMAIL_FETCH_MODE):
+        if GMAIL_FETCH_MODE == 'batch':
+            return await _fetch_messages_batch(user_id, unique_ids, message_format)
+        emails = await asyncio.gather(*(fetch_message(user_id, msg_id, message_format) for msg_id in unique_ids))
+        return dict(zip(unique_ids, emails))
+
+
+async def fetch_email_details(user_id: str, msg_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Async counterpart of gmail_tool.fetch_email_details: cached messages first, the rest from Gmail."""
+    cache = gmail_tool.get_message_cache()
+    details_by_id: Dict[str, Optional[Dict[str, Any]]] = {}
+    if cache:
+        details_by_id.update(await asyncio.to_thread(cache.get_many, msg_ids))
+    missing_ids = [msg_id for msg_id in msg_ids if msg_id not in details_by_id]
+    if not missing_ids:
+        return details_by_id
+
+    fetched = await fetch_messages(user_id, missing_ids)
+    details_by_id.update(fetched)
+    if cache:
+        await asyncio.to_thread(cache.put_many, [email for email in fetched.values() if email])
+    return details_by_id
+
+
+async def search_message_ids(user_id: str, search_query: str, max_results: int) -> List[str]:
+    """Async counterpart of gmail_tool.search_message_ids, sharing its query cache."""
+    query_cache = gmail_tool.get_query_cache()
+    if query_cache:
+        cached_ids = await asyncio.to_thread(query_cache.get, search_query, max_results)
+        if cached_ids is not None:
+            return cached_ids
+
+    with span("gmail.messages.list"):
+        response = await call_gmail(
+            lambda service: service.users().messages().list(userId=user_id, q=search_query, maxResults=max_results).execute(),
+            "messages.list",
+        )
+    msg_ids = [msg_ref['id'] for msg_ref in response.get('messages', [])]
+    count("gmail_messages_listed_total", len(msg_ids))
+
+    if query_cache:
+        await asyncio.to_thread(query_cache.put, search_query, max_results, msg_ids)
+    return msg_ids
+
+
+async def fetch_likely_receipts(
+    user_id: str,
+    msg_ids: List[str],
+    search_query: str
+) -> Tuple[Dict[str, Optional[Dict[str, Any]]], List[Dict[str, Optional[str]]]]:
+    """Async counterpart of gmail_tool.fetch_likely_receipts."""
+    cache = gmail_tool.get_message_cache()
+    known = await asyncio.to_thread(cache.get_many, msg_ids) if cache else {}
+    metadata = await fetch_messages(user_id, [msg_id for msg_id in msg_ids if msg_id not in known], 'metadata')
+
+    selected, others = _partition_candidates(msg_ids, {**metadata, **known}, search_query)
+
+    fetched = await fetch_messages(user_id, [msg_id for msg_id in selected if msg_id not in known])
+    if cache:
+        await asyncio.to_thread(cache.put_many, [email for email in fetched.values() if email])
+    return {msg_id: known.get(msg_id) or fetched.get(msg_id) for msg_id in selected}, others
+
+
+async def get_gmail_emails_by_id(message_ids: List[str]) -> Dict[str, List[Dict[str, Optional[str]]]]:
+    """
+    Fetches the full content of specific emails, e.g. entries from 'other_candidates'
+    of a previous query_gmail_emails_structured result.
+
+    Args:
+        message_ids (List[str]): Gmail message ids.
+
+    Returns:
+        Dict[str, List[Dict[str, Optional[str]]]]: A dict with key 'emails' and a list of dicts, each with keys: id, subject, from, to, body, body_chars_dropped, date.
+    """
+    try:
+        details_by_id = await fetch_email_details('me', message_ids)
+    except Exception as e:
+        print(f"An unexpected error occurred fetching emails by id: {e}")
+        return {"emails": []}
+    return {"emails": [_email_result_fields(details_by_id[msg_id]) for msg_id in message_ids if details_by_id.get(msg_id)]}
+
+
+async def query_gmail_emails_structured(
+    query: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    max_results: int = 10
+) -> Dict[str, List[Dict[str, Optional[str]]]]:
+    """
+    Queries Gmail for emails and returns them as a dict with key 'emails' and a list of dicts with fields: id, subject, from, to, body, body_chars_dropped, date.
+    Only likely receipts are downloaded in full; the other hits are listed under 'other_candidates'
+    (id, subject, from, date, snippet, skipped_reason) and can be fetched with get_gmail_emails_by_id.
+    Long bodies are cut down to the lines around the searched amount, totals, order numbers and merchant names;
+    body_chars_dropped is the number of characters left out.
+
+    Args:
+        query (str): The Gmail search query string (e.g., 'Apple 99').
+        after (str, optional): Start date in 'YYYY/MM/DD' format.
+        before (str, optional): End date in 'YYYY/MM/DD' format.
+        max_results (int): Maximum number of emails to return.
+
+    Returns:
+        Dict[str, List[Dict[str, Optional[str]]]]: A dict with keys 'emails' and 'other_candidates'.
+    """
+    search_query = build_search_query(query, after, before)
+    amounts, keywords = _receipt_hints(search_query)
+
+    try:
+        mirrored = await asyncio.to_thread(gmail_tool.search_mirror, search_query, max_results)
+    except Exception as e:
+        print(f"An unexpected error occurred searching the local mirror: {e}")
+        mirrored = None
+    if mirrored is not None:
+        mirrored_by_id = {email_details['id']: email_details for email_details in mirrored}
+        mirrored_ids = [email_details['id'] for email_details in mirrored]
+        if GMAIL_TWO_PHASE_FETCH:
+            selected, other_candidates = _partition_candidates(mirrored_ids, mirrored_by_id, search_query)
+        else:
+            selected, other_candidates = mirrored_ids, []
+        return {
+            "emails": [_email_result_fields(mirrored_by_id[msg_id], amounts, keywords) for msg_id in selected],
+            "other_candidates": other_candidates,
+        }
+
+    if not await asyncio.to_thread(gmail_tool.get_gmail_service):
+        print("Failed to get Gmail service. Aborting query.")
+        return {"emails": [], "other_candidates": []}
+
+    user_id = 'me'
+    other_candidates: List[Dict[str, Optional[str]]] = []
+    try:
+        msg_ids = await search_message_ids(user_id, search_query, max_results)
+        if not msg_ids:
+            print("No emails found matching the query.")
+            return {"emails": [], "other_candidates": []}
+
+        if GMAIL_TWO_PHASE_FETCH:
+            details_by_id, other_candidates = await fetch_likely_receipts(user_id, msg_ids, search_query)
+        else:
+            details_by_id = await fetch_email_details(user_id, msg_ids)
+    except HttpError as error:
+        print(f"An API error occurred during Gmail query: {error}")
+        return {"emails": [], "other_candidates": []}
+    except Exception as e:
+        print(f"An unexpected error occurred during Gmail query: {e}")
+        return {"emails": [], "other_candidates": []}
+
+    emails_list = [
+        _email_result_fields(details_by_id[msg_id], amounts, keywords)
+        for msg_id in msg_ids if details_by_id.get(msg_id)
+    ]
+    return {"emails": emails_list, "other_candidates": other_candidates}
+
+
+async def search_gmail_for_transaction(
+    date: str,
+    amount: str,
+    description: str,
+    max_results: int = 10
+) -> Dict[str, Any]:
+    """
+    Searches Gmail for the receipt of one bank transaction. The query (every rendering of
+    the amount, merchant keywords from the description, +/- a few days around the date)
+    is built by build_gmail_query, so no query has to be written by hand.
+
+    Args:
+        date (str): Booking date, 'YYYY-MM-DD'.
+        amount (str): Amount as on the statement, e.g. '-1 049,12'.
+        description (str): Raw bank description, e.g. 'ICA NARA JAR/25-03-20'.
+        max_results (int): Maximum number of emails to return.
+
+    Returns:
+        Dict[str, Any]: Like query_gmail_emails_structured, plus 'query' (the search string used).
+    """
+    built = build_gmail_query(date, amount, description)
+    if not built['query']:
+        print(f"Could not build a Gmail query: {built['error']}")
+        return {"query": "", "emails": [], "other_candidates": [], "error": built['error']}
+    return {"query": built['query'], **await query_gmail_emails_structured(built['query'], max_results=max_results)}
+
+
+async def lookup_transaction_receipts(date: str, amount: str, description: str) -> Dict[str, Any]:
+    """
+    Looks up the receipt for one bank transaction without an extra model step: builds the
+    query with build_gmail_query, searches, keeps emails whose amount or sender matches and
+    returns them as compact records with the fields date, amount, company, summary and
+    payment_details (plus id and subject).
+
+    Args:
+        date (str): Booking date, 'YYYY-MM-DD'.
+        amount (str): Amount as on the statement, e.g. '-1 049,12'.
+        description (str): Raw bank description, e.g. 'ICA NARA JAR/25-03-20'.
+
+    Returns:
+        Dict[str, Any]: 'query' (the search string used), 'status' ('success' if a receipt
+        was found, otherwise 'error') and 'emails' (the receipt records, best match first).
+    """
+    built = build_gmail_query(date, amount, description)
+    if not built['query']:
+        print(f"Could not build a Gmail query: {built['error']}")
+        return {"query": "", "status": "error", "emails": [], "error": built['error']}
+    result = await query_gmail_emails_structured(built['query'])
+    receipts = select_receipts(
+        result['emails'], parse_amount(amount), built['keywords'],
+        GMAIL_DIRECT_MAX_RECEIPTS, GMAIL_DIRECT_SUMMARY_CHARS,
+    )
+    return {"query": built['query'], "status": "success" if receipts else "error", "emails": receipts}
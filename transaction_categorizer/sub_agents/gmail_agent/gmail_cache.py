@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import datetime
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+
+def connect_db(db_path: str) -> sqlite3.Connection:
+    """Opens a SQLite connection that can be shared between threads and processes."""
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Message fields persisted alongside the parsed headers and body.
+_RECORD_META_FIELDS = ("threadId", "snippet", "historyId", "internalDate", "labelIds", "sizeEstimate")
+
+
+def compact_email_record(email: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the storable part of a structured email dict (everything except the raw payload)."""
+    record = {
+        "id": email['id'],
+        "headers_parsed": email.get('headers_parsed', {}),
+        "extracted_body_text": email.get('extracted_body_text'),
+    }
+    for field in _RECORD_META_FIELDS:
+        record[field] = email.get(field)
+    return record
+
+
+class MessageCache:
+    """
+    Persistent LRU cache of parsed Gmail messages keyed by message id.
+
+    Only the parsed fields are stored (headers, extracted body text and message
+    metadata), never the raw MIME payload. Entries written under a different parser
+    schema (version and HTML engine) are dropped on open, so parser changes invalidate
+    old entries.
+    """
+
+    def __init__(self, db_path: str, schema_version: str, max_bytes: int):
+        self.db_path = db_path
+        self.schema_version = schema_version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = connect_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    schema_version TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_last_access ON messages(last_access)")
+            self._conn.execute("DELETE FROM messages WHERE schema_version != ?", (schema_version,))
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()
+            self._total_bytes = row[0]
+
+    def get_many(self, msg_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the cached structured email dicts for the given ids.
+        Ids that are not cached are simply absent from the result.
+        """
+        if not msg_ids:
+            return {}
+        found: Dict[str, Dict[str, Any]] = {}
+        placeholders = ",".join("?" * len(msg_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM messages WHERE schema_version = ? AND id IN ({placeholders})",
+                (self.schema_version, *msg_ids),
+            ).fetchall()
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE messages SET last_access = ? WHERE id = ?",
+                [(now, msg_id) for msg_id, _ in rows],
+            )
+            for msg_id, data in rows:
+                found[msg_id] = json.loads(data)
+            self.hits += len(found)
+            self.misses += len(set(msg_ids)) - len(found)
+        return found
+
+    def put_many(self, emails: List[Dict[str, Any]]) -> None:
+        """Stores structured email dicts (as built by the Gmail tool) and evicts LRU entries if over budget."""
+        rows = []
+        for email in emails:
+            if not email or not email.get('id'):
+                continue
+            data = json.dumps(compact_email_record(email), ensure_ascii=False)
+            rows.append((email['id'], self.schema_version, data, len(data.encode('utf-8'))))
+        if not rows:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for msg_id, schema_version, data, size in rows:
+                    old = self._conn.execute("SELECT size FROM messages WHERE id = ?", (msg_id,)).fetchone()
+                    if old:
+                        self._total_bytes -= old[0]
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO messages (id, schema_version, data, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                        (msg_id, schema_version, data, size, now),
+                    )
+                    self._total_bytes += size
+                self._evict_unlocked()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict_unlocked(self) -> None:
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Other processes may have written to the same file; re-check the real size.
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        if self._total_bytes <= self.max_bytes:
+            return
+        cursor = self._conn.execute("SELECT id, size FROM messages ORDER BY last_access ASC")
+        to_delete = []
+        for msg_id, size in cursor:
+            if self._total_bytes <= self.max_bytes:
+                break
+            to_delete.append((msg_id,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM messages WHERE id = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def clear(self) -> None:
+        """Removes every cached message."""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages")
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss/eviction counters and the current cache size."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._total_bytes,
+        }
+
+
+_BEFORE_PATTERN = re.compile(r'\bbefore:(\d{4})[/-](\d{1,2})[/-](\d{1,2})\b', re.IGNORECASE)
+
+
+def normalize_search_query(search_query: str) -> str:
+    """Collapses whitespace so trivially different spellings of a query share a cache entry."""
+    return " ".join(search_query.split())
+
+
+class QueryResultCache:
+    """
+    Persistent cache of Gmail search results (message ids) with a TTL.
+
+    Keyed by the normalized final search query plus max_results. Empty results are
+    cached too, since most transactions have no matching email at all. Queries with
+    a 'before:' date in the past get the longer past_ttl_seconds.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int, past_ttl_seconds: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.past_ttl_seconds = past_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = connect_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS queries (
+                    key TEXT PRIMARY KEY,
+                    message_ids TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("DELETE FROM queries WHERE expires_at <= ?", (time.time(),))
+
+    @staticmethod
+    def _key(search_query: str, max_results: int) -> str:
+        return f"{max_results}|{normalize_search_query(search_query)}"
+
+    def ttl_for(self, search_query: str) -> int:
+        """Returns the TTL to use for a query, based on whether its date window is fully in the past."""
+        match = _BEFORE_PATTERN.search(search_query)
+        if match:
+            try:
+                before = datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+            except ValueError:
+                return self.ttl_seconds
+            if before < datetime.date.today():
+                return self.past_ttl_seconds
+        return self.ttl_seconds
+
+    def get(self, search_query: str, max_results: int) -> Optional[List[str]]:
+        """Returns the cached message ids (possibly empty), or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT message_ids FROM queries WHERE key = ? AND expires_at > ?",
+                (self._key(search_query, max_results), time.time()),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, search_query: str, max_results: int, message_ids: List[str]) -> None:
+        """Stores the message ids returned for a query."""
+        expires_at = time.time() + self.ttl_for(search_query)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queries (key, message_ids, expires_at) VALUES (?, ?, ?)",
+                (self._key(search_query, max_results), json.dumps(message_ids), expires_at),
+            )
+
+    def clear(self) -> None:
+        """Removes every cached query result."""
+        with self._lock:
+            self._conn.execute("DELETE FROM queries")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters and the number of live entries."""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM queries WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,372 @@
+import re
+import json
+import time
+import datetime
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from .config import (
+    GMAIL_MIRROR_BACKFILL_DAYS,
+    GMAIL_MIRROR_BACKFILL_QUERY,
+    GMAIL_MIRROR_MAX_STALENESS_SECONDS,
+)
+from .gmail_cache import connect_db, compact_email_record
+
+# Fetches structured email dicts for a list of message ids (see gmail_tool.fetch_email_details).
+FetchDetails = Callable[[List[str]], Dict[str, Optional[Dict[str, Any]]]]
+
+# Query tokens: an optional 'operator:' prefix followed by a quoted phrase or a bare word.
+_TOKEN_PATTERN = re.compile(r'(?:[A-Za-z_]+:)?"[^"]*"|\S+')
+_OPERATOR_PATTERN = re.compile(r'^([A-Za-z_]+):(.*)$')
+_DATE_PATTERN = re.compile(r'^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$')
+
+# Gmail operators that map onto a column of the full-text index.
+_COLUMN_OPERATORS = {"from": "sender", "subject": "subject"}
+
+_LIST_PAGE_SIZE = 500
+
+
+def _gmail_date_to_millis(value: str) -> Optional[int]:
+    """Converts an after:/before: value (YYYY/MM/DD or epoch seconds) to epoch milliseconds."""
+    if value.isdigit():
+        return int(value) * 1000
+    match = _DATE_PATTERN.match(value)
+    if not match:
+        return None
+    try:
+        day = datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+    # Gmail interprets bare dates in the mailbox's time zone; local midnight is close enough
+    # for the multi-day windows the agents search.
+    return int(time.mktime(day.timetuple())) * 1000
+
+
+def _fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def translate_gmail_query(search_query: str) -> Optional[Tuple[Optional[str], Optional[int], Optional[int]]]:
+    """
+    Translates a Gmail search query into an FTS5 MATCH expression plus a date range.
+
+    Supports bare words, quoted phrases, OR, from:, subject:, after: and before:.
+    Returns None if the query uses anything else, in which case it must go to the live API.
+
+    Returns:
+        Optional[Tuple[Optional[str], Optional[int], Optional[int]]]: (match_expression, after_ms, before_ms).
+    """
+    groups: List[List[str]] = []
+    after_ms: Optional[int] = None
+    before_ms: Optional[int] = None
+    pending_or = False
+
+    for token in _TOKEN_PATTERN.findall(search_query):
+        if token == 'OR':
+            if not groups or pending_or:
+                return None
+            pending_or = True
+            continue
+        if token == 'AND':
+            continue
+        if token.startswith('-') or any(c in token for c in '(){}'):
+            return None
+
+        column = None
+        text = token
+        operator_match = _OPERATOR_PATTERN.match(token)
+        if operator_match:
+            operator, value = operator_match.group(1).lower(), operator_match.group(2)
+            if operator in ('after', 'before'):
+                if pending_or:
+                    return None
+                millis = _gmail_date_to_millis(value)
+                if millis is None:
+                    return None
+                if operator == 'after':
+                    after_ms = millis
+                else:
+                    before_ms = millis
+                continue
+            if operator not in _COLUMN_OPERATORS:
+                return None
+            column = _COLUMN_OPERATORS[operator]
+            text = value
+
+        text = text.strip('"')
+        if not re.search(r'\w', text):
+            # Punctuation-only terms produce no tokens in the index.
+            pending_or = False
+            continue
+        term = _fts_phrase(text)
+        if column:
+            term = f"{column} : {term}"
+        if pending_or:
+            groups[-1].append(term)
+            pending_or = False
+        else:
+            groups.append([term])
+
+    if pending_or:
+        return None
+    if not groups and after_ms is None and before_ms is None:
+        return None
+    match_expression = " AND ".join("(" + " OR ".join(group) + ")" for group in groups) or None
+    return match_expression, after_ms, before_ms
+
+
+class GmailMirror:
+    """
+    Local SQLite mirror of the receipt-relevant part of the mailbox.
+
+    A one-time backfill imports every message matching the backfill query; after that
+    sync() catches up with users.history.list from the stored historyId. Subject,
+    sender and extracted body are indexed with FTS5, so the amount/date/keyword
+    queries the agents build can be answered locally. Messages outside the backfill
+    query are not mirrored.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        backfill_query: str = GMAIL_MIRROR_BACKFILL_QUERY,
+        backfill_days: int = GMAIL_MIRROR_BACKFILL_DAYS,
+        max_staleness_seconds: int = GMAIL_MIRROR_MAX_STALENESS_SECONDS,
+    ):
+        self.db_path = db_path
+        self.backfill_query = backfill_query
+        self.backfill_days = backfill_days
+        self.max_staleness_seconds = max_staleness_seconds
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._conn = connect_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mirror_messages (
+                    rowid INTEGER PRIMARY KEY,
+                    msg_id TEXT NOT NULL UNIQUE,
+                    internal_date INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS mirror_messages_date ON mirror_messages(internal_date)")
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS mirror_fts USING fts5(subject, sender, body)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS mirror_state (key TEXT PRIMARY KEY, value TEXT)")
+
+    # --- State ---
+
+    def _get_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM mirror_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, **values: Any) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO mirror_state (key, value) VALUES (?, ?)",
+                [(key, str(value)) for key, value in values.items()],
+            )
+
+    def is_fresh(self) -> bool:
+        """True if the mirror has been synced within max_staleness_seconds."""
+        last_sync_at = self._get_state('last_sync_at')
+        if not last_sync_at or not self._get_state('history_id'):
+            return False
+        return time.time() - float(last_sync_at) <= self.max_staleness_seconds
+
+    # --- Storage ---
+
+    def _upsert(self, emails: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for email in emails:
+                    record = compact_email_record(email)
+                    headers = record.get('headers_parsed') or {}
+                    subject = headers.get('subject') or ''
+                    sender = headers.get('from') or ''
+                    if isinstance(subject, list):
+                        subject = " ".join(filter(None, subject))
+                    if isinstance(sender, list):
+                        sender = " ".join(filter(None, sender))
+                    internal_date = int(record.get('internalDate') or 0)
+
+                    existing = self._conn.execute(
+                        "SELECT rowid FROM mirror_messages WHERE msg_id = ?", (record['id'],)
+                    ).fetchone()
+                    if existing:
+                        self._conn.execute("DELETE FROM mirror_fts WHERE rowid = ?", existing)
+                        self._conn.execute("DELETE FROM mirror_messages WHERE rowid = ?", existing)
+                    cursor = self._conn.execute(
+                        "INSERT INTO mirror_messages (msg_id, internal_date, data) VALUES (?, ?, ?)",
+                        (record['id'], internal_date, json.dumps(record, ensure_ascii=False)),
+                    )
+                    self._conn.execute(
+                        "INSERT INTO mirror_fts (rowid, subject, sender, body) VALUES (?, ?, ?, ?)",
+                        (cursor.lastrowid, subject, sender, record.get('extracted_body_text') or ''),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _delete(self, msg_ids: List[str]) -> None:
+        with self._lock:
+            for msg_id in msg_ids:
+                row = self._conn.execute("SELECT rowid FROM mirror_messages WHERE msg_id = ?", (msg_id,)).fetchone()
+                if row:
+                    self._conn.execute("DELETE FROM mirror_fts WHERE rowid = ?", row)
+                    self._conn.execute("DELETE FROM mirror_messages WHERE rowid = ?", row)
+
+    def _known_ids(self, msg_ids: List[str]) -> set:
+        if not msg_ids:
+            return set()
+        placeholders = ",".join("?" * len(msg_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT msg_id FROM mirror_messages WHERE msg_id IN ({placeholders})", msg_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _import_query(self, service: Any, fetch_details: FetchDetails, query: str) -> int:
+        """Imports every message matching query that is not mirrored yet. Returns the number imported."""
+        imported = 0
+        page_token = None
+        while True:
+            response = service.users().messages().list(
+                userId='me', q=query, maxResults=_LIST_PAGE_SIZE, pageToken=page_token
+            ).execute()
+            msg_ids = [msg_ref['id'] for msg_ref in response.get('messages', [])]
+            known = self._known_ids(msg_ids)
+            new_ids = [msg_id for msg_id in msg_ids if msg_id not in known]
+            if new_ids:
+                details = fetch_details(new_ids)
+                emails = [email for email in details.values() if email]
+                self._upsert(emails)
+                imported += len(emails)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return imported
+
+    # --- Sync ---
+
+    def backfill(self, service: Any, fetch_details: FetchDetails) -> bool:
+        """Imports the last backfill_days of receipt-relevant mail and records the starting historyId."""
+        with self._sync_lock:
+            try:
+                history_id = service.users().getProfile(userId='me').execute()['historyId']
+                since = datetime.date.today() - datetime.timedelta(days=self.backfill_days)
+                query = f"({self.backfill_query}) after:{since.strftime('%Y/%m/%d')}"
+                imported = self._import_query(service, fetch_details, query)
+            except HttpError as error:
+                print(f"An API error occurred during mirror backfill: {error}")
+                return False
+            self._set_state(history_id=history_id, last_sync_at=time.time(), backfill_query=self.backfill_query)
+            print(f"Mirror backfill imported {imported} messages.")
+            return True
+
+    def sync(self, service: Any, fetch_details: FetchDetails) -> bool:
+        """
+        Catches up with mailbox changes since the stored historyId.
+        Falls back to a full backfill if there is no stored historyId or it has expired.
+        """
+        start_history_id = self._get_state('history_id')
+        if not start_history_id or self._get_state('backfill_query') != self.backfill_query:
+            return self.backfill(service, fetch_details)
+
+        with self._sync_lock:
+            if self.is_fresh():
+                return True  # Another thread synced while we waited.
+            last_sync_at = float(self._get_state('last_sync_at') or 0)
+            latest_history_id = start_history_id
+            has_additions = False
+            deleted_ids: List[str] = []
+            page_token = None
+            try:
+                while True:
+                    response = service.users().history().list(
+                        userId='me',
+                        startHistoryId=start_history_id,
+                        historyTypes=['messageAdded', 'messageDeleted'],
+                        pageToken=page_token,
+                    ).execute()
+                    for record in response.get('history', []):
+                        if record.get('messagesAdded'):
+                            has_additions = True
+                        for deleted in record.get('messagesDeleted', []):
+                            deleted_ids.append(deleted['message']['id'])
+                    latest_history_id = response.get('historyId', latest_history_id)
+                    page_token = response.get('nextPageToken')
+                    if not page_token:
+                        break
+
+                if deleted_ids:
+                    self._delete(deleted_ids)
+                if has_additions:
+                    # history.list cannot evaluate the backfill query, so re-run it over the
+                    # period since the last sync (with a day of slack) to pick up new receipts.
+                    since = int(last_sync_at) - 24 * 60 * 60
+                    self._import_query(service, fetch_details, f"({self.backfill_query}) after:{since}")
+            except HttpError as error:
+                if getattr(error, 'resp', None) is not None and error.resp.status == 404:
+                    print("Mirror historyId has expired; running a full backfill.")
+                    self._set_state(history_id='')
+                else:
+                    print(f"An API error occurred during mirror sync: {error}")
+                    return False
+            else:
+                self._set_state(history_id=latest_history_id, last_sync_at=time.time())
+                return True
+
+        return self.backfill(service, fetch_details)
+
+    # --- Search ---
+
+    def search(self, search_query: str, max_results: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Answers a Gmail search query from the local index, newest first.
+        Returns None if the query uses operators the mirror cannot evaluate.
+        """
+        translated = translate_gmail_query(search_query)
+        if translated is None:
+            return None
+        match_expression, after_ms, before_ms = translated
+
+        clauses: List[str] = []
+        params: List[Any] = []
+        if match_expression:
+            clauses.append("rowid IN (SELECT rowid FROM mirror_fts WHERE mirror_fts MATCH ?)")
+            params.append(match_expression)
+        if after_ms is not None:
+            clauses.append("internal_date >= ?")
+            params.append(after_ms)
+        if before_ms is not None:
+            clauses.append("internal_date < ?")
+            params.append(before_ms)
+        params.append(max_results)
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM mirror_messages WHERE {' AND '.join(clauses)} "
+                "ORDER BY internal_date DESC LIMIT ?",
+                params,
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+if __name__ == "__main__":
+    from .gmail_tool import sync_mirror
+
+    print("Gmail Mirror - Backfill / Sync")
+    print("------------------------------")
+    if sync_mirror():
+        print("Mirror is up to date.")
+    else:
+        print("Mirror sync failed; searches will use the live Gmail API.")
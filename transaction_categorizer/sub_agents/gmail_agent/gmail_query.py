@@ -0,0 +1,125 @@
+import datetime
+from typing import Any, Dict, List, Optional
+
+from .config import GMAIL_KNOWN_MERCHANT_SENDERS, GMAIL_QUERY_MAX_KEYWORDS, GMAIL_QUERY_WINDOW_DAYS
+from ...amounts import parse_amount
+from ...merchant_rules import normalize_description
+
+# Words in bank descriptions that never help find the receipt.
+_NOISE_WORDS = {
+    "ab", "abp", "as", "asa", "oy", "ltd", "inc", "gmbh", "bv", "llc", "se", "com", "www", "http", "https",
+    "filial", "bank", "kundservice", "sverige", "sweden", "stockholm", "goteborg", "göteborg", "malmo",
+    "malmö", "uppsala", "mktp", "marketplace", "payment", "betalning", "kortkop", "kortköp", "online",
+}
+# Bank abbreviations for merchants whose emails use the full name.
+_KEYWORD_ALIASES = {"amzn": "amazon", "circlek": "circle k"}
+
+
+def _known_merchant_names() -> set:
+    # "ica.se" -> "ica", "bolt.eu" -> "bolt"; plain entries are used as they are.
+    return {sender.split(".")[0] for sender in GMAIL_KNOWN_MERCHANT_SENDERS if len(sender.split(".")[0]) >= 2}
+
+
+_KNOWN_MERCHANTS = _known_merchant_names()
+
+
+def amount_renderings(ore: int) -> List[str]:
+    """
+    Every way a receipt is likely to write an amount, sign dropped:
+    104912 -> ["1049", "1049,12", "1049.12", "1 049", "1 049,12", "1 049.12", "1,049.12", "1,049"].
+    """
+    kronor, rest = divmod(abs(ore), 100)
+    wholes = [str(kronor)]
+    if kronor >= 1000:
+        wholes.append(f"{kronor:,}".replace(",", " "))
+    renderings: List[str] = []
+    for whole in wholes:
+        for rendering in (whole, f"{whole},{rest:02d}", f"{whole}.{rest:02d}"):
+            if rendering not in renderings:
+                renderings.append(rendering)
+    if kronor >= 1000:
+        # English receipts (foreign currency): comma thousands, dot decimals.
+        renderings.extend([f"{kronor:,}.{rest:02d}", f"{kronor:,}"])
+    return renderings
+
+
+def merchant_keywords(description: str, max_keywords: int = GMAIL_QUERY_MAX_KEYWORDS) -> List[str]:
+    """
+    Search keywords from a raw bank description, e.g. "ICA NARA JAR/25-03-20" -> ["ica"],
+    "K*BOKUS.COM" -> ["bokus"], "VATTENFALL KUNDSERVICE AB/25-03-18" -> ["vattenfall"],
+    "AMZN Mktp DE" -> ["amazon"]. A known merchant name wins; otherwise the first two
+    significant words are used as one phrase.
+    """
+    words = [
+        _KEYWORD_ALIASES.get(word, word)
+        for word in normalize_description(description).split()
+        if word not in _NOISE_WORDS and not word.isdigit()
+    ]
+    keywords: List[str] = []
+    for index, word in enumerate(words):
+        pair = "".join(words[index:index + 2])
+        if pair in _KNOWN_MERCHANTS and index + 1 < len(words):
+            keywords.append(_KEYWORD_ALIASES.get(pair, " ".join(words[index:index + 2])))
+        elif word in _KNOWN_MERCHANTS:
+            keywords.append(word)
+    if not keywords:
+        significant = [word for word in words if len(word) >= 2]
+        if significant:
+            keywords.append(" ".join(significant[:2]))
+    unique: List[str] = []
+    for keyword in keywords:
+        if keyword not in unique:
+            unique.append(keyword)
+    return unique[:max_keywords]
+
+
+def _quoted(term: str) -> str:
+    return '"' + term.replace('"', '') + '"'
+
+
+def build_gmail_query(
+    date: str,
+    amount: str,
+    description: str,
+    window_days: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Builds the Gmail search query for one bank transaction, without calling the model.
+
+    The query matches any rendering of the amount or any merchant keyword, within
+    +/- window_days (GMAIL_QUERY_WINDOW_DAYS) of the booking date. The same
+    transaction always gives the same query string, so results cache across runs.
+
+    Args:
+        date (str): Booking date, 'YYYY-MM-DD'.
+        amount (str): Amount as on the statement, e.g. '-1 049,12' or '149'.
+        description (str): Raw bank description, e.g. 'CIRCLE K STOCKHOLM'.
+        window_days (int, optional): Days before and after the date to search.
+
+    Returns:
+        Dict[str, Any]: 'query' (the full search string), 'amounts', 'keywords', 'after' and
+        'before' ('YYYY/MM/DD'); 'query' is empty and 'error' is set if the input is invalid.
+    """
+    window = GMAIL_QUERY_WINDOW_DAYS if window_days is None else window_days
+    try:
+        booked = datetime.date.fromisoformat(date.strip()[:10])
+    except ValueError:
+        return {"query": "", "error": f"Invalid date '{date}', expected YYYY-MM-DD."}
+    ore = parse_amount(amount)
+    if ore is None:
+        return {"query": "", "error": f"Invalid amount '{amount}'."}
+
+    amounts = amount_renderings(ore)
+    keywords = merchant_keywords(description)
+    after = (booked - datetime.timedelta(days=window)).strftime("%Y/%m/%d")
+    before = (booked + datetime.timedelta(days=window)).strftime("%Y/%m/%d")
+    # Chained ORs bind tighter than the implicit AND in Gmail, so no parentheses are
+    # needed; that also keeps the query answerable by the local mirror.
+    terms = " OR ".join(_quoted(term) for term in amounts + keywords)
+    return {
+        "query": f"{terms} after:{after} before:{before}",
+        "amounts": amounts,
+        "keywords": keywords,
+        "after": after,
+        "before": before,
+    }
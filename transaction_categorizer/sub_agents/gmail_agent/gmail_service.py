@@ -0,0 +1,229 @@
+import os
+import json
+import pickle
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to unlocked (single process) access
+    fcntl = None
+
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from google.auth.transport.requests import Request
+
+from .config import GMAIL_DISCOVERY_DOCUMENT, GMAIL_TOKEN_REFRESH_MARGIN_SECONDS
+
+
+class GmailServiceHolder:
+    """
+    Long-lived, thread-safe holder for Gmail credentials and service objects
+    (or those of another Google API, given api_name and api_version).
+
+    Credentials are loaded once per process and refreshed proactively shortly
+    before they expire. The discovery document is parsed once and each thread
+    gets its own service object, since googleapiclient services are not safe to
+    share between threads. Token writes are atomic and guarded by a file lock so
+    several worker processes can share a single token file.
+    """
+
+    def __init__(
+        self,
+        token_file: str,
+        client_secret_file: str,
+        scopes: List[str],
+        refresh_margin_seconds: int = GMAIL_TOKEN_REFRESH_MARGIN_SECONDS,
+        discovery_document_file: Optional[str] = GMAIL_DISCOVERY_DOCUMENT,
+        api_name: str = 'gmail',
+        api_version: str = 'v1',
+    ):
+        self.token_file = token_file
+        self.client_secret_file = client_secret_file
+        self.scopes = scopes
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self.discovery_document_file = discovery_document_file
+        self.api_name = api_name
+        self.api_version = api_version
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._creds: Optional[Any] = None
+        self._token_mtime: Optional[float] = None
+        self._discovery_doc: Optional[Dict[str, Any]] = None
+        # Bumped whenever the credentials object is replaced so that per-thread
+        # services built on the old object are rebuilt.
+        self._generation = 0
+
+    # --- Token file handling ---
+
+    @contextmanager
+    def _token_file_lock(self, exclusive: bool) -> Iterator[None]:
+        """Holds an advisory lock on '<token_file>.lock' for the duration of the block."""
+        if fcntl is None:
+            yield
+            return
+        lock_path = f"{self.token_file}.lock"
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _current_token_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.token_file)
+        except OSError:
+            return None
+
+    def _read_token_unlocked(self) -> Optional[Any]:
+        """Reads the pickled credentials. Corrupt token files are removed."""
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            with open(self.token_file, 'rb') as token_file:
+                creds = pickle.load(token_file)
+        except (pickle.UnpicklingError, EOFError):
+            os.remove(self.token_file)
+            return None
+        self._token_mtime = self._current_token_mtime()
+        return creds
+
+    def _write_token_unlocked(self, creds: Any) -> None:
+        """Atomically replaces the token file so readers never see a partial write."""
+        token_dir = os.path.dirname(self.token_file) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=token_dir, prefix='.token-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                pickle.dump(creds, tmp_file)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.token_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._token_mtime = self._current_token_mtime()
+        print(f"Token saved to {self.token_file}")
+
+    # --- Credentials ---
+
+    def _needs_refresh(self, creds: Any) -> bool:
+        """True if the token is invalid or expires within the refresh margin."""
+        if not creds.valid:
+            return True
+        expiry = getattr(creds, 'expiry', None)
+        if expiry is None:
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return expiry - now <= self.refresh_margin
+
+    def _set_creds(self, creds: Any) -> None:
+        if creds is not self._creds:
+            self._creds = creds
+            self._generation += 1
+
+    def _refresh_or_authorize(self) -> Optional[Any]:
+        """
+        Refreshes the credentials, or runs the OAuth flow if there is nothing to refresh.
+        Must be called with self._lock held.
+        """
+        with self._token_file_lock(exclusive=True):
+            # Another process may already have refreshed the shared token.
+            disk_creds = self._read_token_unlocked()
+            if disk_creds and not self._needs_refresh(disk_creds):
+                return disk_creds
+
+            creds = disk_creds or self._creds
+            if creds and creds.refresh_token:
+                try:
+                    creds.refresh(Request())
+                    self._write_token_unlocked(creds)
+                    return creds
+                except Exception as e:  # Catches google.auth.exceptions.RefreshError among others
+                    print(f"Error refreshing {self.api_name} token: {e}")
+                    if os.path.exists(self.token_file):  # Delete problematic token
+                        os.remove(self.token_file)
+
+            if not os.path.exists(self.client_secret_file):
+                print(f"Error: Client secret file not found at {self.client_secret_file}")
+                print("Please download your OAuth 2.0 client credentials from Google Cloud Console")
+                print("and place it as 'client_secret.json' in the 'credentials' directory.")
+                return None
+            try:
+                flow = InstalledAppFlow.from_client_secrets_file(self.client_secret_file, self.scopes)
+                creds = flow.run_local_server(port=0)
+            except FileNotFoundError:
+                print(f"Error: Client secret file not found at {self.client_secret_file}")
+                return None
+            except Exception as e:
+                print(f"Error during OAuth flow: {e}")
+                return None
+
+            self._write_token_unlocked(creds)
+            return creds
+
+    def get_credentials(self) -> Optional[Any]:
+        """Returns valid credentials, loading or refreshing them only when necessary."""
+        creds = self._creds
+        if creds is not None and not self._needs_refresh(creds) \
+                and self._current_token_mtime() == self._token_mtime:
+            return creds
+
+        with self._lock:
+            creds = self._creds
+            if creds is None or self._current_token_mtime() != self._token_mtime:
+                with self._token_file_lock(exclusive=False):
+                    creds = self._read_token_unlocked() or creds
+            if not creds or self._needs_refresh(creds):
+                creds = self._refresh_or_authorize()
+            if creds:
+                self._set_creds(creds)
+            return creds
+
+    def invalidate(self) -> None:
+        """Drops cached credentials and services, forcing a reload on next use."""
+        with self._lock:
+            self._creds = None
+            self._token_mtime = None
+            self._generation += 1
+
+    # --- Service ---
+
+    def _get_discovery_doc(self) -> Dict[str, Any]:
+        """Loads and parses the API's discovery document once per process."""
+        if self._discovery_doc is None:
+            with self._lock:
+                if self._discovery_doc is None:
+                    if self.discovery_document_file:
+                        with open(self.discovery_document_file, 'r', encoding='utf-8') as doc_file:
+                            raw_doc = doc_file.read()
+                    else:
+                        raw_doc = discovery_cache.get_static_doc(self.api_name, self.api_version)
+                        if raw_doc is None:
+                            raise RuntimeError(f"No bundled discovery document found for {self.api_name} {self.api_version}.")
+                    self._discovery_doc = json.loads(raw_doc)
+        return self._discovery_doc
+
+    def get_service(self) -> Optional[Any]:
+        """Returns this thread's service, building it only on first use or after a credential swap."""
+        creds = self.get_credentials()
+        if not creds:
+            return None
+
+        local = self._local
+        if getattr(local, 'service', None) is not None and local.generation == self._generation:
+            return local.service
+        try:
+            service = build_from_document(self._get_discovery_doc(), credentials=creds)
+        except Exception as e:
+            print(f"Error building {self.api_name} service: {e}")
+            return None
+        local.service = service
+        local.generation = self._generation
+        return service
@@ -1,15 +1,40 @@
 import os
-import pickle
 import base64
-from bs4 import BeautifulSoup
 import re
-from typing import List, Dict, Optional, Any
+import threading
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 import urllib.parse
 
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
+
+from .config import (
+    GMAIL_BATCH_SIZE,
+    GMAIL_BODY_CONTEXT_LINES,
+    GMAIL_BODY_MAX_CHARS,
+    GMAIL_CACHE_DIR,
+    GMAIL_DIRECT_MAX_RECEIPTS,
+    GMAIL_DIRECT_SUMMARY_CHARS,
+    GMAIL_FETCH_MODE,
+    GMAIL_HTML_ENGINE,
+    GMAIL_KNOWN_MERCHANT_SENDERS,
+    GMAIL_MESSAGE_CACHE_ENABLED,
+    GMAIL_MESSAGE_CACHE_MAX_BYTES,
+    GMAIL_MIRROR_ENABLED,
+    GMAIL_QUERY_CACHE_ENABLED,
+    GMAIL_QUERY_CACHE_PAST_TTL_SECONDS,
+    GMAIL_QUERY_CACHE_TTL_SECONDS,
+    GMAIL_TWO_PHASE_FETCH,
+)
+from ...amounts import amounts_match, find_amounts, parse_amount
+from ...instrumentation import count, span
+from .gmail_cache import MessageCache, QueryResultCache
+from .gmail_mirror import GmailMirror
+from .gmail_service import GmailServiceHolder
+from .html_text import get_html_engine
+from .body_compaction import compact_body, sender_display_name
+from .email_record import EmailRecord
+from .gmail_query import build_gmail_query
+from .receipt_records import select_receipts
 
 # SCOPES: If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
@@ -21,12 +46,36 @@ CLIENT_SECRET_FILE = 'credentials/client_secret.json'
 TOKEN_PICKLE_FILE = 'credentials/token.pickle'
 CREDENTIALS_DIR = 'credentials'
 
+# Headers requested in the metadata phase of the two-phase fetch.
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+
+_html_to_text = get_html_engine(GMAIL_HTML_ENGINE)
+
+# Bump whenever the header parsing or body extraction output changes, so that
+# messages cached by an older parser are discarded.
+PARSER_SCHEMA_VERSION = 2
+# The body text also depends on the HTML engine in use, so the message cache is keyed
+# by both: switching engines discards bodies parsed by the other one.
+MESSAGE_CACHE_SCHEMA = f"{PARSER_SCHEMA_VERSION}:{_html_to_text.__name__}"
+
+_service_holder: Optional[GmailServiceHolder] = None
+_service_holder_lock = threading.Lock()
+
+def get_service_holder() -> GmailServiceHolder:
+    """Returns the process-wide Gmail credential/service holder."""
+    global _service_holder
+    if _service_holder is None:
+        with _service_holder_lock:
+            if _service_holder is None:
+                _service_holder = GmailServiceHolder(TOKEN_PICKLE_FILE, CLIENT_SECRET_FILE, SCOPES)
+    return _service_holder
+
 def get_gmail_service() -> Optional[Any]:
     """
     Authenticates with the Gmail API and returns a service object.
-    Handles token storage and refresh.
+    Credentials and the discovery document are cached for the life of the process;
+    the token is refreshed proactively before it expires.
     """
-    creds = None
     if not os.path.exists(CREDENTIALS_DIR):
         try:
             os.makedirs(CREDENTIALS_DIR)
@@ -34,53 +83,55 @@ def get_gmail_service() -> Optional[Any]:
             print(f"Error creating credentials directory {CREDENTIALS_DIR}: {e}")
             return None
 
-    if os.path.exists(TOKEN_PICKLE_FILE):
-        with open(TOKEN_PICKLE_FILE, 'rb') as token_file:
-            try:
-                creds = pickle.load(token_file)
-            except pickle.UnpicklingError:
-                os.remove(TOKEN_PICKLE_FILE)
-                creds = None # Will trigger re-authentication
-            except EOFError: # File might be empty or corrupted
-                os.remove(TOKEN_PICKLE_FILE)
-                creds = None
-
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e: # Catches google.auth.exceptions.RefreshError among others
-                if os.path.exists(TOKEN_PICKLE_FILE): # Delete problematic token
-                    os.remove(TOKEN_PICKLE_FILE)
-                creds = None # Will trigger re-authentication
-        
-        if not creds: # creds is None if refresh failed or no token existed
-            if not os.path.exists(CLIENT_SECRET_FILE):
-                print(f"Error: Client secret file not found at {CLIENT_SECRET_FILE}")
-                print("Please download your OAuth 2.0 client credentials from Google Cloud Console")
-                print("and place it as 'client_secret.json' in the 'credentials' directory.")
-                return None
-            try:
-                flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_FILE, SCOPES)
-                creds = flow.run_local_server(port=0)
-            except FileNotFoundError:
-                print(f"Error: Client secret file not found at {CLIENT_SECRET_FILE}")
-                return None
-            except Exception as e:
-                print(f"Error during OAuth flow: {e}")
-                return None
-
-        # Save the credentials for the next run
-        with open(TOKEN_PICKLE_FILE, 'wb') as token_file:
-            pickle.dump(creds, token_file)
-            print(f"Token saved to {TOKEN_PICKLE_FILE}")
+    with span("gmail.get_service"):
+        return get_service_holder().get_service()
 
-    try:
-        return build('gmail', 'v1', credentials=creds)
-    except Exception as e:
-        print(f"Error building Gmail service: {e}")
+_message_cache: Optional[MessageCache] = None
+
+def get_message_cache() -> Optional[MessageCache]:
+    """Returns the process-wide parsed message cache, or None if caching is disabled."""
+    global _message_cache
+    if not GMAIL_MESSAGE_CACHE_ENABLED:
         return None
+    if _message_cache is None:
+        with _service_holder_lock:
+            if _message_cache is None:
+                _message_cache = MessageCache(
+                    os.path.join(GMAIL_CACHE_DIR, 'gmail_cache.sqlite3'),
+                    MESSAGE_CACHE_SCHEMA,
+                    GMAIL_MESSAGE_CACHE_MAX_BYTES,
+                )
+    return _message_cache
+
+_query_cache: Optional[QueryResultCache] = None
+
+def get_query_cache() -> Optional[QueryResultCache]:
+    """Returns the process-wide search result cache, or None if caching is disabled."""
+    global _query_cache
+    if not GMAIL_QUERY_CACHE_ENABLED:
+        return None
+    if _query_cache is None:
+        with _service_holder_lock:
+            if _query_cache is None:
+                _query_cache = QueryResultCache(
+                    os.path.join(GMAIL_CACHE_DIR, 'gmail_cache.sqlite3'),
+                    GMAIL_QUERY_CACHE_TTL_SECONDS,
+                    GMAIL_QUERY_CACHE_PAST_TTL_SECONDS,
+                )
+    return _query_cache
+
+_mirror: Optional[GmailMirror] = None
+
+def get_mirror(force: bool = False) -> Optional[GmailMirror]:
+    """Returns the process-wide local mailbox mirror, or None if mirror mode is disabled."""
+    global _mirror
+    if not (GMAIL_MIRROR_ENABLED or force):
+        return None
+    if _mirror is None:
+        with _service_holder_lock:
+            if _mirror is None:
+                _mirror = GmailMirror(os.path.join(GMAIL_CACHE_DIR, 'gmail_mirror.sqlite3'))
+    return _mirror
 
 def is_text_clearly_a_url(text: str, href: Optional[str] = None) -> bool:
     """Helper function to determine if a string is likely a URL."""
@@ -105,7 +156,7 @@ def is_text_clearly_a_url(text: str, href: Optional[str] = None) -> bool:
 def _decode_email_part_data(data: str, mime_type: str) -> str:
     """
     Decodes base64url encoded email part data.
-    If HTML, uses BeautifulSoup to extract text. Links are formatted as [Descriptive Text] or [Link].
+    If HTML, extracts text with the configured engine (GMAIL_HTML_ENGINE). Links are formatted as [Descriptive Text] or [Link].
     If Plain, normalizes whitespace.
     """
     try:
@@ -113,36 +164,7 @@ def _decode_email_part_data(data: str, mime_type: str) -> str:
         text_content = byte_data.decode('utf-8', errors='replace')
 
         if mime_type == 'text/html':
-            soup = BeautifulSoup(text_content, 'html.parser')
-
-            for unwanted_tag in soup(["script", "style", "head", "title", "meta", "link"]):
-                unwanted_tag.decompose()
-
-            for a_tag in soup.find_all('a', href=True):
-                actual_href = a_tag.get('href', '')
-                text_from_anchor = a_tag.get_text(strip=True)
-                display_text_for_brackets = "Link" # Default to "[Link]"
-
-                if text_from_anchor: 
-                    if not is_text_clearly_a_url(text_from_anchor, actual_href):
-                        display_text_for_brackets = text_from_anchor
-                # If display_text is still "Link", try alt text from image
-                if display_text_for_brackets == "Link":
-                    img_tag = a_tag.find('img', alt=True)
-                    if img_tag:
-                        alt_text = img_tag.get('alt', '').strip()
-                        if alt_text: 
-                            if not is_text_clearly_a_url(alt_text, actual_href):
-                                display_text_for_brackets = alt_text
-                replacement_string = f"[{display_text_for_brackets}]"
-                a_tag.replace_with(soup.new_string(replacement_string + " "))
-
-            text = soup.get_text(separator=' ', strip=False)
-            text = re.sub(r'[ \t]+', ' ', text)
-            text = "\n".join([line.strip() for line in text.splitlines()])
-            text = re.sub(r'\n\n+', '\n\n', text)
-            text = text.strip()
-            return text
+            return _html_to_text(text_content, is_text_clearly_a_url)
         else: # For text/plain
             text_content = re.sub(r'[ \t]+', ' ', text_content)
             text_content = re.sub(r'\n\n+', '\n\n', text_content)
@@ -223,58 +245,92 @@ def extract_email_body(payload: Dict) -> Optional[str]:
     
     return None
 
-def get_email_details_structured(service: Any, user_id: str, msg_id: str) -> Optional[Dict[str, Any]]:
+def _payload_data_bytes(payload: Dict[str, Any]) -> int:
+    """Size of the base64url body data in a message payload, over all its parts."""
+    size = len((payload.get('body') or {}).get('data') or '')
+    for part in payload.get('parts') or []:
+        size += _payload_data_bytes(part)
+    return size
+
+def _structure_message_resource(message_resource: Dict[str, Any], include_payload: bool = True) -> Dict[str, Any]:
+    """
+    Builds the structured email dict from a 'full' format Gmail message resource.
+    With include_payload=False the raw MIME payload and 'all_headers' are left out.
+    """
+    email_data: Dict[str, Any] = {
+        "id": message_resource.get('id'),
+        "threadId": message_resource.get('threadId'),
+        "snippet": message_resource.get('snippet'),
+        "historyId": message_resource.get('historyId'),
+        "internalDate": message_resource.get('internalDate'), # Unix timestamp as string
+        "labelIds": message_resource.get('labelIds', []),
+        "sizeEstimate": message_resource.get('sizeEstimate'),
+
+        "headers_parsed": {}, # For quick access to common headers
+        "extracted_body_text": None,
+    }
+    if include_payload:
+        email_data["raw_payload"] = message_resource.get('payload') # The raw payload for further inspection
+
+    payload = message_resource.get('payload')
+    if payload:
+        headers = payload.get('headers', [])
+        parsed_headers: Dict[str, Any] = {}
+        for header in headers:
+            name = header.get('name', '').lower()
+            value = header.get('value')
+            if name:
+                if name in parsed_headers:
+                    if isinstance(parsed_headers[name], list):
+                        parsed_headers[name].append(value)
+                    else:
+                        parsed_headers[name] = [parsed_headers[name], value]
+                else:
+                    parsed_headers[name] = value
+
+        email_data['headers_parsed']['subject'] = parsed_headers.get('subject')
+        email_data['headers_parsed']['from'] = parsed_headers.get('from')
+        email_data['headers_parsed']['to'] = parsed_headers.get('to')
+        email_data['headers_parsed']['cc'] = parsed_headers.get('cc')
+        email_data['headers_parsed']['date'] = parsed_headers.get('date')
+        email_data['headers_parsed']['message_id'] = parsed_headers.get('message-id')
+        if include_payload:
+            email_data['all_headers'] = parsed_headers
+
+        count("gmail_body_bytes_total", _payload_data_bytes(payload))
+        with span("gmail.parse"):
+            email_data['extracted_body_text'] = extract_email_body(payload)
+
+    count("gmail_messages_parsed_total")
+    return email_data
+
+def _message_get_request(service: Any, user_id: str, msg_id: str, message_format: str) -> Any:
+    """Builds a messages.get request; 'metadata' requests only fetch METADATA_HEADERS."""
+    if message_format == 'metadata':
+        return service.users().messages().get(
+            userId=user_id, id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS
+        )
+    return service.users().messages().get(userId=user_id, id=msg_id, format=message_format)
+
+def get_email_details_structured(
+    service: Any,
+    user_id: str,
+    msg_id: str,
+    message_format: str = 'full',
+    include_payload: bool = True
+) -> Optional[Dict[str, Any]]:
     """
     Fetches and structures the details of a single email message.
-    Returns a dictionary containing parsed information and the raw payload.
+    Returns a dictionary containing parsed information and, unless include_payload is False, the raw payload.
+    With message_format='metadata' only headers, labels and snippet are fetched (no body).
     """
     try:
-        message_resource = service.users().messages().get(userId=user_id, id=msg_id, format='full').execute()
+        message_resource = _message_get_request(service, user_id, msg_id, message_format).execute()
         
         if not message_resource:
             return None
 
-        email_data: Dict[str, Any] = {
-            "id": message_resource.get('id'),
-            "threadId": message_resource.get('threadId'),
-            "snippet": message_resource.get('snippet'),
-            "historyId": message_resource.get('historyId'),
-            "internalDate": message_resource.get('internalDate'), # Unix timestamp as string
-            "labelIds": message_resource.get('labelIds', []),
-            "sizeEstimate": message_resource.get('sizeEstimate'),
-            
-            "headers_parsed": {}, # For quick access to common headers
-            "extracted_body_text": None,
-            "raw_payload": message_resource.get('payload') # The raw payload for further inspection
-        }
-
-        payload = message_resource.get('payload')
-        if payload:
-            headers = payload.get('headers', [])
-            parsed_headers: Dict[str, Any] = {}
-            for header in headers:
-                name = header.get('name', '').lower()
-                value = header.get('value')
-                if name:
-                    if name in parsed_headers:
-                        if isinstance(parsed_headers[name], list):
-                            parsed_headers[name].append(value)
-                        else:
-                            parsed_headers[name] = [parsed_headers[name], value]
-                    else:
-                        parsed_headers[name] = value
-            
-            email_data['headers_parsed']['subject'] = parsed_headers.get('subject')
-            email_data['headers_parsed']['from'] = parsed_headers.get('from')
-            email_data['headers_parsed']['to'] = parsed_headers.get('to')
-            email_data['headers_parsed']['cc'] = parsed_headers.get('cc')
-            email_data['headers_parsed']['date'] = parsed_headers.get('date')
-            email_data['headers_parsed']['message_id'] = parsed_headers.get('message-id')
-            email_data['all_headers'] = parsed_headers
-
-            email_data['extracted_body_text'] = extract_email_body(payload)
-        
-        return email_data
+        return _structure_message_resource(message_resource, include_payload)
         
     except HttpError as error:
         print(f"Error fetching message details for ID {msg_id}: {error}")
@@ -283,6 +339,368 @@ def get_email_details_structured(service: Any, user_id: str, msg_id: str) -> Opt
         print(f"An unexpected error occurred fetching message {msg_id}: {e}")
         return None
 
+def fetch_email_details_batch(
+    service: Any,
+    user_id: str,
+    msg_ids: List[str],
+    batch_size: int = GMAIL_BATCH_SIZE,
+    message_format: str = 'full',
+    include_payload: bool = True,
+    errors: Optional[Dict[str, Exception]] = None
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetches and structures several messages through the Gmail batch endpoint.
+
+    Errors are isolated per message: a failing message maps to None and does not
+    affect the rest of the batch. If a whole batch request fails, its messages are
+    fetched one by one instead.
+
+    If an errors dict is given, the fetch errors are collected in it by message id
+    instead (a failed batch request counts for each of its messages), so the caller
+    can retry them with backoff.
+
+    Returns:
+        Dict[str, Optional[Dict[str, Any]]]: Structured email dicts keyed by message id.
+    """
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    unique_ids = list(dict.fromkeys(msg_ids))
+
+    def _on_response(request_id: str, response: Optional[Dict[str, Any]], exception: Optional[Exception]) -> None:
+        if exception is not None:
+            if errors is None:
+                print(f"Error fetching message details for ID {request_id}: {exception}")
+            else:
+                errors[request_id] = exception
+            results[request_id] = None
+            return
+        try:
+            results[request_id] = _structure_message_resource(response, include_payload) if response else None
+        except Exception as e:
+            print(f"An unexpected error occurred processing message {request_id}: {e}")
+            results[request_id] = None
+
+    for start in range(0, len(unique_ids), batch_size):
+        chunk = unique_ids[start:start + batch_size]
+        batch = service.new_batch_http_request(callback=_on_response)
+        for msg_id in chunk:
+            batch.add(_message_get_request(service, user_id, msg_id, message_format), request_id=msg_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            if errors is not None:
+                for msg_id in chunk:
+                    if msg_id not in results:
+                        results[msg_id] = None
+                        errors[msg_id] = e
+                continue
+            print(f"Batch fetch failed ({e}); falling back to sequential fetch for {len(chunk)} messages.")
+            for msg_id in chunk:
+                if msg_id not in results:
+                    results[msg_id] = get_email_details_structured(service, user_id, msg_id, message_format, include_payload)
+
+    return results
+
+def _fetch_messages(
+    service: Any,
+    user_id: str,
+    msg_ids: List[str],
+    message_format: str = 'full'
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetches messages from Gmail in the configured mode (batch or sequential), bypassing the cache.
+    The raw payload is dropped as soon as each message is parsed.
+    """
+    if not msg_ids:
+        return {}
+    count("gmail_messages_fetched_total", len(msg_ids), mode=GMAIL_FETCH_MODE)
+    with span("gmail.messages.get", messages=len(msg_ids), mode=GMAIL_FETCH_MODE):
+        if GMAIL_FETCH_MODE == 'batch':
+            return fetch_email_details_batch(
+                service, user_id, msg_ids, message_format=message_format, include_payload=False
+            )
+        return {
+            msg_id: get_email_details_structured(service, user_id, msg_id, message_format, include_payload=False)
+            for msg_id in msg_ids
+        }
+
+def fetch_email_details(service: Any, user_id: str, msg_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Returns structured email dicts keyed by message id, serving already parsed
+    messages from the local cache and fetching only the rest from Gmail.
+    Cached entries carry no 'raw_payload'.
+    """
+    cache = get_message_cache()
+    details_by_id: Dict[str, Optional[Dict[str, Any]]] = {}
+    if cache:
+        details_by_id.update(cache.get_many(msg_ids))
+    missing_ids = [msg_id for msg_id in msg_ids if msg_id not in details_by_id]
+    if not missing_ids:
+        return details_by_id
+
+    fetched = _fetch_messages(service, user_id, missing_ids)
+    details_by_id.update(fetched)
+    if cache:
+        cache.put_many([email for email in fetched.values() if email])
+    return details_by_id
+
+def search_message_ids(service: Any, user_id: str, search_query: str, max_results: int) -> List[str]:
+    """
+    Runs messages.list for the final search query and returns the message ids.
+    Results, including empty ones, are served from the query cache while fresh.
+    """
+    query_cache = get_query_cache()
+    if query_cache:
+        cached_ids = query_cache.get(search_query, max_results)
+        if cached_ids is not None:
+            return cached_ids
+
+    with span("gmail.messages.list"):
+        response = service.users().messages().list(
+            userId=user_id,
+            q=search_query,
+            maxResults=max_results
+        ).execute()
+    msg_ids = [msg_ref['id'] for msg_ref in response.get('messages', [])]
+    count("gmail_messages_listed_total", len(msg_ids))
+
+    if query_cache:
+        query_cache.put(search_query, max_results, msg_ids)
+    return msg_ids
+
+def sync_mirror() -> bool:
+    """Backfills or incrementally syncs the local mailbox mirror. Returns True on success."""
+    mirror = get_mirror(force=True)
+    service = get_gmail_service()
+    if not service:
+        print("Failed to get Gmail service. Cannot sync mirror.")
+        return False
+    return mirror.sync(service, lambda msg_ids: fetch_email_details(service, 'me', msg_ids))
+
+def search_mirror(search_query: str, max_results: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Answers a search from the local mirror when mirror mode is enabled.
+    Syncs the mirror first if it is stale. Returns None when the live API must be used:
+    mirror disabled, sync failed, or the query uses operators the mirror cannot evaluate.
+    """
+    mirror = get_mirror()
+    if not mirror:
+        return None
+    if not mirror.is_fresh() and not sync_mirror():
+        return None
+    with span("gmail.mirror.search"):
+        return mirror.search(search_query, max_results)
+
+def build_search_query(query: str, after: Optional[str] = None, before: Optional[str] = None) -> str:
+    """Appends the after:/before: date filters to a Gmail search query."""
+    search_query = query
+    if after:
+        search_query += f" after:{after}"
+    if before:
+        search_query += f" before:{before}"
+    return search_query
+
+def iter_gmail_emails(
+    query: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    max_results: int = 10,
+    chunk_size: int = GMAIL_BATCH_SIZE,
+    include_payload: bool = False
+) -> Iterator[EmailRecord]:
+    """
+    Streaming variant of query_gmail_emails_structured for bulk use.
+
+    Yields an EmailRecord per matching message, in search order, as soon as its
+    chunk has been fetched. Only one chunk of messages is held at a time, so with
+    chunk_size=1 peak memory is bounded by a single message. Records carry no raw
+    payload unless include_payload is True, in which case cached and mirrored
+    messages are fetched from Gmail again. No two-phase filtering or body
+    compaction is applied.
+    """
+    search_query = build_search_query(query, after, before)
+
+    if not include_payload:
+        mirrored = search_mirror(search_query, max_results)
+        if mirrored is not None:
+            for email_details in mirrored:
+                yield EmailRecord.from_structured(email_details)
+            return
+
+    service = get_gmail_service()
+    if not service:
+        print("Failed to get Gmail service. Aborting query.")
+        return
+    user_id = 'me'
+    msg_ids = search_message_ids(service, user_id, search_query, max_results)
+    cache = get_message_cache()
+    chunk_size = max(chunk_size, 1)
+
+    for start in range(0, len(msg_ids), chunk_size):
+        chunk = msg_ids[start:start + chunk_size]
+        if include_payload:
+            if GMAIL_FETCH_MODE == 'batch':
+                details_by_id = fetch_email_details_batch(service, user_id, chunk, batch_size=chunk_size)
+            else:
+                details_by_id = {msg_id: get_email_details_structured(service, user_id, msg_id) for msg_id in chunk}
+            if cache:
+                cache.put_many([email for email in details_by_id.values() if email])
+        else:
+            details_by_id = fetch_email_details(service, user_id, chunk)
+        for msg_id in chunk:
+            email_details = details_by_id.pop(msg_id, None)
+            if email_details:
+                yield EmailRecord.from_structured(email_details, keep_payload=include_payload)
+
+def _email_result_fields(
+    email_details: Dict[str, Any],
+    amounts: Optional[List[int]] = None,
+    keywords: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Picks the fields the tool returns to the model out of a structured email dict.
+    The body is compacted to GMAIL_BODY_MAX_CHARS around the searched amounts and keywords;
+    'body_chars_dropped' tells how much of it was left out.
+    """
+    headers = email_details.get('headers_parsed', {})
+    merchants = list(keywords or [])
+    display_name = sender_display_name(_header_text(headers.get('from')))
+    if display_name:
+        merchants.append(display_name.lower())
+    body, dropped = compact_body(
+        email_details.get('extracted_body_text'), amounts or [], merchants,
+        GMAIL_BODY_MAX_CHARS, context_lines=GMAIL_BODY_CONTEXT_LINES,
+    )
+    return {
+        'id': email_details.get('id'),
+        'subject': headers.get('subject'),
+        'from': headers.get('from'),
+        'to': headers.get('to'),
+        'body': body,
+        'body_chars_dropped': dropped,
+        'date': headers.get('date'),
+    }
+
+def _header_text(value: Any) -> str:
+    if isinstance(value, list):
+        return " ".join(filter(None, value))
+    return value or ''
+
+def _receipt_hints(search_query: str) -> Tuple[List[int], List[str]]:
+    """Extracts the searched amounts (in öre) and the lower-cased keywords from a Gmail query."""
+    amounts: List[int] = []
+    keywords: List[str] = []
+    for quoted, bare in re.findall(r'"([^"]*)"|(\S+)', search_query):
+        if bare and (':' in bare or bare in ('OR', 'AND') or bare.startswith('-')):
+            continue
+        phrase = (quoted or bare).strip('()')
+        amount = parse_amount(phrase)
+        if amount is not None:
+            amounts.append(amount)
+        elif len(phrase) >= 3 and not re.fullmatch(r'[\d\s.,]+', phrase):
+            # Numeric-only phrases are amount renderings parse_amount does not accept ("1 049.12").
+            keywords.append(phrase.lower())
+    return amounts, keywords
+
+def _skip_reason(email_details: Dict[str, Any], amounts: List[int], keywords: List[str]) -> Optional[str]:
+    """
+    Cheap receipt filter over headers, labels and snippet.
+    Returns None if the message is a likely receipt, otherwise why it was not downloaded.
+    """
+    if 'CATEGORY_PROMOTIONS' in (email_details.get('labelIds') or []):
+        return 'promotion'
+    if not amounts and not keywords:
+        return None
+
+    headers = email_details.get('headers_parsed', {})
+    subject = _header_text(headers.get('subject'))
+    sender = _header_text(headers.get('from')).lower()
+    found = find_amounts(f"{subject} {email_details.get('snippet') or ''}")
+    if any(amounts_match(wanted, amount) for wanted in amounts for amount in found):
+        return None
+    if any(merchant in sender for merchant in GMAIL_KNOWN_MERCHANT_SENDERS):
+        return None
+    if any(keyword in sender or keyword in subject.lower() for keyword in keywords):
+        return None
+    return 'no amount or merchant match'
+
+def _other_candidate_fields(email_details: Dict[str, Any], reason: str) -> Dict[str, Optional[str]]:
+    """Header-only summary of a search hit whose body was not downloaded."""
+    headers = email_details.get('headers_parsed', {})
+    return {
+        'id': email_details.get('id'),
+        'subject': headers.get('subject'),
+        'from': headers.get('from'),
+        'date': headers.get('date'),
+        'snippet': email_details.get('snippet'),
+        'skipped_reason': reason,
+    }
+
+def _partition_candidates(
+    msg_ids: List[str],
+    emails_by_id: Dict[str, Optional[Dict[str, Any]]],
+    search_query: str
+) -> Tuple[List[str], List[Dict[str, Optional[str]]]]:
+    """Splits search hits into likely receipts (ids, in order) and summaries of the rest."""
+    amounts, keywords = _receipt_hints(search_query)
+    selected: List[str] = []
+    others: List[Dict[str, Optional[str]]] = []
+    for msg_id in msg_ids:
+        email_details = emails_by_id.get(msg_id)
+        if not email_details:
+            continue
+        reason = _skip_reason(email_details, amounts, keywords)
+        if reason is None:
+            selected.append(msg_id)
+        else:
+            others.append(_other_candidate_fields(email_details, reason))
+    return selected, others
+
+def fetch_likely_receipts(
+    service: Any,
+    user_id: str,
+    msg_ids: List[str],
+    search_query: str
+) -> Tuple[Dict[str, Optional[Dict[str, Any]]], List[Dict[str, Optional[str]]]]:
+    """
+    Two-phase fetch: metadata for every hit, full body only for likely receipts.
+    Already cached messages skip the metadata phase.
+
+    Returns:
+        Tuple: (structured emails of likely receipts keyed by id, header-only summaries of the other hits).
+    """
+    cache = get_message_cache()
+    known = cache.get_many(msg_ids) if cache else {}
+    metadata = _fetch_messages(service, user_id, [msg_id for msg_id in msg_ids if msg_id not in known], 'metadata')
+
+    selected, others = _partition_candidates(msg_ids, {**metadata, **known}, search_query)
+
+    fetched = _fetch_messages(service, user_id, [msg_id for msg_id in selected if msg_id not in known])
+    if cache:
+        cache.put_many([email for email in fetched.values() if email])
+    return {msg_id: known.get(msg_id) or fetched.get(msg_id) for msg_id in selected}, others
+
+def get_gmail_emails_by_id(message_ids: List[str]) -> Dict[str, List[Dict[str, Optional[str]]]]:
+    """
+    Fetches the full content of specific emails, e.g. entries from 'other_candidates'
+    of a previous query_gmail_emails_structured result.
+
+    Args:
+        message_ids (List[str]): Gmail message ids.
+
+    Returns:
+        Dict[str, List[Dict[str, Optional[str]]]]: A dict with key 'emails' and a list of dicts, each with keys: id, subject, from, to, body, body_chars_dropped, date.
+    """
+    service = get_gmail_service()
+    if not service:
+        print("Failed to get Gmail service. Aborting fetch.")
+        return {"emails": []}
+    try:
+        details_by_id = fetch_email_details(service, 'me', message_ids)
+    except Exception as e:
+        print(f"An unexpected error occurred fetching emails by id: {e}")
+        return {"emails": []}
+    return {"emails": [_email_result_fields(details_by_id[msg_id]) for msg_id in message_ids if details_by_id.get(msg_id)]}
+
 def query_gmail_emails_structured(
     query: str,
     after: Optional[str] = None,
@@ -290,7 +708,11 @@ def query_gmail_emails_structured(
     max_results: int = 10
 ) -> Dict[str, List[Dict[str, Optional[str]]]]:
     """
-    Queries Gmail for emails and returns them as a dict with key 'emails' and a list of dicts with fields: subject, from, to, body, date.
+    Queries Gmail for emails and returns them as a dict with key 'emails' and a list of dicts with fields: id, subject, from, to, body, body_chars_dropped, date.
+    Long bodies are cut down to the lines around the searched amount, totals, order numbers and merchant names;
+    body_chars_dropped is the number of characters left out.
+    Only likely receipts are downloaded in full; the other hits are listed under 'other_candidates'
+    (id, subject, from, date, snippet, skipped_reason) and can be fetched with get_gmail_emails_by_id.
 
     Args:
         query (str): The Gmail search query string (e.g., 'Apple 99').
@@ -299,56 +721,115 @@ def query_gmail_emails_structured(
         max_results (int): Maximum number of emails to return.
 
     Returns:
-        Dict[str, List[Dict[str, Optional[str]]]]: A dict with key 'emails' and a list of dicts, each with keys: subject, from, to, body, date.
+        Dict[str, List[Dict[str, Optional[str]]]]: A dict with keys 'emails' and 'other_candidates'.
     """
+    search_query = build_search_query(query, after, before)
+    amounts, keywords = _receipt_hints(search_query)
+
+    try:
+        mirrored = search_mirror(search_query, max_results)
+    except Exception as e:
+        print(f"An unexpected error occurred searching the local mirror: {e}")
+        mirrored = None
+    if mirrored is not None:
+        mirrored_by_id = {email_details['id']: email_details for email_details in mirrored}
+        mirrored_ids = [email_details['id'] for email_details in mirrored]
+        if GMAIL_TWO_PHASE_FETCH:
+            selected, other_candidates = _partition_candidates(mirrored_ids, mirrored_by_id, search_query)
+        else:
+            selected, other_candidates = mirrored_ids, []
+        return {
+            "emails": [_email_result_fields(mirrored_by_id[msg_id], amounts, keywords) for msg_id in selected],
+            "other_candidates": other_candidates,
+        }
+
     service = get_gmail_service()
     if not service:
         print("Failed to get Gmail service. Aborting query.")
-        return {"emails": []}
+        return {"emails": [], "other_candidates": []}
 
-    search_query = query
-    if after:
-        search_query += f" after:{after}"
-    if before:
-        search_query += f" before:{before}"
-    
     user_id = 'me'
     emails_list: List[Dict[str, Optional[str]]] = []
+    other_candidates: List[Dict[str, Optional[str]]] = []
 
     try:
-        response = service.users().messages().list(
-            userId=user_id,
-            q=search_query,
-            maxResults=max_results
-        ).execute()
-        
-        message_refs = response.get('messages', [])
+        msg_ids = search_message_ids(service, user_id, search_query, max_results)
         
-        if not message_refs:
+        if not msg_ids:
             print("No emails found matching the query.")
-            return {"emails": []}
+            return {"emails": [], "other_candidates": []}
 
-        for msg_ref in message_refs:
-            msg_id = msg_ref['id']
-            email_details = get_email_details_structured(service, user_id, msg_id)
+        if GMAIL_TWO_PHASE_FETCH:
+            details_by_id, other_candidates = fetch_likely_receipts(service, user_id, msg_ids, search_query)
+        else:
+            details_by_id = fetch_email_details(service, user_id, msg_ids)
+
+        for msg_id in msg_ids:
+            email_details = details_by_id.get(msg_id)
             if email_details:
-                headers = email_details.get('headers_parsed', {})
-                emails_list.append({
-                    'subject': headers.get('subject'),
-                    'from': headers.get('from'),
-                    'to': headers.get('to'),
-                    'body': email_details.get('extracted_body_text'),
-                    'date': headers.get('date'),
-                })
+                emails_list.append(_email_result_fields(email_details, amounts, keywords))
                 
     except HttpError as error:
         print(f"An API error occurred during Gmail query: {error}")
-        return {"emails": []}
+        return {"emails": [], "other_candidates": []}
     except Exception as e:
         print(f"An unexpected error occurred during Gmail query: {e}")
-        return {"emails": []}
+        return {"emails": [], "other_candidates": []}
+
+    return {"emails": emails_list, "other_candidates": other_candidates}
+
+def search_gmail_for_transaction(
+    date: str,
+    amount: str,
+    description: str,
+    max_results: int = 10
+) -> Dict[str, Any]:
+    """
+    Searches Gmail for the receipt of one bank transaction. The query (every rendering of
+    the amount, merchant keywords from the description, +/- a few days around the date)
+    is built by build_gmail_query, so no query has to be written by hand.
+
+    Args:
+        date (str): Booking date, 'YYYY-MM-DD'.
+        amount (str): Amount as on the statement, e.g. '-1 049,12'.
+        description (str): Raw bank description, e.g. 'ICA NARA JAR/25-03-20'.
+        max_results (int): Maximum number of emails to return.
+
+    Returns:
+        Dict[str, Any]: Like query_gmail_emails_structured, plus 'query' (the search string used).
+    """
+    built = build_gmail_query(date, amount, description)
+    if not built['query']:
+        print(f"Could not build a Gmail query: {built['error']}")
+        return {"query": "", "emails": [], "other_candidates": [], "error": built['error']}
+    return {"query": built['query'], **query_gmail_emails_structured(built['query'], max_results=max_results)}
 
-    return {"emails": emails_list}
+def lookup_transaction_receipts(date: str, amount: str, description: str) -> Dict[str, Any]:
+    """
+    Looks up the receipt for one bank transaction without an extra model step: builds the
+    query with build_gmail_query, searches, keeps emails whose amount or sender matches and
+    returns them as compact records with the fields date, amount, company, summary and
+    payment_details (plus id and subject).
+
+    Args:
+        date (str): Booking date, 'YYYY-MM-DD'.
+        amount (str): Amount as on the statement, e.g. '-1 049,12'.
+        description (str): Raw bank description, e.g. 'ICA NARA JAR/25-03-20'.
+
+    Returns:
+        Dict[str, Any]: 'query' (the search string used), 'status' ('success' if a receipt
+        was found, otherwise 'error') and 'emails' (the receipt records, best match first).
+    """
+    built = build_gmail_query(date, amount, description)
+    if not built['query']:
+        print(f"Could not build a Gmail query: {built['error']}")
+        return {"query": "", "status": "error", "emails": [], "error": built['error']}
+    result = query_gmail_emails_structured(built['query'])
+    receipts = select_receipts(
+        result['emails'], parse_amount(amount), built['keywords'],
+        GMAIL_DIRECT_MAX_RECEIPTS, GMAIL_DIRECT_SUMMARY_CHARS,
+    )
+    return {"query": built['query'], "status": "success" if receipts else "error", "emails": receipts}
 
 if __name__ == "__main__":
     print("Gmail Query Tool - Clean Text Output")
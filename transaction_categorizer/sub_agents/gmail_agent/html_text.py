@@ -0,0 +1,329 @@
+import re
+from collections import Counter
+from html.entities import html5 as _HTML5_ENTITIES
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Tags whose whole subtree is dropped from the extracted text.
+_SKIP_TAGS = frozenset(["script", "style", "head", "title", "meta", "link"])
+# Tags that never have content or an end tag (same list BeautifulSoup uses).
+_VOID_TAGS = frozenset([
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr",
+    "image", "img", "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid",
+    "param", "source", "spacer", "track", "wbr",
+])
+# Whitespace-only strings inside these tags are kept as-is.
+_PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+# Text inside these tags is not part of the document text.
+_HIDDEN_TEXT_TAGS = frozenset(["rt", "rp", "template"])
+
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_DECIMAL_REFERENCE = re.compile(r'^(\d+)(.*)$')
+_HEX_REFERENCE = re.compile(r'^([0-9a-fA-F]+)(.*)$')
+
+# Windows-1252 code points that are often (wrongly) used in numeric character references.
+_WINDOWS_1252_REFERENCES = {n: bytes([n]).decode('cp1252') for n in range(0x80, 0xa0)
+                            if n not in (0x81, 0x8d, 0x8f, 0x90, 0x9d)}
+
+# Decides whether anchor text is a URL; see gmail_tool.is_text_clearly_a_url.
+UrlPredicate = Callable[[str, Optional[str]], bool]
+
+
+def normalize_extracted_text(text: str) -> str:
+    """Collapses runs of spaces, strips every line and limits blank lines, as the Gmail tool always has."""
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = "\n".join([line.strip() for line in text.splitlines()])
+    text = re.sub(r'\n\n+', '\n\n', text)
+    return text.strip()
+
+
+def _anchor_replacement(text_from_anchor: str, alt_text: Optional[str], href: str,
+                        is_url: UrlPredicate) -> str:
+    """Builds the '[Link text] ' string an <a href> is replaced with."""
+    display_text_for_brackets = "Link"  # Default to "[Link]"
+    if text_from_anchor:
+        if not is_url(text_from_anchor, href):
+            display_text_for_brackets = text_from_anchor
+    # If display_text is still "Link", try alt text from image
+    if display_text_for_brackets == "Link" and alt_text:
+        alt_text = alt_text.strip()
+        if alt_text and not is_url(alt_text, href):
+            display_text_for_brackets = alt_text
+    return f"[{display_text_for_brackets}] "
+
+
+def html_to_text_bs4(html: str, is_url: UrlPredicate) -> str:
+    """Reference engine: builds a full BeautifulSoup tree and rewrites it."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    for unwanted_tag in soup(["script", "style", "head", "title", "meta", "link"]):
+        unwanted_tag.decompose()
+
+    for a_tag in soup.find_all('a', href=True):
+        actual_href = a_tag.get('href', '')
+        text_from_anchor = a_tag.get_text(strip=True)
+        img_tag = a_tag.find('img', alt=True)
+        alt_text = img_tag.get('alt', '') if img_tag else None
+        replacement_string = _anchor_replacement(text_from_anchor, alt_text, actual_href, is_url)
+        a_tag.replace_with(soup.new_string(replacement_string))
+
+    return normalize_extracted_text(soup.get_text(separator=' ', strip=False))
+
+
+class _StreamingTextExtractor(HTMLParser):
+    """
+    Single-pass text extractor that reproduces the BeautifulSoup engine's output.
+
+    It tracks only the stack of open tag names (with the same implicit-close rules
+    as BeautifulSoup's html.parser builder) and emits text strings as they end,
+    so no tree is ever built.
+    """
+
+    def __init__(self, is_url: UrlPredicate):
+        super().__init__(convert_charrefs=False)
+        self.is_url = is_url
+        self.strings: List[str] = []
+        self._data: List[str] = []
+        self._stack: List[str] = []
+        self._open_counts: Dict[str, int] = {}
+        self._skip_depth = 0
+        self._preserve_depth = 0
+        self._hidden_depth = 0
+        # Outermost open <a href>: (stack depth, href, collected text, first img alt).
+        self._anchor: Optional[Tuple[int, str, List[str], Optional[str]]] = None
+        self._anchor_alt_seen = False
+        # Void tags closed implicitly; a later explicit end tag for them is ignored outright.
+        # A multiset, since only how many of each tag are still unmatched matters.
+        self._already_closed_void: Counter = Counter()
+
+    # --- Stack bookkeeping ---
+
+    def _push(self, tag: str) -> None:
+        self._stack.append(tag)
+        self._open_counts[tag] = self._open_counts.get(tag, 0) + 1
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve_depth += 1
+        if tag in _HIDDEN_TEXT_TAGS:
+            self._hidden_depth += 1
+
+    def _pop(self) -> None:
+        tag = self._stack.pop()
+        self._open_counts[tag] -= 1
+        if tag in _SKIP_TAGS:
+            self._skip_depth -= 1
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve_depth -= 1
+        if tag in _HIDDEN_TEXT_TAGS:
+            self._hidden_depth -= 1
+        if self._anchor is not None and len(self._stack) < self._anchor[0]:
+            self._close_anchor()
+
+    def _close_anchor(self) -> None:
+        _, href, text_parts, alt_text = self._anchor
+        self._anchor = None
+        self.strings.append(_anchor_replacement("".join(text_parts), alt_text, href, self.is_url))
+
+    # --- Text ---
+
+    def _emit(self, text: str, is_cdata: bool = False) -> None:
+        if not text or self._skip_depth:
+            return
+        if self._hidden_depth and not is_cdata:
+            return
+        if self._anchor is not None:
+            stripped = text.strip()
+            if stripped:
+                self._anchor[2].append(stripped)
+        else:
+            self.strings.append(text)
+
+    def _flush(self) -> None:
+        if not self._data:
+            return
+        text = "".join(self._data)
+        self._data = []
+        if not self._preserve_depth and not text.strip(_ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        self._emit(text)
+
+    # --- HTMLParser callbacks ---
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self._flush()
+        if self._skip_depth == 0:
+            if tag == 'a' and self._anchor is None:
+                attr_dict = {key: value for key, value in attrs}
+                if 'href' in attr_dict:
+                    self._anchor = (len(self._stack) + 1, attr_dict['href'] or '', [], None)
+                    self._anchor_alt_seen = False
+            elif tag == 'img' and self._anchor is not None and not self._anchor_alt_seen:
+                attr_dict = {key: value for key, value in attrs}
+                if 'alt' in attr_dict:
+                    self._anchor_alt_seen = True
+                    depth, href, text_parts, _ = self._anchor
+                    self._anchor = (depth, href, text_parts, attr_dict['alt'] or '')
+        self._push(tag)
+        if tag in _VOID_TAGS:
+            self._pop()
+            self._already_closed_void[tag] += 1
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag in _VOID_TAGS:
+            # '<br/>' closes itself; it must not swallow a later '</br>'.
+            self._already_closed_void[tag] -= 1
+        else:
+            self._end_tag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._already_closed_void[tag] > 0:
+            self._already_closed_void[tag] -= 1
+            return
+        self._end_tag(tag)
+
+    def _end_tag(self, tag: str) -> None:
+        self._flush()
+        if not self._open_counts.get(tag):
+            return
+        while self._stack:
+            popped = self._stack[-1]
+            self._pop()
+            if popped == tag:
+                break
+
+    def handle_data(self, data: str) -> None:
+        self._data.append(data)
+
+    def handle_entityref(self, name: str) -> None:
+        character = _HTML5_ENTITIES.get(name + ';')
+        self._data.append(character if character is not None else f"&{name}")
+
+    def handle_charref(self, name: str) -> None:
+        base, pattern = 10, _DECIMAL_REFERENCE
+        if name[:1] in ('x', 'X'):
+            name, base, pattern = name[1:], 16, _HEX_REFERENCE
+        extra_data = ""
+        try:
+            number: Optional[int] = int(name, base)
+        except ValueError:
+            match = pattern.match(name)
+            number = int(match.group(1), base) if match else None
+            extra_data = match.group(2) if match else name
+        if number is not None:
+            if number == 0 or number > 0x10ffff or 0xd800 <= number <= 0xdfff:
+                self._data.append("�")
+            else:
+                self._data.append(_WINDOWS_1252_REFERENCES.get(number) or chr(number))
+        if extra_data:
+            self._data.append(extra_data)
+
+    def handle_comment(self, data: str) -> None:
+        self._flush()
+
+    def handle_decl(self, decl: str) -> None:
+        self._flush()
+
+    def handle_pi(self, data: str) -> None:
+        self._flush()
+
+    def unknown_decl(self, data: str) -> None:
+        self._flush()
+        if data.upper().startswith("CDATA["):
+            self._emit(data[len("CDATA["):], is_cdata=True)
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+        while self._stack:
+            self._pop()
+        if self._anchor is not None:
+            self._close_anchor()
+
+
+def html_to_text_stdlib(html: str, is_url: UrlPredicate) -> str:
+    """Streaming engine built on html.parser.HTMLParser; no tree is built."""
+    extractor = _StreamingTextExtractor(is_url)
+    extractor.feed(html)
+    extractor.close()
+    return normalize_extracted_text(" ".join(extractor.strings))
+
+
+def html_to_text_lxml(html: str, is_url: UrlPredicate) -> str:
+    """
+    lxml engine: parses with libxml2 and walks the tree once.
+    libxml2 repairs malformed markup differently from html.parser, so on broken
+    HTML the output can differ from the other engines in whitespace or structure.
+    """
+    import lxml.html
+
+    try:
+        root = lxml.html.document_fromstring(html)
+    except Exception:
+        # Empty documents, encoding declarations in str input, etc.
+        return html_to_text_stdlib(html, is_url)
+    strings: List[str] = []
+
+    def _text_of(element, parts: List[str]) -> None:
+        if element.text and element.text.strip():
+            parts.append(element.text.strip())
+        for child in element:
+            if isinstance(child.tag, str) and child.tag not in _SKIP_TAGS:
+                _text_of(child, parts)
+            if child.tail and child.tail.strip():
+                parts.append(child.tail.strip())
+
+    def _collapse(text: Optional[str]) -> Optional[str]:
+        if text and not text.strip(_ASCII_SPACES):
+            return "\n" if "\n" in text else " "
+        return text
+
+    def _walk(element) -> None:
+        tag = element.tag if isinstance(element.tag, str) else None
+        if tag in _SKIP_TAGS:
+            return
+        if tag == 'a' and element.get('href') is not None:
+            parts: List[str] = []
+            _text_of(element, parts)
+            img = next((img for img in element.iter('img') if img.get('alt') is not None), None)
+            strings.append(_anchor_replacement(
+                "".join(parts), img.get('alt') if img is not None else None, element.get('href'), is_url
+            ))
+            return
+        if tag is not None and tag not in _HIDDEN_TEXT_TAGS:
+            text = _collapse(element.text)
+            if text:
+                strings.append(text)
+            for child in element:
+                _walk(child)
+                tail = _collapse(child.tail)
+                if tail:
+                    strings.append(tail)
+
+    _walk(root)
+    return normalize_extracted_text(" ".join(strings))
+
+
+HTML_ENGINES: Dict[str, Callable[[str, UrlPredicate], str]] = {
+    "bs4": html_to_text_bs4,
+    "stdlib": html_to_text_stdlib,
+    "lxml": html_to_text_lxml,
+}
+
+
+def get_html_engine(name: str) -> Callable[[str, UrlPredicate], str]:
+    """Returns the named engine, falling back to 'stdlib' if it is unknown or its parser is not installed."""
+    engine = HTML_ENGINES.get(name)
+    if engine is None:
+        print(f"Unknown HTML engine '{name}', using 'stdlib'.")
+        return html_to_text_stdlib
+    if name == "lxml":
+        try:
+            import lxml.html  # noqa: F401
+        except ImportError:
+            print("lxml is not installed, using the 'stdlib' HTML engine.")
+            return html_to_text_stdlib
+    return engine
@@ -0,0 +1,86 @@
+import re
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+from .body_compaction import compact_body, sender_display_name
+from ...amounts import amounts_match, find_amounts, format_amount
+
+# Payment providers as they appear in receipts, with the name returned for them.
+_PAYMENT_PROVIDERS = [
+    (re.compile(r'\bapple\s*pay\b', re.IGNORECASE), 'Apple Pay'),
+    (re.compile(r'\bgoogle\s*pay\b', re.IGNORECASE), 'Google Pay'),
+    (re.compile(r'\bpaypal\b', re.IGNORECASE), 'PayPal'),
+    (re.compile(r'\bklarna\b', re.IGNORECASE), 'Klarna'),
+    (re.compile(r'\bswish\b', re.IGNORECASE), 'Swish'),
+    (re.compile(r'\brevolut\b', re.IGNORECASE), 'Revolut'),
+    (re.compile(r'\bfirst\s*card\b', re.IGNORECASE), 'FirstCard'),
+    (re.compile(r'\bstrawberry\b', re.IGNORECASE), 'Strawberry'),
+    (re.compile(r'\bnordea\b', re.IGNORECASE), 'Nordea'),
+    (re.compile(r'\bseb\b', re.IGNORECASE), 'SEB'),
+]
+_CARD_PATTERN = re.compile(
+    r'\b(mastercard|visa|amex|american express)\b(?:[^\n\d*•]{0,20}((?:\*|•){2,}\s?\d{4}))?', re.IGNORECASE
+)
+
+
+def _email_date(value: Optional[str]) -> str:
+    try:
+        return parsedate_to_datetime(value).date().isoformat()
+    except (TypeError, ValueError, IndexError):
+        return value or ''
+
+
+def payment_details(text: str) -> str:
+    """Names the payment method mentioned in a receipt ('PayPal', 'Mastercard ****6442', ...) or 'Unknown'."""
+    for pattern, name in _PAYMENT_PROVIDERS:
+        if pattern.search(text):
+            return name
+    card = _CARD_PATTERN.search(text)
+    if card:
+        return " ".join(part for part in (card.group(1).title(), card.group(2)) if part)
+    return 'Unknown'
+
+
+def receipt_record(email: Dict[str, Any], amount_ore: int, keywords: List[str], summary_chars: int) -> Dict[str, Any]:
+    """
+    Turns one email from query_gmail_emails_structured into the EmailContent fields
+    (date, amount, company, summary, payment_details) plus id and subject.
+    The amount is the one in the email that matches the transaction, if any.
+    """
+    subject = email.get('subject') or ''
+    body = email.get('body') or ''
+    text = f"{subject}\n{body}"
+    matched = next((found for found in find_amounts(text) if amounts_match(amount_ore, found)), None)
+    company = sender_display_name(email.get('from')) or (email.get('from') or '')
+    summary, _ = compact_body(body, [amount_ore], list(keywords), summary_chars, head_lines=1, context_lines=1)
+    return {
+        'id': email.get('id'),
+        'subject': subject,
+        'date': _email_date(email.get('date')),
+        'amount': format_amount(abs(matched)).replace(' ', '') if matched is not None else '',
+        'company': company,
+        'summary': " ".join(summary.split()),
+        'payment_details': payment_details(text),
+    }
+
+
+def select_receipts(
+    emails: List[Dict[str, Any]],
+    amount_ore: int,
+    keywords: List[str],
+    max_receipts: int,
+    summary_chars: int
+) -> List[Dict[str, Any]]:
+    """
+    Keeps the emails that look like the receipt for the transaction: the amount matches,
+    or a merchant keyword is in the sender or subject. Amount matches come first; search
+    order (newest first) is kept otherwise.
+    """
+    scored = []
+    for position, email in enumerate(emails):
+        record = receipt_record(email, amount_ore, keywords, summary_chars)
+        header = f"{email.get('from') or ''} {record['subject']}".lower()
+        score = (2 if record['amount'] else 0) + (1 if any(keyword in header for keyword in keywords) else 0)
+        if score:
+            scored.append((-score, position, record))
+    return [record for _, _, record in sorted(scored, key=lambda item: item[:2])[:max_receipts]]
@@ -0,0 +1,324 @@
+import json
+import re
+import sys
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from .config import TOKEN_ACCOUNTING_ENABLED, TOKEN_LEDGER_PATH
+from .instrumentation import count
+
+# Prompt sources. Tool results are kept apart per tool as "tool_result:<tool name>".
+SYSTEM_INSTRUCTION = "system_instruction"
+CATEGORY_LIST = "category_list"
+HINTS = "hints"
+TOOL_DECLARATIONS = "tool_declarations"
+USER_MESSAGE = "user_message"
+HISTORY = "history"  # The model's own earlier turns: text and function calls
+TOOL_RESULT_PREFIX = "tool_result:"
+
+# One entry of the category list: "- **Bensin:** Gas for car, e.g. OKQ8, CircleK etc."
+_CATEGORY_LINE_PATTERN = re.compile(r'^\s*- \*\*.+?:\*\*.*$', re.MULTILINE)
+# The memo and history kNN hints are appended to the instruction as "Hint: ..." paragraphs.
+_HINT_PREFIX = "Hint:"
+# Pieces the approximation counts: letter runs, up to three digits, single symbols.
+_TOKEN_PIECE_PATTERN = re.compile(r'[^\W\d_]+|\d{1,3}|[^\w\s]|_')
+_CHARS_PER_WORD_TOKEN = 4
+# A long-running server keeps only the latest accounts in memory (the file keeps all).
+MAX_ACCOUNTS_IN_MEMORY = 10000
+
+
+@lru_cache(maxsize=1024)
+def approx_tokens(text: str) -> int:
+    """
+    Offline approximation of the model's token count for text.
+
+    Letter runs count one token per four characters (at least one), digits one per
+    group of three and every symbol one. Good enough to rank contributors, not to bill;
+    the report compares it with the model's reported counts when there are any.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECE_PATTERN.findall(text):
+        if piece[0].isalpha():
+            tokens += -(-len(piece) // _CHARS_PER_WORD_TOKEN)
+        else:
+            tokens += 1
+    return tokens
+
+
+def _json_text(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _instruction_text(system_instruction: Any) -> str:
+    if system_instruction is None:
+        return ""
+    if isinstance(system_instruction, str):
+        return system_instruction
+    return "".join(part.text or "" for part in getattr(system_instruction, "parts", None) or [])
+
+
+def split_instruction(text: str) -> Dict[str, int]:
+    """Approximate tokens of a system instruction, split into instruction, category list and hints."""
+    tokens: Counter = Counter()
+    for paragraph in text.split("\n\n"):
+        if paragraph.lstrip().startswith(_HINT_PREFIX):
+            tokens[HINTS] += approx_tokens(paragraph)
+            continue
+        category_lines = _CATEGORY_LINE_PATTERN.findall(paragraph)
+        category_tokens = sum(approx_tokens(line) for line in category_lines)
+        tokens[CATEGORY_LIST] += category_tokens
+        tokens[SYSTEM_INSTRUCTION] += max(approx_tokens(paragraph) - category_tokens, 0)
+    return {source: value for source, value in tokens.items() if value}
+
+
+def split_request(llm_request: Any) -> Dict[str, int]:
+    """Approximate prompt tokens of an LlmRequest by source."""
+    config = llm_request.config
+    tokens: Counter = Counter(split_instruction(_instruction_text(getattr(config, "system_instruction", None))))
+    for tool in getattr(config, "tools", None) or []:
+        for declaration in getattr(tool, "function_declarations", None) or []:
+            tokens[TOOL_DECLARATIONS] += approx_tokens(_json_text(declaration.model_dump(exclude_none=True, mode="json")))
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.function_response is not None:
+                response = part.function_response
+                tokens[TOOL_RESULT_PREFIX + (response.name or "unknown")] += approx_tokens(_json_text(response.response))
+            elif part.function_call is not None:
+                tokens[HISTORY] += approx_tokens(_json_text({"name": part.function_call.name, "args": part.function_call.args}))
+            elif part.text:
+                tokens[USER_MESSAGE if content.role == "user" else HISTORY] += approx_tokens(part.text)
+    return dict(tokens)
+
+
+def _response_text(llm_response: Any) -> str:
+    content = llm_response.content
+    if content is None or not content.parts:
+        return ""
+    pieces = []
+    for part in content.parts:
+        if part.function_call is not None:
+            pieces.append(_json_text({"name": part.function_call.name, "args": part.function_call.args}))
+        elif part.text:
+            pieces.append(part.text)
+    return "".join(pieces)
+
+
+@dataclass
+class ModelCallAccount:
+    """Tokens of one model call. The reported_ counts come from the model's usage metadata, when it has any."""
+    agent: str
+    prompt_tokens: Dict[str, int]
+    output_tokens: int = 0
+    reported_prompt_tokens: Optional[int] = None
+    reported_output_tokens: Optional[int] = None
+
+    @property
+    def total_prompt_tokens(self) -> int:
+        return sum(self.prompt_tokens.values())
+
+
+@dataclass
+class TransactionAccount:
+    """All model calls made for one transaction (the root agent's and the nested gmail_agent's)."""
+    message: str
+    calls: List[ModelCallAccount] = field(default_factory=list)
+
+    def prompt_tokens_by_source(self) -> Counter:
+        tokens: Counter = Counter()
+        for call in self.calls:
+            tokens.update(call.prompt_tokens)
+        return tokens
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call.total_prompt_tokens for call in self.calls)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(call.output_tokens for call in self.calls)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"message": self.message, "calls": [asdict(call) for call in self.calls]}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TransactionAccount":
+        return cls(data["message"], [ModelCallAccount(**call) for call in data.get("calls") or []])
+
+
+class TokenLedger:
+    """
+    The accounts of finished transactions. Kept in memory for the batch report and,
+    if a path is given, appended to it as JSON lines for reports across runs.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self.accounts: Deque[TransactionAccount] = deque(maxlen=MAX_ACCOUNTS_IN_MEMORY)
+        self._lock = threading.Lock()
+
+    def add(self, account: TransactionAccount) -> None:
+        with self._lock:
+            self.accounts.append(account)
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(account.to_json(), ensure_ascii=False) + "\n")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.accounts.clear()
+
+
+def load_ledger(path: Path) -> List[TransactionAccount]:
+    with open(path, encoding="utf-8") as f:
+        return [TransactionAccount.from_json(json.loads(line)) for line in f if line.strip()]
+
+
+_ledger: Optional[TokenLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_token_ledger() -> Optional[TokenLedger]:
+    """Returns the process-wide token ledger, or None if token accounting is disabled."""
+    global _ledger
+    if not TOKEN_ACCOUNTING_ENABLED:
+        return None
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = TokenLedger(TOKEN_LEDGER_PATH)
+    return _ledger
+
+
+# --- ADK callbacks ---
+
+# The transaction whose model calls are being accounted. The gmail_agent runs inside the
+# root agent's tool call and sees the same account.
+_account: ContextVar[Optional[TransactionAccount]] = ContextVar("token_account", default=None)
+# Model calls waiting for their response, per agent.
+_pending: ContextVar[Optional[Dict[str, ModelCallAccount]]] = ContextVar("token_account_pending", default=None)
+
+
+def begin_token_account(callback_context: Any) -> None:
+    """before_agent_callback of the root agent."""
+    if get_token_ledger() is None:
+        return None
+    user_content = callback_context.user_content
+    message = "".join(part.text or "" for part in (user_content.parts or [])) if user_content is not None else ""
+    _account.set(TransactionAccount(message.strip()))
+    _pending.set({})
+    return None
+
+
+def finish_token_account(callback_context: Any) -> None:
+    """after_agent_callback of the root agent. Transactions answered without a model call are not recorded."""
+    account = _account.get()
+    ledger = get_token_ledger()
+    _account.set(None)
+    if account is not None and account.calls and ledger is not None:
+        ledger.add(account)
+    return None
+
+
+def account_model_request(callback_context: Any, llm_request: Any) -> None:
+    """before_model_callback; must come after any callback that appends to the instruction."""
+    account = _account.get()
+    pending = _pending.get()
+    if account is None or pending is None:
+        return None
+    call = ModelCallAccount(callback_context.agent_name, split_request(llm_request))
+    account.calls.append(call)
+    pending[call.agent] = call
+    for source, tokens in call.prompt_tokens.items():
+        count("prompt_tokens_total", tokens, source=source, agent=call.agent)
+    return None
+
+
+def account_model_response(callback_context: Any, llm_response: Any) -> None:
+    """after_model_callback: the call's output tokens, and the model's own counts when reported."""
+    pending = _pending.get()
+    if pending is None or getattr(llm_response, "partial", False):
+        return None
+    call = pending.pop(callback_context.agent_name, None)
+    if call is None:
+        return None
+    call.output_tokens = approx_tokens(_response_text(llm_response))
+    usage = getattr(llm_response, "usage_metadata", None)
+    if usage is not None:
+        call.reported_prompt_tokens = usage.prompt_token_count
+        call.reported_output_tokens = usage.candidates_token_count
+    count("output_tokens_total", call.output_tokens, agent=call.agent)
+    return None
+
+
+# --- Report ---
+
+def _source_group(source: str) -> str:
+    return "tool_results" if source.startswith(TOOL_RESULT_PREFIX) else source
+
+
+def format_report(accounts: Iterable[TransactionAccount], top: int = 5) -> str:
+    """Ranks the prompt sources (and the transactions) by approximate tokens over a batch."""
+    accounts = list(accounts)
+    if not accounts:
+        return "No model calls were accounted."
+    by_source: Counter = Counter()
+    by_agent: Counter = Counter()
+    for account in accounts:
+        by_source.update(account.prompt_tokens_by_source())
+        for call in account.calls:
+            by_agent[call.agent] += call.total_prompt_tokens
+    calls = [call for account in accounts for call in account.calls]
+    prompt_total = sum(by_source.values())
+    output_total = sum(call.output_tokens for call in calls)
+
+    lines = [
+        f"{len(accounts)} transactions, {len(calls)} model calls, ~{prompt_total} prompt and "
+        f"~{output_total} output tokens (~{prompt_total // len(accounts)} prompt tokens per transaction).",
+        "",
+        f"{'prompt source':<44} {'tokens':>9} {'share':>6} {'/txn':>7}",
+    ]
+    groups: Counter = Counter()
+    for source, tokens in by_source.items():
+        groups[_source_group(source)] += tokens
+    for group, tokens in groups.most_common():
+        lines.append(f"{group:<44} {tokens:>9} {tokens / prompt_total:>6.1%} {tokens / len(accounts):>7.0f}")
+        if group == "tool_results":
+            for source, source_tokens in by_source.most_common():
+                if source.startswith(TOOL_RESULT_PREFIX):
+                    lines.append(f"  {source[len(TOOL_RESULT_PREFIX):]:<42} {source_tokens:>9} "
+                                 f"{source_tokens / prompt_total:>6.1%} {source_tokens / len(accounts):>7.0f}")
+    lines.append(f"{'output':<44} {output_total:>9}")
+    lines.append("")
+    lines.append("prompt tokens by agent: " + ", ".join(f"{agent} {tokens}" for agent, tokens in by_agent.most_common()))
+
+    reported = [call for call in calls if call.reported_prompt_tokens]
+    if reported:
+        ratio = sum(call.reported_prompt_tokens for call in reported) / max(sum(call.total_prompt_tokens for call in reported), 1)
+        lines.append(f"model-reported prompt tokens are {ratio:.2f}x the approximation ({len(reported)} calls).")
+
+    lines.append("")
+    lines.append(f"largest transactions (top {min(top, len(accounts))}):")
+    for account in sorted(accounts, key=lambda account: account.prompt_tokens, reverse=True)[:top]:
+        source, tokens = account.prompt_tokens_by_source().most_common(1)[0]
+        lines.append(f"  {account.prompt_tokens:>7} tokens, {len(account.calls)} calls, mostly {source} ({tokens}): "
+                     f"{account.message[:60]}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m transaction_categorizer.token_accounting [token_ledger.jsonl]
+    # python -m transaction_categorizer.token_accounting --text "some prompt text"
+    if len(sys.argv) > 2 and sys.argv[1] == "--text":
+        print(approx_tokens(sys.argv[2]))
+        sys.exit(0)
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else TOKEN_LEDGER_PATH
+    if not source:
+        print("Give a token ledger file, or set TOKEN_LEDGER_PATH.")
+        sys.exit(1)
+    print(format_report(load_ledger(source)))
@@ -0,0 +1,104 @@
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .amounts import format_amount, parse_amount
+from .config import ACCOUNT_NAME_MAP, DEFAULT_STATUS, PLACEHOLDER_CATEGORY, TARGET_COLUMNS
+
+# A statement row as pasted into a message, e.g.
+# "2025-03-11\t5484654361\tEASYPARK    /25-03-11\t-34,50\t23 035,62" or
+# "Categorize this: 2025-03-19    5484689546      BARBER & BOO/25-03-18   -964,00 22 100,62".
+# The amount is the first number with two decimals after the description; a trailing balance is ignored.
+_TRANSACTION_PATTERN = re.compile(
+    r'(?P<date>\d{4}-\d{2}-\d{2})\s+'
+    r'(?:(?P<reference>\d{5,})\s+)?'
+    r'(?P<description>\S.*?)\s+'
+    r'(?P<amount>-?\d{1,3}(?:[ \u00a0\u202f]\d{3})+,\d{2}|-?\d+[.,]\d{2})(?!\d)'
+)
+
+
+@dataclass(slots=True)
+class Transaction:
+    """One statement row: booking date, raw bank description and amount in öre (negative = outflow)."""
+    date: datetime.date
+    description: str
+    amount_ore: int
+    reference: Optional[str] = None
+    account: Optional[str] = None  # Sheet account name, e.g. ACCOUNT_NAME_MAP["seb"]
+
+    @property
+    def outflow_ore(self) -> int:
+        return -self.amount_ore if self.amount_ore < 0 else 0
+
+    @property
+    def inflow_ore(self) -> int:
+        return self.amount_ore if self.amount_ore > 0 else 0
+
+    def to_target_row(self, category: str = PLACEHOLDER_CATEGORY) -> Dict[str, str]:
+        """The row as TARGET_COLUMNS values: amounts as "1049,12" (empty when zero), Memo = raw description."""
+        row = {
+            'Date': self.date.isoformat(),
+            'Outflow': _sheet_amount(self.outflow_ore),
+            'Inflow': _sheet_amount(self.inflow_ore),
+            'Category': category,
+            'Account': self.account or '',
+            'Memo': self.description,
+            'Status': DEFAULT_STATUS,
+        }
+        return {column: row[column] for column in TARGET_COLUMNS}
+
+
+def _sheet_amount(ore: int) -> str:
+    return format_amount(ore).replace(' ', '') if ore else ''
+
+
+def account_display_name(account: str) -> str:
+    """Maps a short account name ("seb") to its sheet name via ACCOUNT_NAME_MAP; unknown names pass through."""
+    return ACCOUNT_NAME_MAP.get(account.lower(), account)
+
+
+def transaction_from_target_row(row: Dict[str, str]) -> Optional[Transaction]:
+    """The inverse of Transaction.to_target_row: Memo is the description. None if date or amount is unusable."""
+    try:
+        date = datetime.date.fromisoformat((row.get('Date') or '').strip()[:10])
+    except ValueError:
+        return None
+    outflow = parse_amount(row['Outflow']) if (row.get('Outflow') or '').strip() else 0
+    inflow = parse_amount(row['Inflow']) if (row.get('Inflow') or '').strip() else 0
+    if outflow is None or inflow is None or not (row.get('Memo') or '').strip():
+        return None
+    return Transaction(
+        date=date,
+        description=row['Memo'].strip(),
+        amount_ore=abs(inflow) - abs(outflow),
+        account=(row.get('Account') or '').strip() or None,
+    )
+
+
+def parse_transaction_message(text: str) -> Optional[Transaction]:
+    """Finds a statement row in a free-text message. Returns None if the message does not contain one."""
+    match = _TRANSACTION_PATTERN.search(text or '')
+    if not match:
+        return None
+    amount = parse_amount(match.group('amount'))
+    if amount is None:
+        return None
+    try:
+        date = datetime.date.fromisoformat(match.group('date'))
+    except ValueError:
+        return None
+    return Transaction(
+        date=date,
+        description=match.group('description').strip(),
+        amount_ore=amount,
+        reference=match.group('reference'),
+    )
+
+
+def format_transaction_message(transaction: Transaction) -> str:
+    """Builds the chat message the root agent expects for one statement row."""
+    fields = [transaction.date.isoformat(), transaction.description, format_amount(transaction.amount_ore)]
+    if transaction.account:
+        fields.append(transaction.account)
+    return "Categorize this: " + "\t".join(fields)